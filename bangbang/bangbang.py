@@ -15,7 +15,7 @@ def main():
         epilog="See the README for more information.",
         prog="bangbang",
     )
-    parser.add_argument("host", help="Provide a host to bind to")
+    parser.add_argument("host", nargs="?", help="Provide a host to bind to")
     parser.add_argument("-m", "--no-music", help="Disable music", action="store_true"),
     parser.add_argument(
         "-v",
@@ -31,8 +31,35 @@ def main():
         action="store_true",
         default=False,
     )
+    parser.add_argument(
+        "-t",
+        "--transport",
+        help="How to send game traffic once connected (default: websocket)",
+        choices=("websocket", "udp", "tcp"),
+        default="websocket",
+    )
+    parser.add_argument(
+        "-s",
+        "--spectate",
+        help="Watch a match through the relay at host instead of playing",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "-r",
+        "--replay",
+        help="Play back a match recorded with server.py --record instead of connecting",
+        metavar="FILE",
+    )
+    parser.add_argument(
+        "--trace",
+        help="Save a timeline of the last frames to this file on exit; see tracing.py",
+        metavar="FILE",
+    )
 
     args = parser.parse_args()
+    if args.host is None and args.replay is None and not args.version:
+        parser.error("a host is required unless --replay is used")
 
     if args.version:
         print("Bang Bang " + constants.VERSION + "\n")
@@ -56,7 +83,17 @@ def main():
         return
 
     try:
-        asyncio.run(game.main(args.host, args.no_music, args.debug))
+        asyncio.run(
+            game.main(
+                args.host,
+                args.no_music,
+                args.debug,
+                args.transport,
+                args.spectate,
+                args.replay,
+                args.trace,
+            )
+        )
     except KeyboardInterrupt:
         pass
 
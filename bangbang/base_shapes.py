@@ -1,11 +1,27 @@
 import time
 
 
+def now() -> float:
+    """
+    Return the time shapes animate by.
+
+    This is time.time(), except during a replay, which replaces this function so it
+    can pause, speed up, and rewind time.
+    """
+    return time.time()
+
+
 class Timer:
     """Class to keep track of elapsed time between two update calls."""
 
+    # whether to ignore replays and always use real time
+    real_time = False
+
     def __init__(self) -> None:
-        self.clock = time.time()
+        self.clock = self._now()
+
+    def _now(self) -> float:
+        return time.time() if self.real_time else now()
 
     def delta_time(self) -> float:
         """
@@ -14,7 +30,7 @@ class Timer:
         If delta_time is being called for the first time, return the time since
         __init__ was called.
         """
-        new_time = time.time()
+        new_time = self._now()
         diff = new_time - self.clock
         self.clock = new_time
         return diff
@@ -30,6 +30,28 @@ def is_message_valid(message: Message) -> None:
     if "id" in message and not isinstance(message["id"], int):
         raise ValueError("client id is not int")
 
+    # hidden must be a list of tank ids
+    if "hidden" in message and not all(isinstance(i, int) for i in message["hidden"]):
+        raise ValueError("hidden is not a list of int")
+
+    # seq and ack must be int
+    for key in ("seq", "ack"):
+        if key in message and not isinstance(message[key], int):
+            raise ValueError(f"{key} is not int")
+
+    # token must be str
+    if "token" in message and not isinstance(message["token"], str):
+        raise ValueError("token is not str")
+
+    # times must be numbers
+    for key in ("time", "client_time", "server_time"):
+        if key in message and not isinstance(message[key], (int, float)):
+            raise ValueError(f"{key} is not a number")
+
+    # rtt must be a number or None
+    if message.get("rtt") is not None and not isinstance(message["rtt"], (int, float)):
+        raise ValueError("rtt is not a number")
+
     # name must be str
     if "name" in message and not isinstance(message["name"], str):
         raise ValueError("client name is not str")
@@ -42,9 +64,9 @@ def is_message_valid(message: Message) -> None:
 
     # type-specific requirements
     match message["type"]:
-        # APPROVE must have id, state
+        # APPROVE must have states, time
         case constants.Msg.APPROVE:
-            for must_have in ("id", "state"):
+            for must_have in ("states", "time"):
                 if must_have not in message:
                     raise ValueError(f"APPROVE message does not have {must_have}")
 
@@ -56,31 +78,57 @@ def is_message_valid(message: Message) -> None:
         case constants.Msg.GREET if "name" not in message:
             raise ValueError("GREET message does not have name")
 
-        # MINE must have id, pos
+        # MINE must have id, pos, time
         case constants.Msg.MINE:
-            for must_have in ("id", "pos"):
+            for must_have in ("id", "pos", "time"):
                 if must_have not in message:
                     raise ValueError(f"MINE message does not have {must_have}")
 
-        # REQUEST must have actions
-        case constants.Msg.REQUEST if "actions" not in message:
-            raise ValueError("REQUEST message does not have actions")
+        # REQUEST must have actions, seq
+        case constants.Msg.REQUEST:
+            for must_have in ("actions", "seq"):
+                if must_have not in message:
+                    raise ValueError(f"REQUEST message does not have {must_have}")
 
-        # SHELL must have angle, id, pos
+        # SHELL must have angle, id, pos, time
         case constants.Msg.SHELL:
-            for must_have in ("angle", "id", "pos"):
+            for must_have in ("angle", "id", "pos", "time"):
                 if must_have not in message:
                     raise ValueError(f"SHELL message does not have {must_have}")
 
-        # SHELL_DIE must have explo, shell_id
+        # SHELL_DIE must have explo, shell_id, time
         case constants.Msg.SHELL_DIE:
-            for must_have in ("explo", "shell_id"):
+            for must_have in ("explo", "shell_id", "time"):
                 if must_have not in message:
                     raise ValueError(f"SHELL_DIE message does not have {must_have}")
 
+        # PING must have client_time, rtt
+        case constants.Msg.PING:
+            for must_have in ("client_time", "rtt"):
+                if must_have not in message:
+                    raise ValueError(f"PING message does not have {must_have}")
+
+        # PONG must have client_time, server_time
+        case constants.Msg.PONG:
+            for must_have in ("client_time", "server_time"):
+                if must_have not in message:
+                    raise ValueError(f"PONG message does not have {must_have}")
+
+        # RESUME must have token
+        case constants.Msg.RESUME if "token" not in message:
+            raise ValueError("RESUME message does not have token")
+
+        # SNAPSHOT must have data
+        case constants.Msg.SNAPSHOT if "data" not in message:
+            raise ValueError("SNAPSHOT message does not have data")
+
+        # SUBSCRIBE must have key
+        case constants.Msg.SUBSCRIBE if "key" not in message:
+            raise ValueError("SUBSCRIBE message does not have key")
+
         # START must have ...
         case constants.Msg.START:
-            for must_have in ("ground_hw", "hill_poses", "tree_poses", "states"):
+            for must_have in ("ground_hw", "map", "states"):
                 if must_have not in message:
                     raise ValueError(f"START message does not have {must_have}")
 
@@ -98,6 +146,14 @@ class _BBSharedProtocol:
         is_message_valid(message)
         await super().send(json.dumps(message))
 
+    async def send_serialized(self, data: str, reliable: bool = True) -> None:
+        """
+        Send a message that has already been validated and serialized to JSON.
+
+        reliable is ignored; it is only there to match udp_transport.Channel.
+        """
+        await super().send(data)
+
 
 class BBClientProtocol(_BBSharedProtocol, websockets.asyncio.client.ClientConnection):
     pass
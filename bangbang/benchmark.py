@@ -0,0 +1,346 @@
+#!/usr/bin/python
+
+"""Performance measurements that don't need a window or real players."""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+import websockets
+
+import bbutils
+import bots
+import collisions
+import constants
+import history
+import recording
+import simulation
+import stream_transport
+import vecenv
+import world_snapshot
+
+# a typical APPROVE with one moving tank
+SAMPLE_MESSAGE = json.dumps(
+    {
+        "type": constants.Msg.APPROVE,
+        "time": 1700000000.0,
+        "states": [
+            (
+                0,
+                {
+                    "actions": (constants.Action.ACCEL,),
+                    "bangle": 123.456,
+                    "color": [0.1, 0.2, 0.3],
+                    "health": 5,
+                    "name": "player",
+                    "pos": (12.345, 0.0, -67.89),
+                    "speed": 7.5,
+                    "tangle": 234.567,
+                },
+                42,
+            )
+        ],
+        "hidden": [],
+    }
+)
+
+
+async def _run_transport(transport: str, clients: int, messages: int) -> tuple[float, float]:
+    """Send messages to each of clients over localhost; return (wall, CPU) seconds."""
+
+    async def serve(connection) -> None:
+        for _ in range(messages):
+            await connection.send_serialized(SAMPLE_MESSAGE)
+        # let the client hang up once it has everything
+        async for _ in connection:
+            pass
+
+    async def receive(connection) -> None:
+        received = 0
+        async for _ in connection:
+            received += 1
+            if received == messages:
+                return
+
+    if transport == "tcp":
+        server = await asyncio.start_server(
+            lambda r, w: serve(stream_transport.StreamConnection(r, w)), "127.0.0.1", 0
+        )
+    else:
+        server = await websockets.serve(
+            serve, "127.0.0.1", 0, create_connection=bbutils.BBServerProtocol
+        )
+    port = server.sockets[0].getsockname()[1]
+
+    def connect():
+        if transport == "tcp":
+            return stream_transport.connect("127.0.0.1", port)
+        return websockets.connect(
+            f"ws://127.0.0.1:{port}", create_connection=bbutils.BBClientProtocol
+        )
+
+    async def client() -> None:
+        async with connect() as connection:
+            await receive(connection)
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    server.close()
+    await server.wait_closed()
+    return wall, cpu
+
+
+def transport(args: argparse.Namespace) -> None:
+    """Compare the websocket and length-prefixed TCP transports."""
+    total = args.clients * args.messages
+    print(f"{args.clients} clients x {args.messages} messages of {len(SAMPLE_MESSAGE)} B")
+    print(f"{'transport':<10} {'msgs/s':>12} {'CPU us/msg':>12}")
+    for name in ("websocket", "tcp"):
+        wall, cpu = asyncio.run(_run_transport(name, args.clients, args.messages))
+        # both ends run in this process, so the CPU time covers sending and receiving
+        print(f"{name:<10} {total / wall:>12.0f} {cpu / total * 1e6:>12.2f}")
+
+
+class _FakeTank:
+    """Just enough of a tank for history.TankHistory.record()."""
+
+    def __init__(self, rng: np.random.Generator) -> None:
+        self.pos = np.array((rng.uniform(-500, 500), 0.0, rng.uniform(-500, 500)))
+        self.bangle = rng.uniform(0, 360)
+        self.bout = np.array(
+            (np.sin(np.radians(self.bangle)), 0.0, np.cos(np.radians(self.bangle)))
+        )
+
+
+def rewind(args: argparse.Namespace) -> None:
+    """Measure the memory and CPU cost of lag-compensated shell hits."""
+    rng = np.random.default_rng(0)
+    tanks = {client_id: _FakeTank(rng) for client_id in range(args.tanks)}
+    tank_history = history.TankHistory(tanks)
+    shells = rng.uniform(-500, 500, (args.shells, 3))
+
+    start = time.process_time()
+    for tick in range(args.ticks):
+        tank_history.record(tick, tanks)
+    record = (time.process_time() - start) / args.ticks
+
+    target = args.ticks - tank_history.length // 2
+    start = time.process_time()
+    for pos in shells:
+        tank_history.hits(target, pos)
+    rewound = (time.process_time() - start) / args.shells
+
+    # the check Server.collisions did before lag compensation, for comparison
+    start = time.process_time()
+    for pos in shells:
+        flat = np.array((pos[0], 0.0, pos[2]))
+        for tank in tanks.values():
+            collisions.collide_tank(tank.pos, flat, tank.bout)
+    current = (time.process_time() - start) / args.shells
+
+    print(f"{args.tanks} tanks, {tank_history.length} ticks of history")
+    print(f"memory:               {tank_history.nbytes / 1024:.1f} KiB")
+    print(f"record per tick:      {record * 1e6:.1f} us")
+    print(f"rewound hit check:    {rewound * 1e6:.1f} us/shell")
+    print(f"unrewound hit check:  {current * 1e6:.1f} us/shell")
+
+
+def record(args: argparse.Namespace) -> None:
+    """Measure what recording a match costs the tick and the disk."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "benchmark.bbrec")
+        recorder = recording.Recorder(path)
+        actions = {constants.Action.ACCEL, constants.Action.SHELL}
+
+        # this is all the tick does; the rest happens on the recorder's thread
+        start = time.perf_counter()
+        for tick in range(args.messages):
+            recorder.message(tick, SAMPLE_MESSAGE)
+            recorder.input(tick, 0, actions, tick)
+        on_tick = (time.perf_counter() - start) / (2 * args.messages)
+
+        start = time.perf_counter()
+        recorder.close()
+        closing = time.perf_counter() - start
+        size = os.path.getsize(path)
+
+        start = time.perf_counter()
+        with recording.Recording(path) as r:
+            count = sum(1 for _ in r.records())
+        reading = (time.perf_counter() - start) / count
+
+    print(f"{args.messages} messages of {len(SAMPLE_MESSAGE)} B and {args.messages} inputs")
+    print(f"cost on the tick:     {on_tick * 1e6:.2f} us/record")
+    print(f"waiting for writes:   {closing * 1e3:.0f} ms at close")
+    print(f"file size:            {size / (2 * args.messages):.1f} B/record")
+    print(f"reading:              {reading * 1e6:.2f} us/record")
+
+
+def _random_inputs(
+    rng: np.random.Generator, players: int, ticks: int
+) -> list[dict[int, tuple[set, int]]]:
+    """Return inputs for Simulation.run() from players who change their minds now and then."""
+    movement = [
+        set(),
+        {constants.Action.ACCEL},
+        {constants.Action.ACCEL, constants.Action.ALL_LEFT},
+        {constants.Action.ACCEL, constants.Action.ALL_RIGHT},
+        {constants.Action.DEACCEL},
+    ]
+    inputs = []
+    for tick in range(ticks):
+        requests = {}
+        # each player sends a new REQUEST about once a second
+        for client_id in np.flatnonzero(rng.random(players) < 1 / constants.TICK_RATE):
+            actions = set(movement[rng.integers(len(movement))])
+            if rng.random() < 0.5:
+                actions.add(constants.Action.SHELL)
+            if rng.random() < 0.1:
+                actions.add(constants.Action.MINE)
+            requests[int(client_id)] = (actions, tick)
+        inputs.append(requests)
+    return inputs
+
+
+def simulate(args: argparse.Namespace) -> None:
+    """Measure how fast the game runs without a network or a clock."""
+    rng = np.random.default_rng(args.seed)
+    ticks = round(args.seconds * constants.TICK_RATE)
+    inputs = _random_inputs(rng, args.players, ticks)
+
+    sim = simulation.Simulation()
+    sim.new_game([(client_id, str(client_id)) for client_id in range(args.players)], args.seed)
+    start = time.perf_counter()
+    ran = sim.run(ticks, inputs)
+    wall = time.perf_counter() - start
+
+    print(f"{args.players} players, {ran} ticks ({sim.sim_time:.0f} s of play)")
+    print(f"ticks per second:     {ran / wall:.0f}")
+    print(f"faster than real time: {sim.sim_time / wall:.1f}x")
+    if sim.winner is not None:
+        print(f"won by:               {sim.winner.name}")
+    else:
+        print(f"tanks left:           {len(sim.tanks)}")
+
+
+def stress(args: argparse.Namespace) -> None:
+    """Measure what bots cost the tick in a match of nothing but bots."""
+    sim = simulation.Simulation()
+    players = bots.Bots(range(args.bots))
+    sim.new_game(players.players, args.seed)
+    ticks = round(args.seconds * constants.TICK_RATE)
+
+    deciding = 0.0
+    start = time.perf_counter()
+    for _ in range(ticks):
+        before = time.perf_counter()
+        inputs = players.decide(sim)
+        deciding += time.perf_counter() - before
+        sim.step(inputs)
+        if sim.winner is not None:
+            break
+    wall = time.perf_counter() - start
+
+    print(f"{args.bots} bots, {sim.tick} ticks ({sim.sim_time:.0f} s of play)")
+    print(f"tick:                 {wall / sim.tick * 1e3:.3f} ms")
+    print(f"bots' share:          {deciding / sim.tick * 1e3:.3f} ms ({deciding / wall:.0%})")
+    print(f"tick budget used:     {wall / sim.sim_time:.0%}")
+    print(f"shells fired:         {sim.next_shell_id}")
+    if sim.winner is not None:
+        print(f"won by:               {sim.winner.name}")
+    else:
+        print(f"tanks left:           {len(sim.tanks)}")
+
+
+def batched(args: argparse.Namespace) -> None:
+    """Measure how many match ticks VecEnv runs per second."""
+    rng = np.random.default_rng(args.seed)
+    env = vecenv.VecEnv(args.matches, args.players, args.seed)
+    # the movements of _random_inputs(), always firing
+    masks = np.array(
+        [
+            world_snapshot.pack_actions(actions | {constants.Action.SHELL, constants.Action.MINE})
+            for actions in (
+                set(),
+                {constants.Action.ACCEL},
+                {constants.Action.ACCEL, constants.Action.ALL_LEFT},
+                {constants.Action.ACCEL, constants.Action.ALL_RIGHT},
+                {constants.Action.DEACCEL},
+            )
+        ]
+    )
+    actions = rng.choice(masks, (args.matches, args.players))
+
+    finished = 0
+    start = time.perf_counter()
+    for _ in range(args.ticks):
+        # each player changes their mind about once a second
+        change = rng.random(actions.shape) < 1 / constants.TICK_RATE
+        actions[change] = rng.choice(masks, np.count_nonzero(change))
+        _, _, done = env.step(actions)
+        if done.any():
+            finished += np.count_nonzero(done)
+            env.reset(done)
+    wall = time.perf_counter() - start
+
+    print(f"{args.matches} matches of {args.players} players, {args.ticks} ticks each")
+    print(f"match ticks per second: {args.matches * args.ticks / wall:.0f}")
+    print(f"per step:               {wall / args.ticks * 1e3:.2f} ms")
+    print(f"matches finished:       {finished}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Bang Bang " + constants.VERSION + " benchmarks",
+        prog="benchmark",
+    )
+    subparsers = parser.add_subparsers(required=True)
+
+    transport_parser = subparsers.add_parser("transport", help=transport.__doc__)
+    transport_parser.add_argument("-c", "--clients", type=int, default=8)
+    transport_parser.add_argument("-n", "--messages", type=int, default=20000)
+    transport_parser.set_defaults(func=transport)
+
+    rewind_parser = subparsers.add_parser("rewind", help=rewind.__doc__)
+    rewind_parser.add_argument("-t", "--tanks", type=int, default=64)
+    rewind_parser.add_argument("-s", "--shells", type=int, default=10000)
+    rewind_parser.add_argument("-n", "--ticks", type=int, default=10000)
+    rewind_parser.set_defaults(func=rewind)
+
+    record_parser = subparsers.add_parser("record", help=record.__doc__)
+    record_parser.add_argument("-n", "--messages", type=int, default=100000)
+    record_parser.set_defaults(func=record)
+
+    simulate_parser = subparsers.add_parser("simulate", help=simulate.__doc__)
+    simulate_parser.add_argument("-p", "--players", type=int, default=8)
+    simulate_parser.add_argument("-s", "--seconds", type=float, default=300.0)
+    simulate_parser.add_argument("--seed", type=int, default=0)
+    simulate_parser.set_defaults(func=simulate)
+
+    bots_parser = subparsers.add_parser("bots", help=stress.__doc__)
+    bots_parser.add_argument("-b", "--bots", type=int, default=32)
+    bots_parser.add_argument("-s", "--seconds", type=float, default=120.0)
+    bots_parser.add_argument("--seed", type=int, default=0)
+    bots_parser.set_defaults(func=stress)
+
+    vecenv_parser = subparsers.add_parser("vecenv", help=batched.__doc__)
+    vecenv_parser.add_argument("-k", "--matches", type=int, default=1024)
+    vecenv_parser.add_argument("-p", "--players", type=int, default=2)
+    vecenv_parser.add_argument("-n", "--ticks", type=int, default=3600)
+    vecenv_parser.add_argument("--seed", type=int, default=0)
+    vecenv_parser.set_defaults(func=batched)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Computer players that run inside the server's tick.
+
+A bot is a tank without a client. Once per tick, Bots.decide() looks at the world for
+all of the bots at once with a few NumPy queries (the nearest enemy, whether a hill
+is in the line of fire, whether a hill is ahead) and returns their input in the same
+form as the players' REQUESTs. Like a client, a bot only sends new input when it
+changes its mind.
+"""
+
+from collections.abc import Iterable
+
+import numpy as np
+
+import constants
+import world_snapshot
+
+
+def _angle_to(delta: np.ndarray) -> np.ndarray:
+    """Return the angles that face along the (x, z) vectors of delta, like bangle."""
+    return np.degrees(np.arctan2(delta[..., 0], delta[..., 1]))
+
+
+def _turn(diff: np.ndarray) -> np.ndarray:
+    """Return angle differences as the shortest turn, between -180 and 180 degrees."""
+    return (diff + 180.0) % 360.0 - 180.0
+
+
+class Bots(constants.Bot):
+    """The bots of one game."""
+
+    def __init__(self, client_ids: Iterable[int]) -> None:
+        self.client_ids = list(client_ids)
+        # the last input of each bot, as world_snapshot.pack_actions() bitmasks
+        self.masks: dict[int, int] = {}
+        # sequence number of the last input of each bot
+        self.seq: dict[int, int] = {}
+
+    @property
+    def players(self) -> list[tuple[int, str]]:
+        """Return the (client id, name) of every bot, for Simulation.new_game()."""
+        return [(client_id, f"Bot {n}") for n, client_id in enumerate(self.client_ids, 1)]
+
+    def decide(self, game: "simulation.Simulation") -> dict[int, tuple[set, int]]:
+        """Return the new (actions, seq) of every bot that has changed its mind."""
+        tanks = list(game.tanks.values())
+        bot_ids = set(self.client_ids)
+        # indices into tanks of the bots that are still alive
+        rows = [row for row, tank in enumerate(tanks) if tank.client_id in bot_ids]
+        if not rows or len(tanks) < 2:
+            return {}
+        poses = np.array([(tank.pos[0], tank.pos[2]) for tank in tanks])
+        me = poses[rows]
+        bangle = np.array([tanks[row].bangle for row in rows])
+        tangle = np.array([tanks[row].tangle for row in rows])
+        speed = np.array([tanks[row].speed for row in rows])
+        bots = np.arange(len(rows))
+
+        # the nearest enemy
+        squared = ((poses[np.newaxis] - me[:, np.newaxis]) ** 2).sum(axis=2)
+        squared[bots, rows] = np.inf
+        target = squared.argmin(axis=1)
+        distance = np.sqrt(squared[bots, target])
+        delta = poses[target] - me
+        heading = _angle_to(delta)
+        aim = _turn(heading - tangle)
+        steer = _turn(heading - bangle)
+
+        # is a hill between the bot and its target?
+        hills = game.hill_array[:, (0, 2)]
+        to_hill = hills[np.newaxis] - me[:, np.newaxis]
+        along = (to_hill * delta[:, np.newaxis]).sum(axis=2) / np.maximum(
+            (delta**2).sum(axis=1), 1e-9
+        )[:, np.newaxis]
+        closest = delta[:, np.newaxis] * np.clip(along, 0.0, 1.0)[..., np.newaxis]
+        blocked = (((closest - to_hill) ** 2).sum(axis=2) < constants.Hill.RADIUS**2).any(axis=1)
+
+        # is a hill in the way?
+        radians = np.radians(bangle)
+        ahead = me + np.stack((np.sin(radians), np.cos(radians)), axis=1) * self.LOOKAHEAD
+        ahead_squared = ((hills[np.newaxis] - ahead[:, np.newaxis]) ** 2).sum(axis=2)
+        hill = ahead_squared.argmin(axis=1)
+        in_way = ahead_squared[bots, hill] < (constants.Hill.RADIUS + constants.Tank.RADIUS) ** 2
+        # positive if the hill is to the left
+        hill_side = _turn(_angle_to(to_hill[bots, hill]) - bangle)
+
+        def bit(action: constants.Action, where: np.ndarray) -> np.ndarray:
+            return np.where(where, 1 << action, 0)
+
+        Action = constants.Action
+        aiming = np.abs(aim) > self.AIM_TOLERANCE
+        close = distance <= self.KEEP_DISTANCE
+        masks = (
+            bit(Action.TURRET_LEFT, aiming & (aim > 0))
+            | bit(Action.TURRET_RIGHT, aiming & (aim <= 0))
+            | bit(Action.SHELL, ~aiming & (distance < self.FIRE_RANGE) & ~blocked)
+            # turn away from a hill in the way, otherwise toward the target
+            | bit(Action.BASE_RIGHT, in_way & (hill_side > 0))
+            | bit(Action.BASE_LEFT, in_way & (hill_side <= 0))
+            | bit(Action.BASE_LEFT, ~in_way & (steer > self.STEER_TOLERANCE))
+            | bit(Action.BASE_RIGHT, ~in_way & (steer < -self.STEER_TOLERANCE))
+            | bit(Action.ACCEL, ~close)
+            | bit(Action.DEACCEL, close & (speed > constants.Tank.SNAP_STOP))
+            | bit(Action.STOP, close & (speed <= constants.Tank.SNAP_STOP))
+            | bit(Action.MINE, distance < self.MINE_RANGE)
+        )
+
+        decisions = {}
+        for row, mask in zip(rows, masks.tolist()):
+            client_id = tanks[row].client_id
+            last = self.masks.get(client_id)
+            if mask != last:
+                self.masks[client_id] = mask
+                self.seq[client_id] = self.seq.get(client_id, -1) + 1
+                decisions[client_id] = (
+                    set(world_snapshot.unpack_actions(mask)),
+                    self.seq[client_id],
+                )
+        return decisions
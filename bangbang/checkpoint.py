@@ -0,0 +1,316 @@
+"""
+Crash-safe checkpoints of the match running on the server.
+
+Every Checkpoint.INTERVAL seconds, the server packs the whole match into a compact
+binary form and hands it to a CheckpointWriter, whose thread compresses it and
+replaces the checkpoint file. The file is written to a temporary name, flushed to
+disk, and renamed over the old checkpoint, so a crash at any point leaves either the
+old checkpoint or the new one, never a mix.
+
+Packing happens on the event loop but only copies a few numbers per object; the slow
+parts (compression and the disk) happen on the writer's thread. Unlike
+world_snapshot, a checkpoint has everything the server needs to carry on: reload
+times, input sequence numbers, id counters, and the players' tokens so they can
+reconnect with RESUME. Numbers are stored as doubles so the match continues exactly
+where it left off.
+"""
+
+import contextlib
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+import constants
+import metrics
+import world_snapshot
+
+# magic, format version, tick, game time, next mine id, next shell id, next client id,
+# map version, ground half width, map seed, hill count, tree count, map checksum
+HEADER = struct.Struct("<4sBQdIIiBIQIII")
+MAGIC = b"BBCP"
+# increment whenever the format changes
+VERSION = 1
+
+COUNT = world_snapshot.COUNT
+# client id, last applied REQUEST seq, action bitmask, health, snapping back, turning
+# back, x, z, bangle, tangle, speed, color, game times of the last mine and shell,
+# token, length of the UTF-8 name that follows
+TANK = struct.Struct("<iiIh??5d3f2d32sH")
+# shell id, owner, ticks to rewind, angle, position, out vector, age
+SHELL = struct.Struct("<IiId3d3dd")
+# mine id, owner, position, age
+MINE = struct.Struct("<Ii3dd")
+TREE = world_snapshot.TREE
+
+
+def capture(game: "server.Server") -> bytes:
+    """Return the uncompressed checkpoint of the match game is running."""
+    network = game.server
+    # tokens of connected players and of players who may still come back
+    tokens = {c.client_id: c.token for c in network.clients}
+    tokens |= {client_id: token for token, client_id in network.departed.items()}
+
+    params = game.map_params
+    parts = [
+        HEADER.pack(
+            MAGIC,
+            VERSION,
+            game.tick,
+            game.sim_time,
+            game.next_mine_id,
+            game.next_shell_id,
+            network.next_id,
+            params["version"],
+            game.ground_hw,
+            params["seed"],
+            params["hills"],
+            params["trees"],
+            params["checksum"],
+        ),
+        COUNT.pack(len(game.tanks)),
+    ]
+    for client_id, tank in game.tanks.items():
+        name = (tank.name or "").encode()[:0xFFFF]
+        parts.append(
+            TANK.pack(
+                client_id,
+                tank.last_seq,
+                world_snapshot.pack_actions(tank.actions),
+                tank.health,
+                tank.snapping_back,
+                tank.turning_back,
+                tank.pos[0],
+                tank.pos[2],
+                tank.bangle,
+                tank.tangle,
+                tank.speed,
+                *tank.color,
+                tank.mine_reloading,
+                tank.shell_reloading,
+                tokens.get(client_id, "").encode(),
+                len(name),
+            )
+        )
+        parts.append(name)
+
+    parts.append(COUNT.pack(len(game.shells)))
+    parts += (
+        SHELL.pack(s.shell_id, s.client_id, s.rewind, s.angle, *s.pos, *s.out, s.age)
+        for s in game.shells
+    )
+    parts.append(COUNT.pack(len(game.mines)))
+    parts += (MINE.pack(m.mine_id, m.client_id, *m.pos, m.age) for m in game.mines)
+    parts.append(COUNT.pack(len(game.fallen_trees)))
+    parts += (TREE.pack(index, *fallen) for index, fallen in game.fallen_trees.items())
+    return b"".join(parts)
+
+
+def load(path: str) -> dict:
+    """
+    Return the contents of the checkpoint at path.
+
+    Raises OSError if it can't be read and ValueError if it isn't a checkpoint this
+    version can read.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    try:
+        raw = zlib.decompress(data)
+    except zlib.error as e:
+        raise ValueError(f"{path} is corrupt") from e
+
+    try:
+        (
+            magic,
+            version,
+            tick,
+            sim_time,
+            next_mine_id,
+            next_shell_id,
+            next_client_id,
+            map_version,
+            ground_hw,
+            seed,
+            hills,
+            trees,
+            checksum,
+        ) = HEADER.unpack_from(raw)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a checkpoint of a supported version")
+        offset = HEADER.size
+
+        def records(record: struct.Struct) -> list[tuple]:
+            nonlocal offset
+            (count,) = COUNT.unpack_from(raw, offset)
+            offset += COUNT.size
+            unpacked = list(record.iter_unpack(raw[offset : offset + count * record.size]))
+            offset += count * record.size
+            return unpacked
+
+        tanks = []
+        (count,) = COUNT.unpack_from(raw, offset)
+        offset += COUNT.size
+        for _ in range(count):
+            (
+                client_id,
+                last_seq,
+                actions,
+                health,
+                snapping_back,
+                turning_back,
+                x,
+                z,
+                bangle,
+                tangle,
+                speed,
+                *rest,
+            ) = TANK.unpack_from(raw, offset)
+            offset += TANK.size
+            r, g, b, mine_reloading, shell_reloading, token, name_length = rest
+            tanks.append(
+                {
+                    "client_id": client_id,
+                    "last_seq": last_seq,
+                    "actions": set(world_snapshot.unpack_actions(actions)),
+                    "health": health,
+                    "snapping_back": snapping_back,
+                    "turning_back": turning_back,
+                    "pos": (x, 0.0, z),
+                    "bangle": bangle,
+                    "tangle": tangle,
+                    "speed": speed,
+                    "color": [r, g, b],
+                    "mine_reloading": mine_reloading,
+                    "shell_reloading": shell_reloading,
+                    "token": token.decode(errors="replace"),
+                    "name": raw[offset : offset + name_length].decode(errors="replace"),
+                }
+            )
+            offset += name_length
+
+        shells = [
+            {
+                "shell_id": shell_id,
+                "id": owner,
+                "rewind": rewind,
+                "angle": angle,
+                "pos": (x, y, z),
+                "out": (out_x, out_y, out_z),
+                "age": age,
+            }
+            for shell_id, owner, rewind, angle, x, y, z, out_x, out_y, out_z, age in records(
+                SHELL
+            )
+        ]
+        mines = [
+            {"mine_id": mine_id, "id": owner, "pos": (x, y, z), "age": age}
+            for mine_id, owner, x, y, z, age in records(MINE)
+        ]
+        fallen_trees = {index: (x, z, speed) for index, x, z, speed in records(TREE)}
+    except struct.error as e:
+        raise ValueError(f"{path} is truncated") from e
+
+    return {
+        "tick": tick,
+        "sim_time": sim_time,
+        "next_mine_id": next_mine_id,
+        "next_shell_id": next_shell_id,
+        "next_client_id": next_client_id,
+        "ground_hw": ground_hw,
+        "map": {
+            "version": map_version,
+            "seed": seed,
+            "hills": hills,
+            "trees": trees,
+            "checksum": checksum,
+        },
+        "tanks": tanks,
+        "shells": shells,
+        "mines": mines,
+        "fallen_trees": fallen_trees,
+    }
+
+
+# queued instead of a checkpoint to delete the file
+_REMOVE = object()
+
+
+class CheckpointWriter(constants.Checkpoint):
+    """Writes checkpoints to a file on a background thread."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        # newest checkpoint not yet written, _REMOVE, or None if there is nothing to do;
+        # a checkpoint that is replaced before the thread gets to it is never written
+        self.pending: bytes | object | None = None
+        self.closed = False
+        self.wake = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="checkpoint writer", daemon=True)
+        self.thread.start()
+
+    def save(self, game: "server.Server") -> None:
+        """Capture the match game is running and write it in the background."""
+        start = time.perf_counter()
+        raw = capture(game)
+        metrics.CHECKPOINT_SECONDS.observe(time.perf_counter() - start, phase="capture")
+        self._queue(raw)
+
+    def remove(self) -> None:
+        """Delete the checkpoint file once any pending write is done."""
+        self._queue(_REMOVE)
+
+    def close(self) -> None:
+        """Finish any pending work and stop the thread."""
+        with self.lock:
+            self.closed = True
+        self.wake.set()
+        self.thread.join()
+
+    def _queue(self, job: bytes | object) -> None:
+        with self.lock:
+            self.pending = job
+        self.wake.set()
+
+    def run(self) -> None:
+        while True:
+            self.wake.wait()
+            with self.lock:
+                self.wake.clear()
+                job, self.pending = self.pending, None
+                closed = self.closed
+            try:
+                if job is _REMOVE:
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(self.path)
+                elif job is not None:
+                    self.write(job)
+            except OSError as e:
+                # keep going; the next checkpoint might succeed
+                logging.error(f"couldn't write checkpoint: {e}")
+            if closed:
+                return
+
+    def write(self, raw: bytes) -> None:
+        """Compress raw and atomically replace the checkpoint file with it."""
+        start = time.perf_counter()
+        data = zlib.compress(raw, self.COMPRESSION)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        if os.name == "posix":
+            # make the rename itself survive a power cut
+            fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        metrics.CHECKPOINT_SECONDS.observe(time.perf_counter() - start, phase="write")
+        metrics.CHECKPOINT_BYTES.set(len(data))
+        metrics.CHECKPOINTS_WRITTEN.inc()
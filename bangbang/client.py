@@ -1,16 +1,26 @@
 import asyncio
 from collections.abc import Iterable
 import json
+import logging
 import websockets
 
 import bbutils
 import constants
+import stream_transport
+import udp_transport
 
 
 class Client:
-    def __init__(self, game: "game.Game") -> None:
+    def __init__(self, game: "game.Game", transport: str) -> None:
         self.game = game
         self.name_task = None
+        # "websocket", "udp" or "tcp"
+        self.transport = transport
+        # whether we're watching through a relay instead of playing
+        self.via_relay = game.spectating
+        # identifies us to the server, including after reconnecting; set by ID
+        self.token: str | None = None
+        self.sync_task: asyncio.Task | None = None
 
     async def greet(self, name: str) -> None:
         """
@@ -18,34 +28,121 @@ class Client:
 
         This type of message informs the server of the player name.
         """
-        await self.ws.send({"type": constants.Msg.GREET, "name": name})
+        await self.connection.send({"type": constants.Msg.GREET, "name": name})
 
-    async def send_actions(self, actions: Iterable[constants.Action]) -> None:
-        """Send a REQUEST message to the server."""
-        await self.ws.send({"type": constants.Msg.REQUEST, "actions": actions})
+    async def send_actions(self, actions: Iterable[constants.Action], seq: int) -> None:
+        """Send a REQUEST message with input sequence number seq to the server."""
+        await self.connection.send(
+            {"type": constants.Msg.REQUEST, "actions": actions, "seq": seq}
+        )
+
+    async def sync_clock(self) -> None:
+        """Keep sending PINGs so game.clock_sync stays up to date."""
+        try:
+            for _ in range(constants.ClockSync.INITIAL_PINGS):
+                await self.connection.send(self.game.clock_sync.ping())
+                await asyncio.sleep(constants.ClockSync.INITIAL_INTERVAL)
+            while True:
+                await self.connection.send(self.game.clock_sync.ping())
+                await asyncio.sleep(constants.ClockSync.INTERVAL)
+        except (websockets.exceptions.ConnectionClosed, ConnectionError):
+            # connect() notices too and takes care of it
+            pass
+
+    async def listen(self, connection: udp_transport.Channel) -> None:
+        """Handle messages arriving on a connection other than the main one."""
+        async for raw_message in connection:
+            await self.game.handle_message(json.loads(raw_message))
+
+    async def switch_to_udp(self, ip: str, port: int, tg: asyncio.TaskGroup) -> None:
+        """Open a UDP channel to the server's port, if possible."""
+        try:
+            channel = await udp_transport.connect(ip, port, self.token)
+        except ConnectionError as e:
+            logging.warning(f"{e}; staying on the websocket")
+            return
+        channel.fallback = self.ws
+        self.connection = channel
+        tg.create_task(self.listen(channel))
 
     async def start(self, ip: str) -> None:
-        """Attempt to connect to the server and listen for new messages."""
-        async with websockets.connect(
-            f"ws://{ip}:{constants.PORT}", create_connection=bbutils.BBClientProtocol
-        ) as self.ws:
+        """Connect to the server, reconnecting if the connection drops during a game."""
+        await self.connect(ip)
+
+        # only a player in a game that is still going has something to come back to
+        attempts = 0
+        while (
+            self.token is not None
+            and self.game.start_event.is_set()
+            and attempts < constants.Reconnect.ATTEMPTS
+        ):
+            if attempts == 0:
+                print("Lost the connection to the server; reconnecting...")
+            attempts += 1
+            await asyncio.sleep(constants.Reconnect.INTERVAL)
+            try:
+                await self.connect(ip)
+            except OSError as e:
+                logging.debug(f"could not reconnect: {e}")
+            else:
+                attempts = 0
+        print("The server disconnected unexpectedly.")
+        exit()
+
+    async def connect(self, ip: str) -> None:
+        """Connect to the server and listen for new messages until the connection closes."""
+        if self.via_relay:
+            # relays only speak websocket
+            connection = websockets.connect(
+                f"ws://{ip}:{constants.RELAY_PORT}", create_connection=bbutils.BBClientProtocol
+            )
+        elif self.transport == "tcp":
+            connection = stream_transport.connect(ip, constants.STREAM_PORT)
+        else:
+            connection = websockets.connect(
+                f"ws://{ip}:{constants.PORT}", create_connection=bbutils.BBClientProtocol
+            )
+        async with connection as self.ws:
+            # where messages to the server are sent; the websocket unless we switch
+            self.connection = self.ws
             async with asyncio.TaskGroup() as tg:
-                async for raw_message in self.ws:
-                    try:
-                        # waits until data is received from the server
+                if self.via_relay:
+                    # relays don't send an ID
+                    self.sync_task = tg.create_task(self.sync_clock())
+                    print("Waiting for the game to start...")
+                try:
+                    async for raw_message in self.ws:
                         message = json.loads(raw_message)
-                    except websockets.exceptions.ConnectionClosed:
-                        if self.name_task is None:
-                            # TODO: This doesn't seem to trigger as expected
-                            print(
-                                "There was an error when trying to connect to the server. This probably means that the game has already started."
-                            )
-                        else:
-                            print("The server disconnected unexpectedly.")
-                        exit()
-
-                    # placing the following block here guarantees that the "Enter your name:" text will not be displayed if there is a server error
-                    if self.name_task is None:
-                        self.name_task = tg.create_task(self.game.assign_name())
-
-                    await self.game.handle_message(message)
+
+                        if message["type"] == constants.Msg.ID:
+                            # a reconnecting client keeps its old identity
+                            rejoining = self.token is not None
+                            if not rejoining:
+                                self.token = message["token"]
+                            if message.get("running"):
+                                # the server answers with a SNAPSHOT of the game
+                                await self.ws.send(
+                                    {"type": constants.Msg.RESUME, "token": self.token}
+                                )
+                            if self.transport == "udp":
+                                await self.switch_to_udp(ip, message["udp_port"], tg)
+                            self.sync_task = tg.create_task(self.sync_clock())
+                            if rejoining:
+                                continue
+
+                        # placing the following block here guarantees that the "Enter your name:" text will not be displayed if there is a server error
+                        if self.name_task is None and not self.via_relay:
+                            self.name_task = tg.create_task(self.game.assign_name())
+
+                        await self.game.handle_message(message)
+                except websockets.exceptions.ConnectionClosed:
+                    pass
+                finally:
+                    # these would otherwise keep the TaskGroup open
+                    for task in (self.sync_task, self.name_task):
+                        if task is not None:
+                            task.cancel()
+                    if self.connection is not self.ws:
+                        # the UDP channel can't tell that the server has gone away
+                        self.connection.close()
+                        self.connection.transport.close()
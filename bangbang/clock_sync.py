@@ -0,0 +1,55 @@
+"""
+NTP-style estimate of the server's clock and the round-trip time to it.
+
+The client regularly sends a PING with its local time. The server answers right away
+with a PONG holding that time and its own, which gives one sample of the round-trip
+time and of the offset between the two clocks. The offset is taken from the fastest
+recent exchange, since the less time a PING and PONG spend in queues, the more evenly
+that time is likely to be split between the two directions.
+"""
+
+import collections
+import time
+
+import bbutils
+import constants
+
+
+class ClockSync(constants.ClockSync):
+    """The client's view of the server's clock."""
+
+    def __init__(self) -> None:
+        # (round-trip time, offset) of the last few exchanges
+        self.samples: collections.deque[tuple[float, float]] = collections.deque(
+            maxlen=self.WINDOW
+        )
+        # server time minus local time
+        self.offset = 0.0
+        # smoothed round-trip time in seconds; None until the first PONG
+        self.rtt: float | None = None
+
+    def ping(self) -> bbutils.Message:
+        """Return a PING message to send to the server."""
+        # the server keeps the RTT for things like lag compensation
+        return {"type": constants.Msg.PING, "client_time": time.time(), "rtt": self.rtt}
+
+    def pong(self, message: bbutils.Message) -> None:
+        """Update the estimates with a PONG from the server."""
+        now = time.time()
+        rtt = now - message["client_time"]
+        # assume the server answered halfway through the round trip
+        self.samples.append((rtt, message["server_time"] + rtt / 2 - now))
+        self.offset = min(self.samples)[1]
+
+        if self.rtt is None:
+            self.rtt = rtt
+        else:
+            self.rtt += (rtt - self.rtt) * self.RTT_SMOOTHING
+
+    def server_now(self) -> float:
+        """Return the current time on the server's clock."""
+        return time.time() + self.offset
+
+    def to_local(self, server_time: float) -> float:
+        """Convert a time on the server's clock to a time on the local clock."""
+        return server_time - self.offset
@@ -3,6 +3,12 @@ import numpy as np
 import constants
 import utils_3d
 
+# every tank collision sphere lies within this distance of the tank's position
+TANK_BOUND = (
+    max(constants.Tank.COLLISION_SPHERE_BACK, constants.Tank.COLLISION_SPHERE_FRONT)
+    + constants.Tank.RADIUS
+)
+
 
 def collide_hill(hill_pos: np.ndarray, obj_pos: np.ndarray) -> bool:
     """Return True if a hill and another object are colliding, False otherwise."""
@@ -47,6 +53,33 @@ def collide_tank_tank(
     return False
 
 
+def collide_tanks_points(
+    tank_poses: np.ndarray, tank_bouts: np.ndarray, points: np.ndarray
+) -> np.ndarray:
+    """
+    Return a boolean array whose [i, j] is True if tank i collides with point j.
+
+    tank_poses and tank_bouts have shape (n, 3) and points has shape (m, 3).
+    """
+    # shape (n, 3 spheres, 3 coordinates)
+    spheres = np.stack(tank_collision_spheres(tank_poses, tank_bouts), axis=1)
+    squared = ((spheres[:, :, np.newaxis, :] - points[np.newaxis, np.newaxis, :, :]) ** 2).sum(
+        axis=3
+    )
+    return (squared < constants.Tank.RADIUS**2).any(axis=1)
+
+
+def within(poses_a: np.ndarray, poses_b: np.ndarray, distance: float) -> np.ndarray:
+    """
+    Return a boolean array whose [i, j] is True if point i is within distance of point j.
+
+    poses_a has shape (n, 3) and poses_b has shape (m, 3). This is a cheap first pass
+    for the exact checks above, which then only need to run where it is True.
+    """
+    squared = ((poses_a[:, np.newaxis, :] - poses_b[np.newaxis, :, :]) ** 2).sum(axis=2)
+    return squared < distance**2
+
+
 def collide_shell_world(shell_pos: np.ndarray, ground_hw: int) -> bool:
     """Return True if a shell passes the boundaries of the playing area."""
     for dimension in shell_pos:
@@ -19,6 +19,11 @@ TREE_BUFFER = 0  # m
 # minimum spawning distance between tanks
 MIN_SPAWN_DIST = 50  # m
 
+# how far the camera can see; also the radius of each client's area of interest
+VIEW_DISTANCE = 500.0  # m
+# fog starts at this fraction of VIEW_DISTANCE to hide the far clipping plane
+FOG_START = 0.8
+
 # height at which gluLookAt is called
 CAMERA_HEIGHT = 6.0  # m
 # how far 2D elements are drawn from the camera for gluUnProject
@@ -26,13 +31,37 @@ OVERLAY_DISTANCE = 0.001  # m
 
 # network constants
 PORT = 4320
+# the optional UDP transport listens here
+UDP_PORT = PORT + 1
+# the optional length-prefixed TCP transport listens here
+STREAM_PORT = PORT + 2
+# spectators connect to a relay (see relay.py) here
+RELAY_PORT = PORT + 3
+# websocket path on which relays subscribe to the server
+RELAY_PATH = "/relay"
+# how long the server waits for a relay's SUBSCRIBE
+SUBSCRIBE_TIMEOUT = 5.0  # s
+# longest message accepted by the TCP transport
+MAX_FRAME_SIZE = 1 << 20  # B
 SERVER_START_KEYWORD = "start"
 SERVER_QUIT_KEYWORD = "quit"
-SERVER_INSTRUCTIONS = f"\nType '{SERVER_START_KEYWORD}' at any time to start the game.\nType '{SERVER_QUIT_KEYWORD}' to quit."
+SERVER_PROFILE_KEYWORD = "profile"
+SERVER_ALLOC_KEYWORD = "alloc"
+SERVER_INSTRUCTIONS = (
+    f"\nType '{SERVER_START_KEYWORD}' at any time to start the game."
+    f"\nType '{SERVER_QUIT_KEYWORD}' to quit."
+    f"\nType '{SERVER_PROFILE_KEYWORD} <seconds>' or '{SERVER_ALLOC_KEYWORD} <seconds>' to profile "
+    "the server."
+)
 VERSION = "1.3.0a"
 
-# how often to send keypresses to the server
-INPUT_CHECK_WAIT = 0.005  # s
+# how many times per second the server advances the game
+TICK_RATE = 60  # Hz
+# how many times per second the server sends changed tank states to the clients
+SNAPSHOT_RATE = 20  # Hz
+# how far the server may fall behind schedule before it skips ticks
+MAX_TICK_LAG = 0.25  # s
+
 # how long to keep the window alive after someone has won
 END_TIME = 3  # s
 
@@ -40,6 +69,52 @@ END_TIME = 3  # s
 UP = np.array((0, 1, 0), dtype=float)
 
 
+class AreaOfInterest:
+    # tanks closer than this are sent to a client
+    RADIUS = VIEW_DISTANCE  # m
+    # tanks already sent stay relevant until they are this much further away
+    HYSTERESIS = 50.0  # m
+
+
+class Bot:
+    # how far off the target the turret may point when a bot fires
+    AIM_TOLERANCE = 3.0  # deg
+    # bots fire at enemies closer than this
+    FIRE_RANGE = 300.0  # m
+    # bots stop closing in on their target at this distance
+    KEEP_DISTANCE = 60.0  # m
+    # how far ahead of itself a bot looks for hills
+    LOOKAHEAD = 30.0  # m
+    # bots lay a mine when an enemy is this close
+    MINE_RANGE = 25.0  # m
+    # the base turns toward the target while it is further off than this
+    STEER_TOLERANCE = 10.0  # deg
+
+
+class Checkpoint:
+    # time between checkpoints of a running match
+    INTERVAL = 5.0  # s
+    # zlib level; checkpoints are compressed on a background thread
+    COMPRESSION = 6
+    # how long a resumed game waits for its players to reconnect before carrying on;
+    # about as long as clients keep trying
+    RESUME_TIMEOUT = 120.0  # s
+    # how often a resumed game checks whether everyone is back
+    RESUME_POLL = 0.25  # s
+
+
+class ClockSync:
+    # PINGs sent in quick succession after connecting, for a good first estimate
+    INITIAL_PINGS = 5
+    INITIAL_INTERVAL = 0.1  # s
+    # time between PINGs after that
+    INTERVAL = 1.0  # s
+    # how many recent exchanges to pick the clock offset from
+    WINDOW = 8
+    # weight of a new sample in the round trip time moving average
+    RTT_SMOOTHING = 0.125
+
+
 class Explosion:
     NO_FRAMES = 150
     SECONDS_PER_FRAME = 0.02  # S
@@ -59,16 +134,37 @@ class Hill:
     RADIUS = 20  # m
 
 
+class Interpolation:
+    # how far behind the server remote tanks are drawn
+    DELAY = 0.1  # s
+    # how long to keep moving a remote tank after its states stop arriving
+    MAX_EXTRAPOLATION = 0.25  # s
+    # how many states to keep per remote tank
+    BUFFER_LENGTH = 32
+
+
+class LagCompensation:
+    # furthest back in time shell hits are checked
+    MAX_REWIND = 0.25  # s
+
+
 class LifeBar:
     MARGIN = 50  # px
     UNIT = 200  # px
 
 
+class Metrics:
+    # the metrics endpoint is only reachable from this computer
+    HOST = "127.0.0.1"
+
+
 class Mine:
     # time interval between beep noises
     BEEP_INTERVAL = 1  # s
     LIFETIME = 10  # s
     RELOAD_TIME = 2  # s
+    # color of mines laid by tanks that have been destroyed
+    ORPHAN_COLOR = (0.5, 0.5, 0.5)
 
     DAMAGE = 2
 
@@ -80,11 +176,60 @@ class MineExplosion:
     NO_FRAMES = 50
 
 
+class Prediction:
+    # how many unacknowledged inputs to remember
+    HISTORY_LENGTH = 128
+    # corrections larger than this are snapped to instead of smoothed
+    SNAP_DISTANCE = 5.0  # m
+    # time constant of the exponential smoothing of small corrections
+    SMOOTH_TIME = 0.1  # s
+
+
+class Profiler:
+    # longest time the profile and alloc commands can run for
+    MAX_SECONDS = 600.0  # s
+    # how many stack frames tracemalloc keeps for each allocation
+    FRAMES = 1
+    # how many lines the alloc report lists
+    TOP_ALLOCATIONS = 25
+
+
+class Reconnect:
+    # how many times a client tries to get back into a game after losing connection;
+    # long enough for the server to be restarted from a checkpoint
+    ATTEMPTS = 60
+    INTERVAL = 2.0  # s
+
+
+class Recording:
+    # time between keyframes, which a replay can seek to
+    KEYFRAME_INTERVAL = 10.0  # s
+    # records are compressed in blocks of about this size...
+    BLOCK_SIZE = 1 << 18  # B
+    # ...or whatever has been recorded in this long, whichever comes first
+    BLOCK_INTERVAL = 1.0  # s
+    COMPRESSION = 6
+
+
 class ReloadingBar:
     HEIGHT = 10.0  # px
     COLOR = (0.3, 0.05, 0.0)
 
 
+class Replay:
+    # how far [ and ] seek
+    SEEK_STEP = 10.0  # s
+    MIN_SPEED = 0.125
+    MAX_SPEED = 64.0
+    # longest the replay waits before noticing a seek or a change of speed
+    POLL_INTERVAL = 0.05  # s
+
+
+class SendQueue:
+    # how many bytes of messages a client may have waiting before it is disconnected
+    BYTE_BUDGET = 1_000_000  # B
+
+
 class Shell:
     # how many hits does this weapon deal to a Tank upon contact?
     DAMAGE = 1
@@ -114,11 +259,49 @@ class Spectator:
     ROTATE_SPEED = 60  # deg / s
 
 
+class TickTiming:
+    # ticks that take longer than this are counted as overruns
+    BUDGET = 1 / TICK_RATE  # s
+    # minimum time between warnings about overruns
+    WARNING_INTERVAL = 5.0  # s
+
+
+class TokenBucket:
+    # how many messages per second a client may send on average
+    RATE = 60.0  # 1/s
+    # how many messages a client may send at once
+    BURST = 30
+
+
+class Tracing:
+    # how many events the trace keeps; older ones are overwritten
+    CAPACITY = 1 << 16
+
+
 class Tree:
     ACC = 200.0  # deg/s**2
     COLOR = (0.64, 0.44, 0.17)
 
 
+class Udp:
+    # how many reliable packets may be in flight before send_serialized waits
+    WINDOW = 256
+    # how often to check for reliable packets that need to be resent
+    RESEND_INTERVAL = 0.02  # s
+    # how long to wait for an ACK before resending
+    RESEND_TIMEOUT = 0.1  # s
+    # the other end is given up on after resending a packet this many times
+    MAX_RESENDS = 50
+    # largest payload of a UDP datagram over IPv4; bigger messages use the websocket
+    MAX_DATAGRAM = 65507  # B
+    # how often clients on UDP are sent every tank they can see, in case the APPROVE
+    # with a tank's last change was lost
+    REFRESH_INTERVAL = 1.0  # s
+    # how long to wait for the server to echo a HELLO, and how many times to try
+    HELLO_INTERVAL = 0.25  # s
+    HELLO_ATTEMPTS = 8
+
+
 class VictoryBanner:
     # final scale factor at the end of the animation
     FINAL_SCALE = 1.0
@@ -128,6 +311,24 @@ class VictoryBanner:
     ZOOM_SCALE = 20.0  # at the beginning
 
 
+class Watchdog:
+    # how often the event loop is checked on
+    INTERVAL = 0.01  # s
+    # how often the watchdog thread looks for a stall
+    CHECK_INTERVAL = 0.02  # s
+    # how long the event loop may be blocked before it counts as a stall; the server
+    # has to keep up with the ticks, while the client only has to answer pings
+    SERVER_THRESHOLD = 0.1  # s
+    CLIENT_THRESHOLD = 1.0  # s
+
+
+class WorldSnapshot:
+    # records packed between yields to the event loop
+    CHUNK = 64
+    # zlib compression level
+    COMPRESSION = 6
+
+
 class Tank:
     # how fast the turret rotates after the player presses "t"
     SNAP_SPEED = 600  # deg / s
@@ -172,6 +373,11 @@ class Msg(enum.IntEnum):
     START = enum.auto()         # game starts
     TANK_COLLIDE = enum.auto()  # tank-tank collision
     QUIT = enum.auto()          # force-quit game while running
+    PING = enum.auto()          # client asks for the server's time
+    PONG = enum.auto()          # server answers a PING
+    SUBSCRIBE = enum.auto()     # relay asks to receive every message of the match
+    RESUME = enum.auto()        # client joins or rejoins a game in progress
+    SNAPSHOT = enum.auto()      # server sends the whole world to a RESUMEd client
 
 
 @enum.unique
@@ -213,3 +419,6 @@ KEYMAP: tuple[tuple[[tuple[int], Action]]] = (
     ((K_t,), Action.SNAP_BACK),
     ((K_s,), Action.STOP),
 )
+
+# every key that appears in KEYMAP; presses of other keys cannot change the actions
+KEYMAP_KEYS: frozenset[int] = frozenset(key for key_combo, _ in KEYMAP for key in key_combo)
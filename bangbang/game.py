@@ -1,12 +1,12 @@
 # TODO: find it out if it makes sense to make all update() functions coroutines
 import asyncio
+import base64
 import contextlib
 import logging
 import math
 import socket
 import time
 import types
-from typing import Optional
 
 import aioconsole
 import numpy as np
@@ -21,10 +21,18 @@ from OpenGL.GLU import *
 
 import bbutils
 import client
+import clock_sync
 import collisions
 import constants
+import mapgen
+import metrics
 import os
+import prediction
+import replay
 import shapes
+import tracing
+import watchdog
+import world_snapshot
 
 
 # make SDL2 play nicely with Wayland
@@ -41,13 +49,24 @@ if os.environ["XDG_SESSION_TYPE"] == "wayland":
 # https://www.pygame.org/docs/ref/pygame.html#pygame.init
 pygame.init()
 
+SKY_COLOR = (0.25, 0.89, 0.92, 1.0)
+
 
 class Game:
-    def __init__(self, no_music: bool, debug: bool) -> None:
-        self.client = client.Client(self)
+    def __init__(
+        self, no_music: bool, debug: bool, transport: str, spectate: bool, replaying: bool
+    ) -> None:
+        # playing back a recording instead of connecting to a server
+        self.replaying = replaying
+        # watching a match without a tank, through a relay, after joining late, or in
+        # a replay
+        self.spectating = spectate or replaying
+        self.client = replay.Replay(self) if replaying else client.Client(self, transport)
 
         # used to block opening the window until the game has started
         self.start_event = asyncio.Event()
+        # set once initialize_graphics() has run
+        self.graphics_ready = asyncio.Event()
 
         # id of the player playing on this computer
         # assigned upon receiving an ID message
@@ -59,6 +78,8 @@ class Game:
         self.ground_hw: int | None = None
         self.hill_poses: list[tuple] | None = None
         self.tree_poses: list[tuple] | None = None
+        # set when joining a game in progress; applied once the graphics are set up
+        self.pending_snapshot: dict | None = None
 
         # used to avoid update_list, tanks, etc. cluttering the Game namespace
         # https://docs.python.org/3/library/types.html#types.SimpleNamespace
@@ -68,9 +89,22 @@ class Game:
         self.no_music = no_music
         self.debug = debug
 
+        # estimates the server's clock and the round-trip time to it; in a replay, the
+        # recording's clock
+        self.clock_sync = self.client.clock if replaying else clock_sync.ClockSync()
+
+        # times the phases of each frame for the trace
+        self.timer = metrics.PhaseTimer()
+        # the newest of this player's inputs that the trace shows the server acknowledging
+        self.traced_ack: int | None = None
+
     # TODO: replace the initialize methods with factory methods
     async def initialize(self, ip: str) -> None:
-        """Things that can't go in __init__ because they're coros"""
+        """
+        Things that can't go in __init__ because they're coros
+
+        ip is the path of the recording when replaying.
+        """
         async with asyncio.TaskGroup() as self.tg:
             self.client_task = self.tg.create_task(self.client.start(ip))
 
@@ -91,7 +125,6 @@ class Game:
             await self.start_main_loop()
 
             # the following code runs after the main loop terminates
-            self.input_handler_task.cancel()
             self.client_task.cancel()
             # start_main_loop() has ended; close the pygame window
             pygame.quit()
@@ -112,58 +145,36 @@ class Game:
 
     async def handle_message(self, message: bbutils.Message) -> None:
         """Handle a JSON-loaded dict network message."""
+        start = time.perf_counter()
         match message["type"]:
             case constants.Msg.APPROVE:
-                try:
-                    self.groups.tanks[message["id"]].update_state(message["state"])
-                except KeyError:
-                    logging.log(
-                        logging.DEBUG,
-                        f"received APPROVE for player {message['id']} which does not exist",
-                    )
-                else:
-                    num_alive = len(tuple(t for t in self.groups.tanks.values() if t.alive))
-
-                    # Tank.update_state() calls die() if health <= 0
-                    # if this player has died
-                    # and there are at least two players left
-                    if (
-                        message["id"] == self.player_id
-                        and not self.this_player.alive
-                        and num_alive >= 2
-                    ):
-                        self.spectator = shapes.Spectator(
-                            self.this_player.pos, self.this_player.tout, self.this_player.tangle
-                        )
-                        self.groups.update_list.append(self.spectator)
-
-                    # if only one player remains
-                    if not self.debug and num_alive == 1:
-                        # if this player is the winning player
-                        # and we have not already made a victory banner
-                        if self.this_player.alive and self.end_time is None:
-                            self.victory_banner = shapes.VictoryBanner(
-                                pygame.display.get_window_size()
-                            )
-
-                        print(("You" if self.this_player.alive else tuple(self.groups.tanks.values())[0].name) + " won!")
-
-                        # end the game in END_TIME seconds
-                        self.end_time = time.time() + constants.END_TIME
+                for client_id, state, ack in message["states"]:
+                    self.update_tank(client_id, state, ack, message["time"])
+                    if tracing.enabled and client_id == self.player_id and ack != self.traced_ack:
+                        # the input has made it there and back
+                        tracing.flow("f", tracing.input_id(client_id, ack))
+                        self.traced_ack = ack
+                # tanks that have left this player's area of interest
+                for client_id in message.get("hidden", ()):
+                    if client_id in self.groups.tanks and client_id != self.player_id:
+                        self.groups.tanks[client_id].hide()
 
             case constants.Msg.ID:
                 self.player_id = message["id"]
 
             case constants.Msg.MINE:
-                self.groups.update_list.append(
-                    shapes.Mine(
-                        self,
-                        message["id"],
-                        message["mine_id"],
-                        message["pos"],
-                        self.groups.tanks[message["id"]].color,
-                    )
+                # the tank that laid the mine may be gone by the time we hear about it
+                owner = self.groups.tanks.get(message["id"])
+                mine = shapes.Mine(
+                    self,
+                    message["id"],
+                    message["mine_id"],
+                    message["pos"],
+                    owner.color if owner is not None else shapes.Mine.ORPHAN_COLOR,
                 )
+                # the mine was laid a little while ago on the server
+                mine.step(max(self.clock_sync.server_now() - message["time"], 0.0))
+                self.groups.update_list.append(mine)
 
             case constants.Msg.MINE_DIE:
                 for s in self.groups.update_list:
@@ -178,27 +189,39 @@ class Game:
                     message["out"],
                     message["pos"],
                 )
+                # catch up with where the shell is on the server
+                shell.step(max(self.clock_sync.server_now() - message["time"], 0.0))
                 self.groups.update_list.append(shell)
                 if message["id"] == self.player_id:
-                    self.reloadingbar.fire()
+                    self.reloadingbar.fire(self.clock_sync.to_local(message["time"]))
 
             case constants.Msg.SHELL_DIE:
                 for s in self.groups.update_list:
                     if hasattr(s, "shell_id") and s.shell_id == message["shell_id"]:
                         if message["explo"]:
-                            s.hill()
+                            s.hill(self.clock_sync.to_local(message["time"]))
                         else:
                             # no explosion for tank-shell collision
                             s.die()
                             self.sounds.hit_confirmation.play()
 
+            case constants.Msg.PONG:
+                self.clock_sync.pong(message)
+
+            case constants.Msg.SNAPSHOT:
+                try:
+                    world = world_snapshot.decode(base64.b64decode(message["data"]))
+                except ValueError as e:
+                    logging.error(f"could not read the world snapshot: {e}")
+                    exit()
+                self.apply_snapshot(world)
+
             case constants.Msg.START:
                 logging.debug("starting")
                 self.initial_states += message["states"]
 
                 self.ground_hw = message["ground_hw"]
-                self.hill_poses = message["hill_poses"]
-                self.tree_poses = message["tree_poses"]
+                self.generate_map(message["map"])
 
                 # allow the main game loop to start
                 self.start_event.set()
@@ -218,6 +241,126 @@ class Game:
                 # release the event loop to allow the cancellations to take place
                 await asyncio.sleep(0)
 
+        if tracing.enabled:
+            tracing.complete(
+                f"handle {constants.Msg(message['type']).name}", start, time.perf_counter()
+            )
+
+    def apply_snapshot(self, world: dict) -> None:
+        """Catch up with a game in progress from a decoded world snapshot."""
+        if not self.start_event.is_set():
+            # joining for the first time; the snapshot stands in for START
+            self.ground_hw = world["ground_hw"]
+            self.generate_map(world["map"])
+            self.initial_states += [(client_id, state) for client_id, state, _ in world["tanks"]]
+            # without a tank, all we can do is watch
+            if all(client_id != self.player_id for client_id, _, _ in world["tanks"]):
+                self.spectating = True
+            # shells, mines and trees are added by initialize_graphics()
+            self.pending_snapshot = world
+            self.start_event.set()
+            return
+
+        # reconnecting
+        alive = {client_id for client_id, _, _ in world["tanks"]}
+        for client_id, tank in tuple(self.groups.tanks.items()):
+            if tank.alive and client_id not in alive:
+                # destroyed while we were away
+                self.update_tank(client_id, tank.state | {"health": 0}, -1, world["time"])
+        for client_id, state, ack in world["tanks"]:
+            self.update_tank(client_id, state, ack, world["time"])
+        self.add_world_objects(world)
+
+    def add_world_objects(self, world: dict) -> None:
+        """Replace the shells and mines with those in a snapshot and knock over its trees."""
+        self.groups.update_list = [
+            s for s in self.groups.update_list if not isinstance(s, (shapes.Shell, shapes.Mine))
+        ]
+        # how long ago the snapshot was taken
+        age = max(self.clock_sync.server_now() - world["time"], 0.0)
+        for s in world["shells"]:
+            shell = shapes.Shell(s["id"], s["shell_id"], s["angle"], s["out"], s["pos"])
+            shell.step(age)
+            self.groups.update_list.append(shell)
+        for m in world["mines"]:
+            # the tank that laid the mine may be gone
+            owner = self.groups.tanks.get(m["id"])
+            mine = shapes.Mine(
+                self,
+                m["id"],
+                m["mine_id"],
+                m["pos"],
+                owner.color if owner is not None else shapes.Mine.ORPHAN_COLOR,
+            )
+            mine.step(m["age"] + age)
+            self.groups.update_list.append(mine)
+        for index, (x, z, speed) in world["fallen_trees"].items():
+            self.groups.trees[index].fallen((x, 0.0, z), speed)
+
+    def update_tank(self, client_id: int, state: dict, ack: int, server_time: float) -> None:
+        """Apply one tank state from an APPROVE message."""
+        try:
+            tank = self.groups.tanks[client_id]
+            if tank is self.this_player:
+                self.predictor.reconcile(state, ack, server_time)
+            else:
+                tank.push_state(server_time, state)
+        except KeyError:
+            logging.log(
+                logging.DEBUG,
+                f"received APPROVE for player {client_id} which does not exist",
+            )
+        else:
+            num_alive = len(tuple(t for t in self.groups.tanks.values() if t.alive))
+
+            # Tank.update_state() calls die() if health <= 0
+            # if this player has died
+            # and there are at least two players left
+            if client_id == self.player_id and not self.this_player.alive and num_alive >= 2:
+                self.spectator = shapes.Spectator(
+                    self.this_player.pos, self.this_player.tout, self.this_player.tangle
+                )
+                self.groups.update_list.append(self.spectator)
+
+            # if only one player remains
+            # a replay keeps going so it can be rewound
+            if not self.debug and not self.replaying and num_alive == 1:
+                won = not self.spectating and self.this_player.alive
+                # if this player is the winning player
+                # and we have not already made a victory banner
+                if won and self.end_time is None:
+                    self.victory_banner = shapes.VictoryBanner(
+                        pygame.display.get_window_size()
+                    )
+
+                print(
+                    (
+                        "You"
+                        if won
+                        else tuple(t for t in self.groups.tanks.values() if t.alive)[0].name
+                    )
+                    + " won!"
+                )
+
+                # end the game in END_TIME seconds
+                self.end_time = time.time() + constants.END_TIME
+
+    def generate_map(self, params: dict) -> None:
+        """Set self.hill_poses and self.tree_poses from the map parameters in START."""
+        if params["version"] != mapgen.VERSION:
+            logging.error(
+                f"the server uses map version {params['version']}, but this client uses "
+                f"version {mapgen.VERSION}"
+            )
+            exit()
+
+        self.hill_poses, self.tree_poses = mapgen.generate(
+            params["seed"], self.ground_hw, params["hills"], params["trees"]
+        )
+        if mapgen.checksum(self.hill_poses, self.tree_poses) != params["checksum"]:
+            logging.error("the generated map does not match the server's")
+            exit()
+
     def initialize_graphics(self) -> None:
         """
         Set up the pygame and OpenGL environments and generate some display lists.
@@ -262,34 +405,71 @@ class Game:
         glMatrixMode(GL_PROJECTION)
         if not gluPerspective:
             logging.warning("If the program crashes, make sure glew is installed.")
-        gluPerspective(
-            45.0,
-            float(SCR[0]) / float(SCR[1]),
-            0.1,
+        # the server only sends tanks within VIEW_DISTANCE, so there's no point in
+        # drawing further than that
+        view_distance = min(
             # length of the ground diagonal, which is the longest distance the player would need to see
             math.sqrt(8) * self.ground_hw,
+            constants.VIEW_DISTANCE,
         )
+        gluPerspective(45.0, float(SCR[0]) / float(SCR[1]), 0.1, view_distance)
         glMatrixMode(GL_MODELVIEW)
 
+        # fade distant objects into the sky instead of cutting them off abruptly
+        glEnable(GL_FOG)
+        glFogi(GL_FOG_MODE, GL_LINEAR)
+        glFogfv(GL_FOG_COLOR, SKY_COLOR)
+        glFogf(GL_FOG_START, view_distance * constants.FOG_START)
+        glFogf(GL_FOG_END, view_distance)
+
         # set up the explosion displaylists
         shapes.setup_explosion()
 
         # make the sky blue
-        glClearColor(0.25, 0.89, 0.92, 1.0)
+        glClearColor(*SKY_COLOR)
+
+        self.build_world(self.pending_snapshot)
+
+        if self.spectating:
+            # there's no tank to follow, so start in the middle of the map
+            self.this_player = None
+            self.spectator = shapes.Spectator((0.0, 0.0, 0.0), np.array((0.0, 0.0, 1.0)), 0.0)
+            self.groups.update_list.append(self.spectator)
+            self.graphics_ready.set()
+            return
+
+        self.lifebar = shapes.LifeBar(self.groups.tanks[self.player_id], SCR)
+        self.reloadingbar = shapes.ReloadingBar(SCR[0])
+
+        # translates keyboard events from the main loop into REQUESTs
+        self.input_handler = PlayerInputHandler(self)
+        # moves this player's tank without waiting for the server
+        self.predictor = prediction.Predictor(self.this_player, self.clock_sync)
+        self.graphics_ready.set()
+
+    def build_world(self, world: dict | None = None) -> None:
+        """
+        Create the shapes of the map and the tanks.
+
+        The tanks come from world, a decoded world snapshot, if given, otherwise from
+        self.initial_states. Replays call this again to start over from a keyframe.
+        """
+        if world is not None:
+            states = [(client_id, state) for client_id, state, _ in world["tanks"]]
+        else:
+            states = self.initial_states
 
         self.groups.trees = [shapes.Tree(pos) for pos in self.tree_poses]
         self.groups.tanks = dict()
-        for client_id, state in self.initial_states:
+        for client_id, state in states:
             if client_id == self.player_id:
                 self.this_player = shapes.Tank(self, client_id, state)
                 self.groups.tanks[client_id] = self.this_player
             else:
-                self.groups.tanks[client_id] = shapes.Tank(self, client_id, state)
+                self.groups.tanks[client_id] = shapes.RemoteTank(self, client_id, state)
 
         # single-instance shapes
         ground = shapes.Ground(self.ground_hw)
-        self.lifebar = shapes.LifeBar(self.groups.tanks[self.player_id], SCR)
-        self.reloadingbar = shapes.ReloadingBar(SCR[0])
 
         self.groups.update_list = (
             [ground]
@@ -297,11 +477,10 @@ class Game:
             + self.groups.trees
             + [t for t in self.groups.tanks.values() if t.client_id != self.player_id]
         )
-
-        # start listening for keyboard input
-        # self.tg is defined in initialize
-        input_handler = PlayerInputHandler(self)
-        self.input_handler_task = self.tg.create_task(input_handler.run())
+        if world is not None:
+            self.add_world_objects(world)
+        if hasattr(self, "spectator"):
+            self.groups.update_list.append(self.spectator)
 
     def make_mine_explosion(self, pos: tuple, color: tuple) -> None:
         self.groups.update_list.append(shapes.MineExplosion(pos, color))
@@ -315,28 +494,47 @@ class Game:
 
         frame_length = -1.0
         frame_end_time = time.time()
+        # numbers the frames in the trace
+        frame = 0
 
         while self.end_time is None or frame_end_time < self.end_time:
             frame_start_time = frame_end_time
+            self.timer.start()
 
             # listen for input device events
-            pygame.event.pump()
+            for event in pygame.event.get():
+                match event.type:
+                    # quit game on window close or escape key
+                    case pygame.QUIT:
+                        # end right now
+                        # this breaks out of the while loop
+                        self.end_time = frame_start_time
+
+                    case pygame.KEYDOWN if event.key == pygame.K_ESCAPE:
+                        self.end_time = frame_start_time
+
+                    # print FPS to the console when the F key is pressed
+                    case pygame.KEYDOWN if event.key == pygame.K_f:
+                        print(f"{int(round(1 / frame_length))} FPS")
 
-            # print FPS to the console when the F key is pressed
-            if pygame.key.get_pressed()[pygame.K_f]:
-                print(f"{int(round(1 / frame_length))} FPS")
+                    case pygame.KEYDOWN if self.replaying:
+                        self.client.handle_key(event.key)
 
-            # quit game on window close or escape key
-            if pygame.event.get(pygame.QUIT) or pygame.key.get_pressed()[pygame.K_ESCAPE]:
-                # end right now
-                # this breaks out of the while loop
-                self.end_time = frame_start_time
+                    case pygame.KEYDOWN | pygame.KEYUP if not self.spectating:
+                        self.input_handler.handle_event(event)
+            self.timer.lap("events")
+
+            # send the new actions right away instead of waiting for the next frame
+            if not self.spectating:
+                await self.input_handler.flush()
+            self.timer.lap("input")
 
             # clear everything
             glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
             glLoadIdentity()
 
             self.collisions()
+            self.timer.lap("collisions")
 
             # gluLookAt needs to be called immediately after player update to avoid
             # "jumping" artifacts resulting from respective .pos 's being updated at
@@ -352,9 +550,9 @@ class Game:
             else:
                 if self.this_player.alive:
                     shapes.HeadlessTank.update(self.this_player)
-                camera_pos = np.array(
-                    (self.this_player.pos[0], constants.CAMERA_HEIGHT, self.this_player.pos[2])
-                )
+                    self.predictor.smooth()
+                render_pos = self.this_player.pos + self.this_player.render_offset
+                camera_pos = np.array((render_pos[0], constants.CAMERA_HEIGHT, render_pos[2]))
                 camera_out = self.this_player.tout
             gluLookAt(
                 # pos
@@ -364,16 +562,19 @@ class Game:
                 # up
                 *constants.UP,
             )
-            if self.this_player.alive:
+            if not self.spectating and self.this_player.alive:
                 self.this_player.gl_update()
+            self.timer.lap("player")
 
             for shape in self.groups.update_list:
                 shape.update()
             # overlays must be updated last to render correctly
-            self.lifebar.update()
+            if not self.spectating:
+                self.lifebar.update()
             if hasattr(self, "victory_banner"):
                 self.victory_banner.update()
-            self.reloadingbar.update()
+            if not self.spectating:
+                self.reloadingbar.update()
 
             # I think this is a little slower than list.remove() because a whole new
             # linked list has to be built; however, it seems more Pythonic than
@@ -382,11 +583,17 @@ class Game:
                 client_id: tank for client_id, tank in self.groups.tanks.items() if tank.alive
             }
             self.groups.update_list = [shape for shape in self.groups.update_list if shape.alive]
+            self.timer.lap("shapes")
 
             pygame.display.flip()
+            self.timer.lap("flip")
 
             # allow other async stuff (including networking) to take over
             await asyncio.sleep(0)
+            self.timer.lap("messages")
+            if tracing.enabled:
+                tracing.complete("frame", self.timer.started, self.timer.last, frame=frame)
+            frame += 1
 
             frame_end_time = time.time()
             frame_length = frame_end_time - frame_start_time
@@ -398,44 +605,61 @@ class PlayerInputHandler:
     def __init__(self, game: Game) -> None:
         self.game = game
 
-    async def run(self) -> None:
-        """Interface to send requests to the server."""
-        # to avoid sending the same set of actions twice in a row
-        prev_actions: Optional[list[constants.Action]] = None
-        while self.game.this_player.alive:
-            try:
-                pressed = pygame.key.get_pressed()
-                actions: list[constants.Action] = [
-                    action
-                    for key_combo, action in constants.KEYMAP
-                    # if all the keys in the combo are pressed
-                    if all([pressed[k] for k in key_combo])
-                ]
-                # corner case: if TURRET_x or BASE_x, then ALL_x cannot be true
-                if constants.Action.TURRET_LEFT in actions or constants.Action.BASE_LEFT in actions:
-                    actions.remove(constants.Action.ALL_LEFT)
-                if (
-                    constants.Action.TURRET_RIGHT in actions
-                    or constants.Action.BASE_RIGHT in actions
-                ):
-                    actions.remove(constants.Action.ALL_RIGHT)
-                # corner case: cannot snap back in the presence of ctrl key
-                if constants.Action.TURN_BACK in actions:
-                    actions.remove(constants.Action.SNAP_BACK)
-
-                # only send the actions if they are different from last time
-                if actions != prev_actions:
-                    await self.game.client.send_actions(actions)
-                    prev_actions = actions
-
-                await asyncio.sleep(constants.INPUT_CHECK_WAIT)
-
-            except asyncio.CancelledError:
-                # usually this happens because the main loop ends before the game does
-                break
-
-
-async def main(host, no_music, debug) -> None:
+        # keys from constants.KEYMAP_KEYS that are currently held down
+        self.pressed: set[int] = set()
+        # the actions most recently sent to the server
+        self.actions: list[constants.Action] = []
+        # whether self.actions has changed since the last flush()
+        self.changed = False
+
+    def handle_event(self, event: pygame.event.Event) -> None:
+        """Update the set of pressed keys from a KEYDOWN or KEYUP event."""
+        # keys that aren't part of any action can't change the actions
+        if event.key not in constants.KEYMAP_KEYS:
+            return
+
+        if event.type == pygame.KEYDOWN:
+            self.pressed.add(event.key)
+        else:
+            self.pressed.discard(event.key)
+
+        actions = self.get_actions()
+        # only send the actions if they are different from last time
+        if actions != self.actions:
+            self.actions = actions
+            self.changed = True
+
+    def get_actions(self) -> list[constants.Action]:
+        """Return the actions corresponding to the currently pressed keys."""
+        actions: list[constants.Action] = [
+            action
+            for key_combo, action in constants.KEYMAP
+            # if all the keys in the combo are pressed
+            if self.pressed.issuperset(key_combo)
+        ]
+        # corner case: if TURRET_x or BASE_x, then ALL_x cannot be true
+        if constants.Action.TURRET_LEFT in actions or constants.Action.BASE_LEFT in actions:
+            actions.remove(constants.Action.ALL_LEFT)
+        if constants.Action.TURRET_RIGHT in actions or constants.Action.BASE_RIGHT in actions:
+            actions.remove(constants.Action.ALL_RIGHT)
+        # corner case: cannot snap back in the presence of ctrl key
+        if constants.Action.TURN_BACK in actions:
+            actions.remove(constants.Action.SNAP_BACK)
+        return actions
+
+    async def flush(self) -> None:
+        """Send a REQUEST message if the actions have changed since the last call."""
+        if self.changed and self.game.this_player.alive:
+            seq = self.game.predictor.record(self.actions)
+            if tracing.enabled:
+                tracing.flow("s", tracing.input_id(self.game.player_id, seq))
+            await self.game.client.send_actions(self.actions, seq)
+        self.changed = False
+
+
+async def main(
+    host, no_music, debug, transport, spectate, replay_path=None, trace_path=None
+) -> None:
     # set up logging
     logger = logging.getLogger("websockets")
     if debug:
@@ -448,9 +672,20 @@ async def main(host, no_music, debug) -> None:
 
     print("Welcome to Bang Bang " + constants.VERSION)
 
-    game = Game(no_music, debug)
+    if trace_path is not None:
+        tracing.enable("client")
+    # initialize_graphics() and the frames themselves block the event loop
+    dog = watchdog.Watchdog("client", constants.Watchdog.CLIENT_THRESHOLD)
+    watching = asyncio.create_task(dog.run())
+    game = Game(no_music, debug, transport, spectate, replay_path is not None)
     try:
-        await game.initialize(host)
+        await game.initialize(replay_path or host)
     except (socket.gaierror, OSError):
         logging.error(f"could not connect to {host}")
         exit()
+    finally:
+        watching.cancel()
+        if debug:
+            print(dog.report())
+        if trace_path is not None:
+            tracing.write(trace_path)
@@ -0,0 +1,86 @@
+"""
+Lag compensation: a record of where every tank was on recent ticks.
+
+A player aims at remote tanks as they are drawn, which is where they were about half
+a round trip plus constants.Interpolation.DELAY ago. Checking shells against those
+old positions instead of the current ones makes hits land where the player saw them.
+"""
+
+import math
+from collections.abc import Iterable
+
+import numpy as np
+
+import constants
+
+# columns of TankHistory.frames
+X, Z, BANGLE = range(3)
+
+
+class TankHistory(constants.LagCompensation):
+    """Ring buffer of the ground position and base angle of every tank, one row per tick."""
+
+    def __init__(self, client_ids: Iterable[int]) -> None:
+        # ticks needed to cover MAX_REWIND, plus the current one
+        self.length = math.ceil(self.MAX_REWIND * constants.TICK_RATE) + 1
+        # column of each tank in the arrays below; the set of tanks is fixed per game
+        self.slots = {client_id: slot for slot, client_id in enumerate(client_ids)}
+        self.ids = np.array(list(self.slots), dtype=np.int64)
+
+        # tick stored in each row, or -1 if the row is empty
+        self.ticks = np.full(self.length, -1, dtype=np.int64)
+        self.frames = np.zeros((self.length, len(self.slots), 3), dtype=np.float32)
+        # whether each tank was alive on each tick
+        self.alive = np.zeros((self.length, len(self.slots)), dtype=bool)
+
+    def record(self, tick: int, tanks: dict) -> None:
+        """Store the tanks (indexed by client id) as they are at the end of tick."""
+        row = tick % self.length
+        self.ticks[row] = tick
+        self.alive[row] = False
+        frame = self.frames[row]
+        for client_id, tank in tanks.items():
+            slot = self.slots[client_id]
+            frame[slot, X] = tank.pos[0]
+            frame[slot, Z] = tank.pos[2]
+            frame[slot, BANGLE] = tank.bangle
+            self.alive[row, slot] = True
+
+    def rewind_ticks(self, rtt: float) -> int:
+        """Return how many ticks back a client with the given round-trip time sees."""
+        seconds = min(rtt / 2 + constants.Interpolation.DELAY, self.MAX_REWIND)
+        return round(seconds * constants.TICK_RATE)
+
+    def hits(self, tick: int, pos: np.ndarray) -> list[int]:
+        """
+        Return the ids of the tanks that something at pos would have hit on tick.
+
+        Falls back to the oldest stored tick if tick is no longer in the buffer. Only
+        the ground plane is considered, like the tank-shell check in Server.collisions.
+        """
+        row = tick % self.length
+        if self.ticks[row] != tick:
+            row = int(np.argmin(np.where(self.ticks < 0, np.iinfo(np.int64).max, self.ticks)))
+        frame = self.frames[row]
+
+        radians = np.radians(frame[:, BANGLE])
+        # (x, z) of HeadlessTank.bout for every tank at once
+        bout = np.stack((np.sin(radians), np.cos(radians)), axis=1)
+        centers = frame[:, (X, Z)]
+        # the three spheres of collisions.tank_collision_spheres
+        spheres = np.stack(
+            (
+                centers,
+                centers - bout * constants.Tank.COLLISION_SPHERE_BACK,
+                centers + bout * constants.Tank.COLLISION_SPHERE_FRONT,
+            ),
+            axis=1,
+        )
+        squared = ((spheres - np.array((pos[0], pos[2]), dtype=np.float32)) ** 2).sum(axis=2)
+        hit = (squared < constants.Tank.RADIUS**2).any(axis=1) & self.alive[row]
+        return self.ids[hit].tolist()
+
+    @property
+    def nbytes(self) -> int:
+        """Return the memory used by the arrays."""
+        return self.ticks.nbytes + self.frames.nbytes + self.alive.nbytes + self.ids.nbytes
@@ -0,0 +1,46 @@
+"""Area-of-interest filtering: which clients need to hear about which tanks."""
+
+from collections.abc import Iterable
+
+import numpy as np
+
+import constants
+
+
+def relevant_tanks(
+    positions: dict[int, np.ndarray], previous: dict[int, set[int]]
+) -> dict[int, set[int]]:
+    """
+    Return the ids of the tanks relevant to each tank.
+
+    A tank becomes relevant once it is within AreaOfInterest.RADIUS and stops being
+    relevant once it is further than RADIUS + HYSTERESIS, so tanks near the edge don't
+    flicker in and out. previous holds the result of the last call. A tank is always
+    relevant to itself.
+    """
+    if not positions:
+        return {}
+
+    ids = list(positions)
+    # only the ground plane matters
+    flat = np.array([positions[i] for i in ids])[:, (0, 2)]
+    distances = np.sqrt(((flat[:, np.newaxis, :] - flat[np.newaxis, :, :]) ** 2).sum(axis=2))
+    entering = distances < constants.AreaOfInterest.RADIUS
+    staying = distances < constants.AreaOfInterest.RADIUS + constants.AreaOfInterest.HYSTERESIS
+
+    relevant = {}
+    for row, tank_id in enumerate(ids):
+        old = previous.get(tank_id, set())
+        relevant[tank_id] = {
+            other
+            for col, other in enumerate(ids)
+            if entering[row, col] or (staying[row, col] and other in old)
+        }
+    return relevant
+
+
+def is_near(pos: Iterable[float], tank_pos: np.ndarray) -> bool:
+    """Return True if something at pos is within the area of interest of a tank."""
+    return (pos[0] - tank_pos[0]) ** 2 + (pos[2] - tank_pos[2]) ** 2 < (
+        constants.AreaOfInterest.RADIUS**2
+    )
@@ -0,0 +1,72 @@
+"""Smooth rendering of remote tanks from timestamped server states."""
+
+import collections
+
+import numpy as np
+
+import constants
+
+# state keys that are interpolated instead of applied as soon as they arrive
+KINEMATIC_KEYS = frozenset(("actions", "bangle", "pos", "speed", "tangle"))
+
+
+def lerp_angle(a: float, b: float, fraction: float) -> float:
+    """Interpolate between two angles in degrees along the shortest path."""
+    diff = ((b - a + 180.0) % 360.0) - 180.0
+    return (a + diff * fraction) % 360.0
+
+
+class SnapshotBuffer(constants.Interpolation):
+    """The recent server states of one remote tank."""
+
+    def __init__(self) -> None:
+        # (server_time, state) in order of increasing server_time
+        self.snapshots: collections.deque[tuple[float, dict]] = collections.deque(
+            maxlen=self.BUFFER_LENGTH
+        )
+
+    def push(self, server_time: float, state: dict) -> None:
+        """Add a state; states older than the newest one are discarded."""
+        if self.snapshots and server_time <= self.snapshots[-1][0]:
+            return
+        self.snapshots.append(
+            (server_time, {k: v for k, v in state.items() if k in KINEMATIC_KEYS})
+        )
+
+    def apply(self, tank: "shapes.HeadlessTank", render_time: float) -> None:
+        """Move tank to where it was at render_time on the server's clock."""
+        if not self.snapshots:
+            return
+
+        oldest_time, oldest = self.snapshots[0]
+        if render_time <= oldest_time:
+            self._set(tank, oldest)
+            return
+
+        newest_time, newest = self.snapshots[-1]
+        if render_time >= newest_time:
+            # we've run out of states; guess where the tank went, but not for too long
+            self._set(tank, newest)
+            tank.step(min(render_time - newest_time, self.MAX_EXTRAPOLATION))
+            return
+
+        # find the pair of states surrounding render_time
+        for (a_time, a), (b_time, b) in zip(self.snapshots, list(self.snapshots)[1:]):
+            if a_time <= render_time <= b_time:
+                fraction = (render_time - a_time) / (b_time - a_time)
+                tank.pos = np.array(a["pos"]) + (
+                    np.array(b["pos"]) - np.array(a["pos"])
+                ) * fraction
+                tank.bangle = lerp_angle(a["bangle"], b["bangle"], fraction)
+                tank.tangle = lerp_angle(a["tangle"], b["tangle"], fraction)
+                tank.speed = a["speed"] + (b["speed"] - a["speed"]) * fraction
+                tank.actions = set(a["actions"])
+                return
+
+    @staticmethod
+    def _set(tank: "shapes.HeadlessTank", state: dict) -> None:
+        tank.pos = np.array(state["pos"], dtype=float)
+        tank.bangle = state["bangle"]
+        tank.tangle = state["tangle"]
+        tank.speed = state["speed"]
+        tank.actions = set(state["actions"])
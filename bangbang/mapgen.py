@@ -0,0 +1,101 @@
+"""
+Deterministic map generation shared by the server and the clients.
+
+The server only sends the seed and parameters; every client generates the same hills
+and trees from them. Anything that changes the output of generate() must increment
+VERSION.
+"""
+
+import struct
+import zlib
+
+import numpy as np
+
+import collisions
+import constants
+
+# increment whenever generate() or Random would produce different output
+VERSION = 1
+
+_MASK = (1 << 64) - 1
+
+
+class Random:
+    """
+    SplitMix64 pseudorandom number generator.
+
+    The output of the standard library's random module is not guaranteed to stay the
+    same between Python versions, but ours is part of the network protocol.
+    """
+
+    def __init__(self, seed: int) -> None:
+        self.state = seed & _MASK
+
+    def next_u64(self) -> int:
+        self.state = (self.state + 0x9E3779B97F4A7C15) & _MASK
+        z = self.state
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK
+        return z ^ (z >> 31)
+
+    def random(self) -> float:
+        """Return a float in [0, 1) with 53 random bits."""
+        return (self.next_u64() >> 11) * (1.0 / (1 << 53))
+
+    def uniform(self, a: float, b: float) -> float:
+        """Return a float between a and b."""
+        return a + (b - a) * self.random()
+
+
+def checksum(hill_poses: list[tuple[float]], tree_poses: list[tuple[float]]) -> int:
+    """Return a CRC32 of the exact bits of all hill and tree positions."""
+    coords = [c for pos in hill_poses + tree_poses for c in pos]
+    return zlib.crc32(struct.pack(f"<{len(coords)}d", *coords))
+
+
+def generate(
+    seed: int, ground_hw: int, hill_count: int, tree_count: int
+) -> tuple[list[tuple[float]], list[tuple[float]]]:
+    """Return the hill and tree positions of the map described by the arguments."""
+    rng = Random(seed)
+
+    hill_poses: list[tuple] = [
+        # (x, y, z)
+        (
+            rng.uniform(
+                -ground_hw + constants.HILL_BUFFER,
+                ground_hw - constants.HILL_BUFFER,
+            ),
+            0.0,
+            rng.uniform(
+                -ground_hw + constants.HILL_BUFFER,
+                ground_hw - constants.HILL_BUFFER,
+            ),
+        )
+        for _ in range(hill_count)
+    ]
+
+    def _gen_tree_pos():
+        valid = False
+        while not valid:
+            pos = (
+                rng.uniform(
+                    -ground_hw + constants.TREE_BUFFER,
+                    ground_hw - constants.TREE_BUFFER,
+                ),
+                0.0,
+                rng.uniform(
+                    -ground_hw + constants.TREE_BUFFER,
+                    ground_hw - constants.TREE_BUFFER,
+                ),
+            )
+            valid = True
+            for hill_pos in hill_poses:
+                if collisions.collide_hill(np.array(pos), np.array(hill_pos)):
+                    valid = False
+                    break
+        return pos
+
+    tree_poses: list[tuple] = [_gen_tree_pos() for _ in range(tree_count)]
+
+    return hill_poses, tree_poses
@@ -0,0 +1,298 @@
+"""
+Counters, gauges, and histograms describing what the server is doing.
+
+serve() makes them available over HTTP in the Prometheus text format so they can be
+scraped while the server runs.
+"""
+
+import asyncio
+import bisect
+from collections.abc import Callable, Iterator
+import logging
+import math
+import time
+
+import tracing
+
+
+class Metric:
+    """A named value, optionally split up by labels."""
+
+    def __init__(self, name: str, description: str) -> None:
+        self.name = name
+        self.description = description
+        # value for each set of labels; labels are stored as a sorted tuple of pairs
+        self.values: dict[tuple[tuple[str, str], ...], float] = {}
+        REGISTRY[name] = self
+
+    # the Prometheus metric type
+    kind = "untyped"
+
+    def get(self, **labels) -> float:
+        """Return the value for the given labels."""
+        return self.values.get(_key(labels), 0)
+
+    def samples(self) -> Iterator[tuple[str, tuple[tuple[str, str], ...], float]]:
+        """Yield the (name, labels, value) samples to expose."""
+        for key, value in self.values.items():
+            yield self.name, key, value
+
+
+class Counter(Metric):
+    """A value that only ever goes up."""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that can go up and down."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        self.values[_key(labels)] = value
+
+    def clear(self) -> None:
+        """Forget the values for every set of labels, such as those of departed clients."""
+        self.values.clear()
+
+
+class Distribution:
+    """
+    Counts of values in buckets of constant relative width, like HdrHistogram.
+
+    Each power of two above UNIT is split into SUB_BUCKETS buckets, so percentiles
+    are within 1 / SUB_BUCKETS of the true value however large it is, recording a
+    value is a few arithmetic operations, and memory only grows with the number of
+    distinct buckets used.
+    """
+
+    SUB_BUCKETS = 32
+    # values below this are counted as this
+    UNIT = 1e-6
+
+    def __init__(self) -> None:
+        # number of values in each bucket, by bucket index
+        self.counts: dict[int, int] = {}
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        mantissa, exponent = math.frexp(value / self.UNIT)
+        # exponent is at least 1 for values of UNIT and above; bucket 0 is below UNIT
+        index = (
+            exponent * self.SUB_BUCKETS + int((mantissa - 0.5) * 2 * self.SUB_BUCKETS)
+            if exponent > 0
+            else 0
+        )
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def upper(self, index: int) -> float:
+        """Return the largest value counted in bucket index."""
+        if index == 0:
+            return self.UNIT
+        exponent, sub = divmod(index, self.SUB_BUCKETS)
+        return math.ldexp(0.5 + (sub + 1) / (2 * self.SUB_BUCKETS), exponent) * self.UNIT
+
+    def percentile(self, q: float) -> float:
+        """Return the value that q percent of the values are at or below."""
+        if not self.count:
+            return 0.0
+        rank = max(math.ceil(q / 100 * self.count), 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                break
+        return min(self.upper(index), self.max)
+
+
+class Histogram(Metric):
+    """
+    Counts of values in fixed buckets for each set of labels, like Prometheus expects.
+
+    The buckets are too coarse for good percentiles; keep a Distribution for those.
+    """
+
+    kind = "histogram"
+    # upper bounds of the buckets: powers of two from about 1 µs to 1 s
+    BOUNDS = tuple(2.0**exponent for exponent in range(-20, 1))
+
+    def __init__(self, name: str, description: str) -> None:
+        super().__init__(name, description)
+        # for each set of labels, the number of values in each bucket, and then
+        # the number above the last bound
+        self.buckets: dict[tuple[tuple[str, str], ...], list[int]] = {}
+        self.sums: dict[tuple[tuple[str, str], ...], float] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = _key(labels)
+        if key not in self.buckets:
+            self.buckets[key] = [0] * (len(self.BOUNDS) + 1)
+            self.sums[key] = 0.0
+        self.buckets[key][bisect.bisect_left(self.BOUNDS, value)] += 1
+        self.sums[key] += value
+
+    def samples(self) -> Iterator[tuple[str, tuple[tuple[str, str], ...], float]]:
+        for key, counts in self.buckets.items():
+            seen = 0
+            for bound, count in zip(self.BOUNDS, counts):
+                seen += count
+                yield f"{self.name}_bucket", key + (("le", repr(bound)),), seen
+            seen += counts[-1]
+            yield f"{self.name}_bucket", key + (("le", "+Inf"),), seen
+            yield f"{self.name}_sum", key, self.sums[key]
+            yield f"{self.name}_count", key, seen
+
+
+class PhaseTimer:
+    """
+    Times the consecutive phases of a tick.
+
+    Call start() at the beginning of the tick and lap() at the end of each phase;
+    durations then has the seconds each phase took. Each phase is also a span of the
+    trace when tracing is enabled.
+    """
+
+    def __init__(self) -> None:
+        self.durations: dict[str, float] = {}
+        # time.perf_counter() at the last start() and at the end of the last phase
+        self.started = self.last = time.perf_counter()
+
+    def start(self) -> None:
+        self.durations.clear()
+        self.started = self.last = time.perf_counter()
+
+    def lap(self, phase: str) -> None:
+        """End phase, which started when the previous one ended."""
+        now = time.perf_counter()
+        self.durations[phase] = self.durations.get(phase, 0.0) + now - self.last
+        if tracing.enabled:
+            tracing.complete(phase, self.last, now)
+        self.last = now
+
+
+def _key(labels: dict) -> tuple[tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: tuple[tuple[str, str], ...]) -> str:
+    if not key:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in key
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def render() -> str:
+    """Return every metric in the Prometheus text format, after running the collectors."""
+    for collect in COLLECTORS:
+        collect()
+    lines = []
+    for metric in REGISTRY.values():
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, key, value in metric.samples():
+            lines.append(f"{name}{_format_labels(key)} {float(value)!r}")
+    return "\n".join(lines) + "\n"
+
+
+async def _handle_scrape(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request = await reader.readline()
+        # skip the headers
+        while await reader.readline() not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request.split()
+        if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] == b"/metrics":
+            status = "200 OK"
+            body = render().encode()
+        else:
+            status = "404 Not Found"
+            body = b"only /metrics is here\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host: str, port: int) -> asyncio.Server:
+    """
+    Start answering GET /metrics on host:port and return the asyncio.Server.
+
+    Each scrape is rendered on the event loop between ticks, so there is nothing to
+    lock, and nothing is done when nobody is scraping.
+    """
+    server = await asyncio.start_server(_handle_scrape, host, port)
+    logging.debug(f"serving metrics on http://{host}:{port}/metrics")
+    return server
+
+
+# every metric that has been created, indexed by name
+REGISTRY: dict[str, Metric] = {}
+# functions that update gauges right before a scrape, for values that are cheaper to
+# read when asked for than to keep up to date
+COLLECTORS: list[Callable[[], None]] = []
+
+INPUTS_RECEIVED = Counter("bangbang_inputs_received_total", "REQUEST messages received")
+INPUTS_DROPPED = Counter(
+    "bangbang_inputs_dropped_total", "Malformed messages and messages over the rate limit"
+)
+INPUTS_COALESCED = Counter(
+    "bangbang_inputs_coalesced_total", "REQUEST messages replaced by a newer one before a tick"
+)
+
+CHECKPOINT_SECONDS = Histogram(
+    "bangbang_checkpoint_seconds",
+    "Time taken by checkpoints, split into capture (on the tick) and write",
+)
+CHECKPOINT_BYTES = Gauge("bangbang_checkpoint_bytes", "Compressed size of the newest checkpoint")
+CHECKPOINTS_WRITTEN = Counter("bangbang_checkpoints_written_total", "Checkpoints written to disk")
+RECORDING_BYTES = Counter("bangbang_recording_bytes_total", "Bytes written to match recordings")
+
+TICK_SECONDS = Histogram(
+    "bangbang_tick_seconds", "Time taken by each phase of the server tick, and by the whole tick"
+)
+TICK_OVERRUNS = Counter(
+    "bangbang_tick_overruns_total", "Ticks that took longer than TickTiming.BUDGET"
+)
+
+CLIENTS = Gauge("bangbang_clients", "Connected clients, by kind (player or relay)")
+TANKS = Gauge("bangbang_tanks", "Live tanks")
+SHELLS = Gauge("bangbang_shells", "Live shells")
+MINES = Gauge("bangbang_mines", "Live mines")
+QUEUE_DEPTH = Gauge("bangbang_queue_depth", "Messages waiting to be sent to each client")
+RTT_SECONDS = Gauge("bangbang_rtt_seconds", "Round-trip time to each player")
+
+MESSAGES_SENT = Counter("bangbang_messages_sent_total", "Messages sent to clients, by type")
+BYTES_SENT = Counter("bangbang_bytes_sent_total", "Bytes of messages sent to clients, by type")
+MESSAGES_RECEIVED = Counter(
+    "bangbang_messages_received_total", "Messages received from clients, by type"
+)
+BYTES_RECEIVED = Counter(
+    "bangbang_bytes_received_total", "Bytes of messages received from clients, by type"
+)
+
+EVENT_LOOP_LAG = Histogram(
+    "bangbang_event_loop_lag_seconds", "How late the event loop runs a coroutine that is due"
+)
+EVENT_LOOP_STALLS = Counter(
+    "bangbang_event_loop_stalls_total", "Times the event loop was blocked for too long"
+)
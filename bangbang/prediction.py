@@ -0,0 +1,85 @@
+"""Client-side prediction and server reconciliation for the local tank."""
+
+import collections
+from collections.abc import Iterable
+import math
+import time
+
+import numpy as np
+
+from base_shapes import Timer
+import constants
+import utils_3d
+
+
+class Predictor(Timer, constants.Prediction):
+    """
+    Apply the player's inputs to the local tank immediately and correct it later.
+
+    Every input is given a sequence number and kept in a ring buffer until the server
+    acknowledges it. When an APPROVE arrives, the tank is reset to the authoritative
+    state and the inputs the server hasn't seen yet are replayed on top of it.
+    """
+
+    def __init__(self, tank: "shapes.Tank", clock_sync: "clock_sync.ClockSync") -> None:
+        super().__init__()
+        self.tank = tank
+        self.clock_sync = clock_sync
+
+        # (seq, actions, timestamp) for each input not yet acknowledged by the server
+        self.history: collections.deque[tuple[int, set[constants.Action], float]] = (
+            collections.deque(maxlen=self.HISTORY_LENGTH)
+        )
+        # sequence number of the next input
+        self.next_seq = 0
+
+    def record(self, actions: Iterable[constants.Action]) -> int:
+        """Apply actions to the local tank and return the sequence number to send."""
+        seq = self.next_seq
+        self.next_seq += 1
+
+        actions = set(actions)
+        self.history.append((seq, actions, time.time()))
+        self.tank.actions = actions
+        return seq
+
+    def reconcile(self, state: dict, ack: int, server_time: float) -> None:
+        """
+        Snap to an authoritative state and replay the unacknowledged inputs.
+
+        server_time is when the server sent the state, on the server's clock.
+        """
+        now = time.time()
+
+        # forget the inputs the server has already applied
+        while self.history and self.history[0][0] <= ack:
+            self.history.popleft()
+
+        # where the player currently sees the tank
+        old_pos = self.tank.pos + self.tank.render_offset
+
+        self.tank.update_state(state)
+        if not self.tank.alive:
+            return
+
+        replay_time = min(self.clock_sync.to_local(server_time), now)
+        for _, actions, timestamp in self.history:
+            if timestamp > replay_time:
+                self.tank.step(timestamp - replay_time)
+                replay_time = timestamp
+            self.tank.actions = actions
+        if now > replay_time:
+            self.tank.step(now - replay_time)
+        # the replay has already accounted for the time up to now
+        self.tank.clock = now
+
+        # hide small corrections by easing the rendered tank towards the new position
+        error = old_pos - self.tank.pos
+        if utils_3d.mag(error) < self.SNAP_DISTANCE:
+            self.tank.render_offset = error
+        else:
+            self.tank.render_offset = np.zeros(3)
+
+    def smooth(self) -> None:
+        """Decay the render offset; call once per frame."""
+        self.tank.render_offset *= math.exp(-self.delta_time() / self.SMOOTH_TIME)
@@ -0,0 +1,109 @@
+"""
+Profile the running server from its console without interrupting the match.
+
+'profile <seconds>' runs cProfile over everything the event loop does, including
+the tick loop and networking, and writes a pstats file. 'alloc <seconds>' traces
+memory allocations with tracemalloc and writes the lines that allocated the most
+memory that was still in use at the end. Both stop on their own and write their
+report to the working directory.
+"""
+
+import asyncio
+import cProfile
+import time
+import tracemalloc
+
+import constants
+
+
+def _report_path(kind: str, extension: str) -> str:
+    return f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}.{extension}"
+
+
+def _write_allocations(
+    snapshot: tracemalloc.Snapshot, seconds: float, peak: int, path: str, top: int
+) -> None:
+    snapshot = snapshot.filter_traces(
+        (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        )
+    )
+    stats = snapshot.statistics("lineno")
+    with open(path, "w") as f:
+        f.write(
+            f"Memory allocated in {seconds:g} s and still in use at the end: "
+            f"{sum(stat.size for stat in stats) / 1024:.1f} KiB "
+            f"(peak {peak / 1024:.1f} KiB)\n\n"
+        )
+        for stat in stats[:top]:
+            frame = stat.traceback[0]
+            f.write(
+                f"{stat.size / 1024:10.1f} KiB {stat.count:8} blocks  "
+                f"{frame.filename}:{frame.lineno}\n"
+            )
+
+
+class Profiler(constants.Profiler):
+    """Runs one profile or alloc command at a time."""
+
+    def __init__(self) -> None:
+        self.task: asyncio.Task | None = None
+
+    def command(self, words: list[str]) -> None:
+        """Handle a profile or alloc console command that has been split into words."""
+        usage = f"Usage: {words[0]} <seconds>"
+        try:
+            (seconds,) = map(float, words[1:])
+        except ValueError:
+            print(usage)
+            return
+        if not 0 < seconds <= self.MAX_SECONDS:
+            print(f"{usage}, up to {self.MAX_SECONDS:g} seconds")
+            return
+        if self.task is not None and not self.task.done():
+            print("Already profiling; wait for it to finish")
+            return
+        if words[0] == constants.SERVER_PROFILE_KEYWORD:
+            self.task = asyncio.create_task(self.profile(seconds))
+        else:
+            self.task = asyncio.create_task(self.trace_allocations(seconds))
+
+    async def profile(self, seconds: float) -> None:
+        """Run cProfile for seconds and write the stats to a file."""
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # another profiler is already running
+            print(f"Can't profile: {e}")
+            return
+        print(f"Profiling for {seconds:g} seconds...")
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+        path = _report_path("profile", "pstats")
+        await asyncio.to_thread(profiler.dump_stats, path)
+        print(f"Wrote the profile to {path}; read it with 'python -m pstats {path}'")
+
+    async def trace_allocations(self, seconds: float) -> None:
+        """Trace allocations for seconds and write the top allocating lines to a file."""
+        if tracemalloc.is_tracing():
+            print("Can't trace allocations: tracemalloc is already running")
+            return
+        print(f"Tracing allocations for {seconds:g} seconds...")
+        tracemalloc.start(self.FRAMES)
+        try:
+            await asyncio.sleep(seconds)
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        path = _report_path("alloc", "txt")
+        # sorting the traces takes a while, so don't hold up the game
+        await asyncio.to_thread(
+            _write_allocations, snapshot, seconds, peak, path, self.TOP_ALLOCATIONS
+        )
+        print(f"Wrote the allocation report to {path}")
@@ -0,0 +1,291 @@
+"""
+Append-only recordings of matches.
+
+The server records every REQUEST it applies, tagged with the tick it was applied
+on, and every message it broadcasts. Every Recording.KEYFRAME_INTERVAL seconds it
+also records a keyframe: an uncompressed world_snapshot of the whole world, from
+which a viewer can start without the messages before it.
+
+The tick only puts records on a queue. A Recorder thread packs them into blocks,
+compresses each block with zlib, and appends it to the file. Every keyframe starts a
+new block, so seeking to a keyframe means seeking to a block. When the recording is
+closed, an index of the keyframe blocks is appended along with a footer that points
+to it. A recording that was never closed (say the server crashed) is still readable;
+Recording rebuilds the index by skipping from block header to block header.
+
+File layout: FILE_HEADER, then blocks, each a BLOCK header followed by its data,
+then an INDEX block and the FOOTER. Inside a compressed block, each record is a
+RECORD header followed by its payload.
+"""
+
+import bisect
+from collections.abc import Iterator
+import enum
+import logging
+import mmap
+import queue
+import struct
+import threading
+import time
+import zlib
+
+import constants
+import metrics
+import world_snapshot
+
+# magic, format version, wall-clock time the recording started
+FILE_HEADER = struct.Struct("<4sBd")
+MAGIC = b"BBRC"
+# increment whenever the format changes
+VERSION = 1
+
+# kind of block, length of the data that follows, number of records, tick and time of
+# the first record
+BLOCK = struct.Struct("<BIIQd")
+# kind of record, tick, server time, length of the payload that follows
+RECORD = struct.Struct("<BQdI")
+# tick, time, and file offset of a keyframe block
+INDEX_ENTRY = struct.Struct("<Qdq")
+# offset of the INDEX block, time of the last record, magic
+FOOTER = struct.Struct("<Qd4s")
+FOOTER_MAGIC = b"BBRI"
+# payload of an INPUT record: client id, seq, action bitmask
+INPUT = struct.Struct("<iiI")
+
+
+@enum.unique
+class Block(enum.IntEnum):
+    """Enum for block kinds."""
+
+    DATA = enum.auto()      # compressed records
+    KEYFRAME = enum.auto()  # compressed records, starting with a KEYFRAME
+    INDEX = enum.auto()     # uncompressed INDEX_ENTRYs
+
+
+@enum.unique
+class Record(enum.IntEnum):
+    """Enum for record kinds."""
+
+    INPUT = enum.auto()     # a REQUEST applied by the server; see INPUT
+    MESSAGE = enum.auto()   # a broadcast message, as JSON
+    KEYFRAME = enum.auto()  # the world, as made by world_snapshot.pack()
+
+
+def decode_input(payload: bytes) -> tuple[int, list[constants.Action], int]:
+    """Return the (client id, actions, seq) of an INPUT record."""
+    client_id, seq, actions = INPUT.unpack(payload)
+    return client_id, world_snapshot.unpack_actions(actions), seq
+
+
+class Recorder(constants.Recording):
+    """Writes a recording on a background thread."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        # (kind, tick, time, payload) records waiting for the thread; None means close
+        self.queue: queue.SimpleQueue[tuple | None] = queue.SimpleQueue()
+
+        # the rest is only used by the thread
+        # records packed since the last block was written
+        self.pending = bytearray()
+        self.pending_count = 0
+        self.pending_kind = Block.DATA
+        # tick and time of the first pending record
+        self.pending_start = (0, 0.0)
+        # time of the newest record
+        self.last_time = 0.0
+        # monotonic time the last block was written
+        self.last_flush = time.monotonic()
+        # (tick, time, offset) of every keyframe block
+        self.index: list[tuple[int, float, int]] = []
+
+        # open the file here so a bad path is reported right away
+        self.file = open(path, "wb")
+        self.file.write(FILE_HEADER.pack(MAGIC, VERSION, time.time()))
+        self.thread = threading.Thread(target=self.run, name="recorder", daemon=True)
+        self.thread.start()
+
+    def input(self, tick: int, client_id: int, actions: set, seq: int) -> None:
+        """Record a REQUEST applied on tick."""
+        self.queue.put(
+            (
+                Record.INPUT,
+                tick,
+                time.time(),
+                INPUT.pack(client_id, seq, world_snapshot.pack_actions(actions)),
+            )
+        )
+
+    def message(self, tick: int, data: str) -> None:
+        """Record a JSON-serialized message broadcast on tick."""
+        self.queue.put((Record.MESSAGE, tick, time.time(), data))
+
+    def keyframe(self, tick: int, game: "server.Server") -> None:
+        """Record the whole world as it is on tick."""
+        server_time = time.time()
+        payload = world_snapshot.pack(game, server_time)
+        self.queue.put((Record.KEYFRAME, tick, server_time, payload))
+
+    def close(self) -> None:
+        """Write everything that has been recorded, add the index, and close the file."""
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self) -> None:
+        try:
+            while True:
+                try:
+                    item = self.queue.get(timeout=self.BLOCK_INTERVAL)
+                except queue.Empty:
+                    item = ()
+                if item is None:
+                    break
+                if item:
+                    self.add(*item)
+                if (
+                    len(self.pending) >= self.BLOCK_SIZE
+                    or time.monotonic() - self.last_flush >= self.BLOCK_INTERVAL
+                ):
+                    self.flush()
+
+            self.flush()
+            index_offset = self.file.tell()
+            entries = b"".join(INDEX_ENTRY.pack(*entry) for entry in self.index)
+            self.file.write(BLOCK.pack(Block.INDEX, len(entries), len(self.index), 0, 0.0))
+            self.file.write(entries)
+            self.file.write(FOOTER.pack(index_offset, self.last_time, FOOTER_MAGIC))
+        except OSError as e:
+            logging.error(f"couldn't write recording: {e}")
+        finally:
+            self.file.close()
+
+    def add(self, kind: Record, tick: int, server_time: float, payload: bytes | str) -> None:
+        """Pack a record into the pending block."""
+        if kind == Record.KEYFRAME:
+            # keyframes always start a block so they can be seeked to
+            self.flush()
+            self.pending_kind = Block.KEYFRAME
+        if isinstance(payload, str):
+            payload = payload.encode()
+        if not self.pending_count:
+            self.pending_start = (tick, server_time)
+        self.pending += RECORD.pack(kind, tick, server_time, len(payload))
+        self.pending += payload
+        self.pending_count += 1
+        self.last_time = server_time
+
+    def flush(self) -> None:
+        """Compress the pending records and append them to the file as a block."""
+        self.last_flush = time.monotonic()
+        if not self.pending_count:
+            return
+        data = zlib.compress(self.pending, self.COMPRESSION)
+        if self.pending_kind == Block.KEYFRAME:
+            self.index.append((*self.pending_start, self.file.tell()))
+        self.file.write(
+            BLOCK.pack(self.pending_kind, len(data), self.pending_count, *self.pending_start)
+        )
+        self.file.write(data)
+        # a crash loses at most the blocks still in the OS's buffers
+        self.file.flush()
+        metrics.RECORDING_BYTES.inc(BLOCK.size + len(data))
+
+        self.pending = bytearray()
+        self.pending_count = 0
+        self.pending_kind = Block.DATA
+
+
+class Recording:
+    """A recording opened for reading through a memory map."""
+
+    def __init__(self, path: str) -> None:
+        """Raises OSError if path can't be read and ValueError if it isn't a recording."""
+        with open(path, "rb") as f:
+            try:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as e:
+                # mmap can't map empty files
+                raise ValueError(f"{path} is empty") from e
+        try:
+            magic, version, self.start_time = FILE_HEADER.unpack_from(self.map)
+        except struct.error as e:
+            raise ValueError(f"{path} is truncated") from e
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a recording of a supported version")
+
+        # (tick, time, offset) of every keyframe block
+        self.keyframes: list[tuple[int, float, int]] = []
+        # time of the last record
+        self.end_time = self.start_time
+        if not self._read_index():
+            self._scan()
+
+    def _read_index(self) -> bool:
+        """Load the index written by Recorder.close(); return False if there isn't one."""
+        if len(self.map) < FILE_HEADER.size + FOOTER.size:
+            return False
+        index_offset, end_time, magic = FOOTER.unpack_from(self.map, len(self.map) - FOOTER.size)
+        if magic != FOOTER_MAGIC:
+            return False
+        kind, length, count, _, _ = BLOCK.unpack_from(self.map, index_offset)
+        if kind != Block.INDEX or count * INDEX_ENTRY.size != length:
+            return False
+        start = index_offset + BLOCK.size
+        self.keyframes = list(INDEX_ENTRY.iter_unpack(self.map[start : start + length]))
+        self.end_time = end_time
+        return True
+
+    def _scan(self) -> None:
+        """Rebuild the index of a recording that was never closed."""
+        last_block = None
+        for offset, kind, tick, block_time, _ in self._blocks(FILE_HEADER.size):
+            if kind == Block.KEYFRAME:
+                self.keyframes.append((tick, block_time, offset))
+            last_block = offset
+        if last_block is not None:
+            for _, _, record_time, _ in self.records(last_block):
+                self.end_time = record_time
+
+    def _blocks(self, offset: int) -> Iterator[tuple[int, int, int, float, bytes]]:
+        """Yield (offset, kind, tick, time, data) of each complete block from offset on."""
+        while offset + BLOCK.size <= len(self.map):
+            kind, length, _, tick, block_time = BLOCK.unpack_from(self.map, offset)
+            start = offset + BLOCK.size
+            if kind not in (Block.DATA, Block.KEYFRAME) or start + length > len(self.map):
+                # the index, or a block cut off by a crash
+                return
+            yield offset, kind, tick, block_time, self.map[start : start + length]
+            offset = start + length
+
+    def records(self, offset: int = FILE_HEADER.size) -> Iterator[tuple[Record, int, float, bytes]]:
+        """Yield (kind, tick, time, payload) of each record from the block at offset on."""
+        for _, _, _, _, data in self._blocks(offset):
+            try:
+                raw = zlib.decompress(data)
+            except zlib.error:
+                logging.warning("stopped reading at a corrupt block")
+                return
+            position = 0
+            while position < len(raw):
+                kind, tick, record_time, length = RECORD.unpack_from(raw, position)
+                position += RECORD.size
+                yield Record(kind), tick, record_time, raw[position : position + length]
+                position += length
+
+    def keyframe_before(self, when: float) -> int:
+        """Return the offset of the last keyframe block at or before time when."""
+        times = [keyframe_time for _, keyframe_time, _ in self.keyframes]
+        i = bisect.bisect_right(times, when) - 1
+        if i < 0:
+            # before the first keyframe; start from the beginning
+            return FILE_HEADER.size
+        return self.keyframes[i][2]
+
+    def close(self) -> None:
+        self.map.close()
+
+    def __enter__(self) -> "Recording":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
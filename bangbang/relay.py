@@ -0,0 +1,213 @@
+#!/usr/bin/python
+
+"""
+Relay a match to many spectators without adding work to the game server.
+
+The relay subscribes to the server with the key the server prints when it starts,
+so the server sends every message once no matter how many people are watching. The
+relay forwards the stream to each spectator through its own SendQueue, so a slow
+spectator only holds up itself. A spectator who connects in the middle of a match
+starts with a SNAPSHOT of the world, like a player who rejoins; the relay asks the
+server for one on behalf of all the spectators who connected since the last one.
+
+Spectators connect with bangbang.py --spectate <relay host>.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+
+import websockets
+
+import bbutils
+import clock_sync
+import constants
+import server_network
+
+
+class Spectator:
+    """Relay's representation of a spectator connection."""
+
+    def __init__(self, relay: "Relay", ws: bbutils.BBServerProtocol) -> None:
+        self.relay = relay
+        self.ws = ws
+        self.queue = server_network.SendQueue()
+        # spectators only send PINGs, but don't let them make us parse too many
+        self.bucket = server_network.TokenBucket()
+
+    async def handler(self) -> None:
+        """Answer PINGs with the relay's estimate of the server's clock."""
+        async for json_message in self.ws:
+            if not self.bucket.take():
+                continue
+            message = json.loads(json_message)
+            if message["type"] == constants.Msg.PING:
+                self.queue.put(
+                    json.dumps(
+                        {
+                            "type": constants.Msg.PONG,
+                            "client_time": message["client_time"],
+                            "server_time": self.relay.clock_sync.server_now(),
+                        }
+                    )
+                )
+
+    async def writer(self) -> None:
+        """Send messages from self.queue as fast as the spectator accepts them."""
+        try:
+            while True:
+                await self.queue.ready.wait()
+                self.queue.ready.clear()
+                while (item := self.queue.get()) is not None:
+                    await self.ws.send_serialized(*item)
+                if self.queue.overflowed:
+                    logging.warning("disconnecting a spectator: too far behind")
+                    await self.ws.close()
+                    return
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+
+class Relay:
+    def __init__(self, key: str) -> None:
+        # proves to the server that we're a relay
+        self.key = key
+        # connection to the server; set by run()
+        self.server: bbutils.BBClientProtocol | None = None
+        # the server's clock, passed on to spectators
+        self.clock_sync = clock_sync.ClockSync()
+        # whether a match is in progress
+        self.running = False
+        # spectators who are sent the stream
+        self.spectators: list[Spectator] = []
+        # spectators who connected during the match and are waiting for a SNAPSHOT
+        self.waiting: list[Spectator] = []
+
+    def handle_message(self, json_message: str) -> None:
+        """Pass a message from the server on to the spectators."""
+        message = json.loads(json_message)
+        match message["type"]:
+            case constants.Msg.APPROVE:
+                # serialize each state once for all spectators
+                entries = {entry[0]: json.dumps(entry) for entry in message["states"]}
+                for s in self.spectators:
+                    s.queue.put_states(message["time"], entries, message["hidden"])
+                return
+
+            case constants.Msg.ID:
+                return
+
+            case constants.Msg.PONG:
+                self.clock_sync.pong(message)
+                return
+
+            case constants.Msg.SNAPSHOT:
+                # it stands in for START for the spectators waiting for it, or for
+                # everyone if we subscribed in the middle of the match
+                for s in self.waiting if self.running else self.spectators:
+                    s.queue.put(json_message)
+                self.spectators += self.waiting
+                self.waiting = []
+                self.running = True
+                return
+
+            case constants.Msg.START:
+                self.running = True
+
+            case constants.Msg.QUIT:
+                self.running = False
+                # the SNAPSHOT they're waiting for isn't coming
+                self.spectators += self.waiting
+                self.waiting = []
+
+        for s in self.spectators:
+            s.queue.put(json_message)
+
+    async def handle_new_spectator(self, ws: bbutils.BBServerProtocol) -> None:
+        spectator = Spectator(self, ws)
+        if self.running:
+            self.waiting.append(spectator)
+            # the spectators who connect before the SNAPSHOT arrives can share it
+            if len(self.waiting) == 1:
+                await self.server.send({"type": constants.Msg.RESUME, "token": self.key})
+        else:
+            # START is on its way
+            self.spectators.append(spectator)
+        logging.debug(f"{len(self.spectators) + len(self.waiting)} spectators")
+        try:
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(spectator.handler())
+                writer_task = tg.create_task(spectator.writer())
+                await ws.wait_closed()
+                writer_task.cancel()
+        finally:
+            if spectator in self.waiting:
+                self.waiting.remove(spectator)
+            else:
+                self.spectators.remove(spectator)
+
+    async def sync_clock(self, ws: bbutils.BBClientProtocol) -> None:
+        """Keep sending PINGs so self.clock_sync stays up to date."""
+        for _ in range(constants.ClockSync.INITIAL_PINGS):
+            await ws.send(self.clock_sync.ping())
+            await asyncio.sleep(constants.ClockSync.INITIAL_INTERVAL)
+        while True:
+            await ws.send(self.clock_sync.ping())
+            await asyncio.sleep(constants.ClockSync.INTERVAL)
+
+    async def run(self, host: str) -> None:
+        """Subscribe to the server at host and serve spectators until it disconnects."""
+        async with websockets.connect(
+            f"ws://{host}:{constants.PORT}{constants.RELAY_PATH}",
+            create_connection=bbutils.BBClientProtocol,
+        ) as ws:
+            self.server = ws
+            await ws.send({"type": constants.Msg.SUBSCRIBE, "key": self.key})
+            ip = server_network.get_local_ip()
+            async with websockets.serve(
+                self.handle_new_spectator,
+                ip,
+                constants.RELAY_PORT,
+                create_connection=bbutils.BBServerProtocol,
+                ping_interval=5,
+                ping_timeout=10,
+            ):
+                print(f"Relay started on {ip}:{constants.RELAY_PORT}")
+                sync_task = asyncio.create_task(self.sync_clock(ws))
+                try:
+                    async for json_message in ws:
+                        self.handle_message(json_message)
+                except websockets.exceptions.ConnectionClosed:
+                    pass
+                sync_task.cancel()
+        print("The server closed the connection.")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Bang Bang " + constants.VERSION + " spectator relay",
+        prog="relay",
+    )
+    parser.add_argument("host", help="Host of the game server")
+    parser.add_argument("key", help="Relay key printed by the game server")
+    parser.add_argument(
+        "-d",
+        "--debug",
+        help="Print debugging information to the console",
+        action="store_true",
+        default=False,
+    )
+    args = parser.parse_args()
+    logging.root.setLevel(logging.DEBUG if args.debug else logging.WARNING)
+
+    try:
+        asyncio.run(Relay(args.key).run(args.host))
+    except (OSError, RuntimeError) as e:
+        logging.error(e)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
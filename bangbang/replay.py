@@ -0,0 +1,207 @@
+"""
+Play back a match recorded by the server (see recording.py).
+
+Replay stands in for client.Client: instead of receiving messages from a server, it
+reads them from a recording and passes them to Game.handle_message() when the
+PlaybackClock reaches the time they were recorded. The PlaybackClock also stands in
+for the game's ClockSync, and replaces base_shapes.now() so shells, mines and
+explosions move with it.
+
+Seeking starts from the nearest keyframe before the target and fast-forwards through
+the messages after it, so it takes about as long no matter how far into the match
+the target is.
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import time
+
+# hide pygame contribute message
+with contextlib.redirect_stdout(None):
+    import pygame
+
+import base_shapes
+import constants
+import recording
+import world_snapshot
+
+# messages that are only meaningful to a live client
+IGNORED = {constants.Msg.START, constants.Msg.QUIT}
+
+CONTROLS = f"""Replay controls:
+  space    pause or resume
+  - and =  halve or double the speed
+  [ and ]  go back or forward {constants.Replay.SEEK_STEP:g} seconds
+  home     go back to the beginning"""
+
+
+def _format_time(seconds: float) -> str:
+    return f"{int(seconds // 60)}:{seconds % 60:04.1f}"
+
+
+class PlaybackClock:
+    """Recorded server time that can be paused, sped up, and moved around in."""
+
+    def __init__(self) -> None:
+        # the recorded time at real time self.base_real
+        self.base = 0.0
+        self.base_real = time.monotonic()
+        self.speed = 1.0
+        self.paused = False
+
+    def now(self) -> float:
+        """Return the current recorded time."""
+        if self.paused:
+            return self.base
+        return self.base + (time.monotonic() - self.base_real) * self.speed
+
+    def set(self, recorded_time: float) -> None:
+        """Jump to recorded_time."""
+        self.base = recorded_time
+        self.base_real = time.monotonic()
+
+    def set_speed(self, speed: float) -> None:
+        self.set(self.now())
+        self.speed = speed
+
+    def toggle_pause(self) -> None:
+        self.set(self.now())
+        self.paused = not self.paused
+
+    # everything in a recording is on the server's clock, so the clock that is being
+    # played back is both the server's clock and the local one
+    def server_now(self) -> float:
+        return self.now()
+
+    def to_local(self, server_time: float) -> float:
+        return server_time
+
+
+class Replay(constants.Replay):
+    """Feeds a recorded match to a Game."""
+
+    def __init__(self, game: "game.Game") -> None:
+        self.game = game
+        self.clock = PlaybackClock()
+        # Game checks this when the server sends QUIT, which recordings never do
+        self.name_task = None
+
+        self.recording: recording.Recording | None = None
+        # iterator over the records after the current position
+        self.records = iter(())
+        # the next MESSAGE record as (time, message), or None at the end
+        self.next_message: tuple[float, dict] | None = None
+        # recorded time to seek to, set by handle_key()
+        self.seek_target: float | None = None
+        self.finished = False
+
+    async def start(self, path: str) -> None:
+        """Open the recording at path and play it until the window is closed."""
+        try:
+            self.recording = recording.Recording(path)
+        except (OSError, ValueError) as e:
+            logging.error(f"could not open the replay: {e}")
+            exit()
+        if not self.recording.keyframes:
+            logging.error("the recording has no keyframes to start from")
+            exit()
+
+        base_shapes.now = self.clock.now
+        print(
+            f"Replaying {_format_time(self.recording.end_time - self.recording.start_time)} "
+            "of recorded play."
+        )
+        print(CONTROLS)
+
+        # the first keyframe stands in for START
+        world = self.load_keyframe(self.recording.keyframes[0][2])
+        self.game.apply_snapshot(world)
+        await self.game.graphics_ready.wait()
+
+        try:
+            while True:
+                if self.seek_target is not None:
+                    await self.seek(self.seek_target)
+                    self.seek_target = None
+
+                now = self.clock.now()
+                while self.next_message is not None and self.next_message[0] <= now:
+                    await self.game.handle_message(self.next_message[1])
+                    self.advance()
+
+                if self.next_message is None:
+                    if not self.finished:
+                        print("The replay has ended.")
+                        self.finished = True
+                    delay = self.POLL_INTERVAL
+                elif self.clock.paused:
+                    delay = self.POLL_INTERVAL
+                else:
+                    delay = (self.next_message[0] - now) / self.clock.speed
+                # wake up now and then to notice seeks
+                await asyncio.sleep(min(delay, self.POLL_INTERVAL))
+        finally:
+            self.recording.close()
+
+    def load_keyframe(self, offset: int) -> dict:
+        """Set the clock and the position to the keyframe at offset and return its world."""
+        self.records = self.recording.records(offset)
+        # keyframe blocks start with their keyframe
+        _, _, keyframe_time, payload = next(self.records)
+        self.clock.set(keyframe_time)
+        self.advance()
+        return world_snapshot.unpack(payload)
+
+    def advance(self) -> None:
+        """Set self.next_message to the next message to play."""
+        for kind, _, record_time, payload in self.records:
+            if kind != recording.Record.MESSAGE:
+                continue
+            message = json.loads(payload)
+            if message["type"] not in IGNORED:
+                self.next_message = (record_time, message)
+                return
+        self.next_message = None
+
+    async def seek(self, target: float) -> None:
+        """Jump to recorded time target."""
+        # there's nothing to show before the first keyframe
+        target = min(max(target, self.recording.keyframes[0][1]), self.recording.end_time)
+        world = self.load_keyframe(self.recording.keyframe_before(target))
+        self.game.build_world(world)
+        # fast-forward to the target
+        while self.next_message is not None and self.next_message[0] <= target:
+            self.clock.set(self.next_message[0])
+            await self.game.handle_message(self.next_message[1])
+            self.advance()
+        self.clock.set(target)
+        self.finished = False
+        # don't play all the sounds from the fast-forward at once
+        pygame.mixer.stop()
+        self.print_position()
+
+    def handle_key(self, key: int) -> None:
+        """Handle a KEYDOWN event from the main loop."""
+        match key:
+            case pygame.K_SPACE:
+                self.clock.toggle_pause()
+                self.print_position()
+            case pygame.K_EQUALS:
+                self.clock.set_speed(min(self.clock.speed * 2, self.MAX_SPEED))
+                self.print_position()
+            case pygame.K_MINUS:
+                self.clock.set_speed(max(self.clock.speed / 2, self.MIN_SPEED))
+                self.print_position()
+            case pygame.K_RIGHTBRACKET:
+                self.seek_target = self.clock.now() + self.SEEK_STEP
+            case pygame.K_LEFTBRACKET:
+                self.seek_target = self.clock.now() - self.SEEK_STEP
+            case pygame.K_HOME:
+                self.seek_target = self.recording.keyframes[0][1]
+
+    def print_position(self) -> None:
+        position = _format_time(self.clock.now() - self.recording.start_time)
+        state = "paused" if self.clock.paused else f"{self.clock.speed:g}x"
+        print(f"{position} ({state})")
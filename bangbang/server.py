@@ -1,154 +1,155 @@
-"""The part of the server that handles game-specific logic."""
+"""
+The part of the server that handles game-specific logic.
 
+The rules themselves are in simulation.py; Server runs them in real time and tells
+the clients what happens.
+"""
+
+import argparse
 import asyncio
-import math
 import logging
+import os
 import random
 import time
-from typing import Any
 import sys
 
 import aioconsole
 import numpy as np
 
-import collisions
+import bots
+import checkpoint
 import constants
+import interest
+import metrics
+import profiling
+import recording
 import server_network
-from shapes import HeadlessMine, HeadlessShell, HeadlessTank
-import utils_3d
+from shapes import HeadlessMine, HeadlessShell
+import simulation
+import tracing
+import watchdog
 
 # TODO: add consistent type hinting throughout the whole project
 
 
-class Tank(HeadlessTank):
-    def __init__(self, angle, client_id, color, ground_hw, name, pos, server):
-        super().__init__(angle, client_id, color, ground_hw, name, pos)
-
-        self.mine_reloading = 0  # timestamp at which tank can lay a mine again
-        self.shell_reloading = 0  # timestamp at which tank can fire a shell again
-
-        # whether a tank state change has occurred that needs to be sent to the clients
-        self.__needs_update = False
-        self.server = server
-
-    def update(self) -> bool:
-        super().update()
-
-        if constants.Action.MINE in self.actions:
-            if self.clock >= self.mine_reloading + constants.Mine.RELOAD_TIME:
-                self.mine_reloading = self.clock
-                self.server.make_mine(self.client_id, self.pos)
-
-        if constants.Action.SHELL in self.actions:
-            if self.clock >= self.shell_reloading + constants.Shell.RELOAD_TIME:
-                self.shell_reloading = self.clock
-                self.server.make_shell(
-                    self.tangle,
-                    self.client_id,
-                    self.tout + (self.bout * self.speed / constants.Shell.SPEED),
-                    self.pos + constants.Shell.START_DISTANCE * self.tout,
-                )
-
-        temp_needs_update = self.__needs_update
-        self.__needs_update = False
-        return temp_needs_update
-
-    def update_actions(self, actions: set) -> None:
-        self.__needs_update = True
-        self.actions = actions
-
-    def set_needs_update(self) -> None:
-        """Make this Tank send a network update on the next call to update()."""
-        self.__needs_update = True
-
-
-class Server:
-    def __init__(self, debug: bool) -> None:
+class Server(simulation.Simulation):
+    def __init__(
+        self,
+        debug: bool,
+        checkpoint_path: str | None = None,
+        resume: dict | None = None,
+        record_dir: str | None = None,
+        bot_count: int = 0,
+        metrics_port: int | None = None,
+        trace_path: str | None = None,
+    ) -> None:
+        """
+        If checkpoint_path is given, the match is saved there every
+        Checkpoint.INTERVAL seconds. resume is a checkpoint returned by
+        checkpoint.load() to carry on with. If record_dir is given, every game is
+        recorded to a file in it; see recording.py. bot_count bots join every game.
+        If metrics_port is given, metrics are served on it at localhost; see metrics.py.
+        If trace_path is given, a trace of the newest ticks is saved there after every
+        game; see tracing.py.
+        """
+        super().__init__(debug)
         self.end_event = asyncio.Event()
         self.server = server_network.ServerNetwork(self)
-        self.debug = debug
-
-        self.next_mine_id = 0
-        self.next_shell_id = 0
+        self.checkpoint_writer = (
+            checkpoint.CheckpointWriter(checkpoint_path) if checkpoint_path else None
+        )
+        self.resume = resume
+        self.record_dir = record_dir
+        # records the current game if record_dir is set
+        self.recorder: recording.Recorder | None = None
+        self.bot_count = bot_count
+        # the bots of the current game
+        self.bots = bots.Bots(())
+        self.metrics_port = metrics_port
+        self.trace_path = trace_path
+        if trace_path is not None:
+            tracing.enable("server")
+        # runs the profile and alloc console commands
+        self.profiler = profiling.Profiler()
+        self.watchdog = watchdog.Watchdog("server", constants.Watchdog.SERVER_THRESHOLD)
+        # how long each phase of the ticks of the current game took
+        self.tick_timings: dict[str, metrics.Distribution] = {}
 
     async def initialize(self) -> None:
         """Code that should go in __init__ but needs to be awaited."""
+        # restore before accepting connections so the players who connect are told
+        # that a game is running
+        if self.resume is not None:
+            self.restore(self.resume)
+            self.resume = None
+            asyncio.create_task(self.run_game(wait_for_players=True))
+        watching = asyncio.create_task(self.watchdog.run())
+        endpoint = None
+        if self.metrics_port is not None:
+            metrics.COLLECTORS.append(self.collect_metrics)
+            try:
+                endpoint = await metrics.serve(constants.Metrics.HOST, self.metrics_port)
+            except OSError as e:
+                logging.error(f"can't serve metrics: {e}")
+                exit()
+            print(f"Metrics are at http://{constants.Metrics.HOST}:{self.metrics_port}/metrics")
         await self.server.initialize(self.listen_for_start, self.end_event)
+        watching.cancel()
+        if endpoint is not None:
+            endpoint.close()
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.close()
+
+    def take_requests(self) -> dict[int, tuple[set, int]]:
+        """Return the newest input of every client and bot for Simulation.step()."""
+        inputs = {}
+        for client in self.server.clients:
+            if (request := client.take_request()) is not None:
+                inputs[client.client_id] = request
+                if tracing.enabled:
+                    tracing.flow("t", tracing.input_id(client.client_id, request[1]))
+        self.timer.lap("inputs")
+        inputs |= self.bots.decide(self)
+        self.timer.lap("bots")
+        if self.recorder is not None:
+            try:
+                for client_id, request in inputs.items():
+                    self.recorder.input(self.tick, client_id, *request)
+            except Exception:
+                # a gap in the recording is better than losing the match
+                logging.exception("couldn't record the inputs")
+        return inputs
+
+    def collect_metrics(self) -> None:
+        """Update the gauges that are only read when metrics are scraped."""
+        metrics.CLIENTS.set(len(self.server.clients), kind="player")
+        metrics.CLIENTS.set(len(self.server.subscribers), kind="relay")
+        running = self.server.game_running
+        metrics.TANKS.set(len(self.tanks) if running else 0)
+        metrics.SHELLS.set(len(self.shells) if running else 0)
+        metrics.MINES.set(len(self.mines) if running else 0)
+        metrics.QUEUE_DEPTH.clear()
+        metrics.RTT_SECONDS.clear()
+        for client in self.server.everyone:
+            metrics.QUEUE_DEPTH.set(client.queue_depth, client=client.client_id)
+        for client in self.server.clients:
+            metrics.RTT_SECONDS.set(client.rtt, client=client.client_id)
+
+    def clients_near(self, pos: np.ndarray) -> set[int]:
+        """
+        Return the ids of the clients that can see something at pos.
 
-    def collisions(self) -> None:
-        """Check for and handle all shape collisions."""
-        # tank-tank collisions
-        # this should be first in case the tank back up causes another collision
-        already_checked: list[set[Tank, Tank]] = []
-        for tank1 in self.tanks.values():
-            for tank2 in self.tanks.values():
-                pair = {tank1, tank2}
-                if tank1 == tank2 or pair in already_checked:
-                    continue
-                if collisions.collide_tank_tank(tank1.pos, tank2.pos, tank1.bout, tank2.bout):
-                    self.server.message_all({"type": constants.Msg.TANK_COLLIDE})
-
-                    # move the tanks away from each other
-                    away = (
-                        utils_3d.normalize(tank1.pos - tank2.pos)
-                        * constants.Tank.COLLISION_SPRINGBACK
-                    )
-                    tank1.pos += away
-                    tank2.pos -= away
-                    tank1.speed = 0.0
-                    tank2.speed = 0.0
-                    already_checked.append(pair)
-                    tank1.set_needs_update()
-                    tank2.set_needs_update()
-
-        for hill_pos in self.hill_poses:
-            # tank vs. hill
-            for tank in self.tanks.values():
-                if collisions.collide_hill_tank(hill_pos, tank.pos, tank.bout):
-                    # back up the tank away from the hill so they aren't permanently stuck
-                    tank.pos += (
-                        utils_3d.normalize(tank.pos - hill_pos) * constants.Hill.COLLIDE_DIST
-                    )
-                    tank.speed = 0.0
-                    tank.set_needs_update()
-
-            # shell vs. hill
-            for shell in self.shells:
-                if collisions.collide_hill(hill_pos, shell.pos):
-                    self.send_shell_die(shell)
-
-        for shell in self.shells:
-            # remove shells exiting the playing area
-            if collisions.collide_shell_world(shell.pos, self.ground_hw):
-                self.send_shell_die(shell)
-                break
-
-            # handle tank-shell collisions
-            for tank in self.tanks.values():
-                if tank.client_id != shell.client_id and collisions.collide_tank(
-                    tank.pos, np.array((shell.pos[0], 0.0, shell.pos[2])), tank.bout
-                ):
-                    tank.recv_hit(constants.Shell.DAMAGE)
-                    tank.set_needs_update()
-                    self.send_shell_die(shell, False)
-
-        for mine in self.mines:
-            for tank in self.tanks.values():
-                if tank.client_id != mine.client_id and collisions.collide_tank_mine(
-                    tank.pos, mine.pos, tank.bout
-                ):
-                    tank.recv_hit(constants.Mine.DAMAGE)
-                    tank.set_needs_update()
-                    self.send_mine_die(mine)
-
-    def handle_request(self, client_id, actions) -> None:
-        """Handle a message of type constants.Msg.REQUEST."""
-        # TODO: Isn't it expensive to make new sets? Perhaps a new datatype should
-        # be used for Tank.actions
-        self.tanks[client_id].update_actions(set(actions))
+        Clients without a live tank and relays are always included since their
+        spectator cameras can be anywhere.
+        """
+        return {
+            c.client_id
+            for c in self.server.everyone
+            if c.client_id not in self.tanks or interest.is_near(pos, self.tanks[c.client_id].pos)
+        }
 
     async def input_loop(self) -> None:
-        """Start the game upon receiving proper user input."""
+        """Start the game upon receiving proper user input, and run profiling commands."""
         output = None
         while output != constants.SERVER_START_KEYWORD and output != constants.SERVER_QUIT_KEYWORD:
             try:
@@ -159,13 +160,20 @@ class Server:
             except (asyncio.exceptions.CancelledError, EOFError):
                 output = constants.SERVER_QUIT_KEYWORD
                 self.end_event.set()
+            words = output.split()
+            if words and words[0] in (
+                constants.SERVER_PROFILE_KEYWORD,
+                constants.SERVER_ALLOC_KEYWORD,
+            ):
+                # the game keeps running while these profile it
+                self.profiler.command(words)
 
         match output:
             case constants.SERVER_START_KEYWORD if not self.server.game_running:
                 # It is always OK to start in debug mode
                 can_start = self.debug
                 if not self.debug:
-                    if len(self.server.clients) < 2:
+                    if len(self.server.clients) + self.bot_count < 2:
                         print("At least two players must join before the game can start")
                     else:
                         # how many players have not submitted their names yet?
@@ -187,6 +195,7 @@ class Server:
 
             case constants.SERVER_QUIT_KEYWORD:
                 self.server.message_all({"type": constants.Msg.QUIT})
+                # stops send_updates()
                 self.server.end_game()
                 if len(self.server.clients) == 0:
                     self.end_event.set()
@@ -202,245 +211,395 @@ class Server:
         while not self.end_event.is_set():
             await self.input_loop()
 
-    def make_mine(self, client_id: int, pos: np.ndarray) -> None:
-        self.mines.append(HeadlessMine(client_id, self.next_mine_id, pos))
-        self.server.message_all(
+    def mine_died(self, mine: HeadlessMine) -> None:
+        self.server.message_clients(
+            {
+                "type": constants.Msg.MINE_DIE,
+                "mine_id": mine.mine_id,
+            },
+            mine.recipients,
+        )
+
+    def mine_laid(self, mine: HeadlessMine) -> None:
+        # ids of the clients that have been told about this mine
+        mine.recipients = set()
+        self.send_mine(mine, self.clients_near(mine.pos))
+
+    def rewind_ticks(self, client_id: int) -> int:
+        return self.history.rewind_ticks(self.server.rtt(client_id))
+
+    def start_message(self) -> dict:
+        """Return a START message describing the game as it is now."""
+        return {
+            "type": constants.Msg.START,
+            "states": [(client_id, t.state) for client_id, t in self.tanks.items()],
+            "ground_hw": self.ground_hw,
+            "map": self.map_params,
+        }
+
+    def send_mine(self, mine: HeadlessMine, client_ids: set[int], record: bool = True) -> None:
+        mine.recipients |= client_ids
+        self.server.message_clients(
             {
                 "type": constants.Msg.MINE,
-                "id": client_id,
-                "mine_id": self.next_mine_id,
-                "pos": tuple(pos),
-            }
+                "id": mine.client_id,
+                "mine_id": mine.mine_id,
+                "pos": mine.pos,
+                # lets clients that hear about the mine late age it correctly
+                "time": mine.spawn_time,
+            },
+            client_ids,
+            record,
         )
-        self.next_mine_id += 1
 
-    def make_shell(self, angle: float, client_id: int, out: np.ndarray, pos: np.ndarray) -> None:
-        self.shells.append(HeadlessShell(client_id, self.next_shell_id, angle, out, pos))
-        self.server.message_all(
+    def send_shell(self, shell: HeadlessShell, client_ids: set[int], record: bool = True) -> None:
+        shell.recipients |= client_ids
+        # HeadlessShell raises the shell when it's created, so send the unraised position
+        pos = shell.pos.copy()
+        pos[1] -= constants.Shell.START_HEIGHT
+        self.server.message_clients(
             {
                 "type": constants.Msg.SHELL,
-                "id": client_id,
-                "shell_id": self.next_shell_id,
-                "angle": angle,
-                "out": tuple(out),
+                "id": shell.client_id,
+                "shell_id": shell.shell_id,
+                "angle": shell.angle,
+                "out": tuple(shell.out),
                 "pos": tuple(pos),
-            }
+                # when the shell was at pos
+                "time": time.time(),
+            },
+            client_ids,
+            record,
         )
-        self.next_shell_id += 1
 
-    def send_mine_die(self, mine: HeadlessMine) -> None:
-        mine.die()
-        self.server.message_all(
-            {
-                "type": constants.Msg.MINE_DIE,
-                "mine_id": mine.mine_id,
-            }
-        )
+    def send_snapshot(self, refresh: bool = False) -> None:
+        """
+        Send each client the changed states of the tanks in its area of interest.
 
-    def send_shell_die(self, shell: HeadlessShell, explo: bool = True) -> None:
-        shell.die()
-        self.server.message_all(
-            {
-                "type": constants.Msg.SHELL_DIE,
-                "shell_id": shell.shell_id,
-                "explo": explo,
-            }
+        Tanks that have just entered a client's area of interest are sent even if they
+        haven't changed, and tanks that have left it are hidden. Destroyed tanks are
+        sent to everyone. If refresh is True, clients on UDP get every tank in their
+        area of interest, since they may have missed the last change of one; the
+        APPROVEs that can't be missed are sent reliably.
+        """
+        relevant = interest.relevant_tanks(
+            {client_id: tank.pos for client_id, tank in self.tanks.items()},
+            {c.client_id: c.relevant for c in self.server.everyone},
         )
+        dead = {client_id for client_id, tank in self.changed_tanks.items() if not tank.alive}
+
+        # (tank ids to send, tank ids to hide, whether they must be delivered) for each
+        # client
+        wanted: dict[int, tuple[set[int], set[int], bool]] = {}
+        for c in self.server.everyone:
+            # without a tank, the client's spectator camera can be anywhere
+            new = relevant.get(c.client_id, set(self.tanks))
+            entered = new - c.relevant
+            hidden = c.relevant - new - dead
+            # over UDP, a tank that has stopped changing may have had its last change lost
+            refreshed = refresh and c.udp is not None
+            changed = new if refreshed else self.changed_tanks.keys() & new
+            # these are only sent once, so they can't be left to an unreliable channel
+            reliable = bool(entered or hidden or dead) or refreshed
+            wanted[c.client_id] = (changed | entered | dead, hidden, reliable)
+            c.relevant = new
+
+        sent = set().union(*(ids for ids, _, _ in wanted.values()))
+        # recordings get every change, as if they could see the whole map, even when
+        # no client wants it (departed players, bots far from everyone, no clients)
+        recorded = self.changed_tanks.keys() if self.recorder is not None else set()
+        if sent or recorded or any(hidden for _, hidden, _ in wanted.values()):
+            tanks = self.tanks | self.changed_tanks
+            self.server.message_states(
+                time.time(),
+                # the ack lets the client discard the inputs the server has seen
+                [(i, tanks[i].state, tanks[i].last_seq) for i in sent | recorded],
+                wanted,
+            )
+        self.changed_tanks.clear()
+
+        # tell clients that have come close to a shell or mine about it
+        for shell in self.shells:
+            if new_ids := self.clients_near(shell.pos) - shell.recipients:
+                self.send_shell(shell, new_ids, record=False)
+        for mine in self.mines:
+            if new_ids := self.clients_near(mine.pos) - mine.recipients:
+                self.send_mine(mine, new_ids, record=False)
 
     async def send_updates(self) -> None:
-        end_time = None
-        while end_time is None or time.time() < end_time:
-            self.collisions()
-            for client_id, tank in self.tanks.items():
-                # tank.update() returns whether a network update is necessary
-                if tank.update():
-                    self.server.message_all(
-                        {
-                            "type": constants.Msg.APPROVE,
-                            "id": client_id,
-                            "state": tank.state,
-                        }
-                    )
+        ticks_per_snapshot = round(constants.TICK_RATE / constants.SNAPSHOT_RATE)
+        ticks_per_refresh = ticks_per_snapshot * round(
+            constants.SNAPSHOT_RATE * constants.Udp.REFRESH_INTERVAL
+        )
+        ticks_per_checkpoint = round(constants.TICK_RATE * constants.Checkpoint.INTERVAL)
+        ticks_per_keyframe = round(constants.TICK_RATE * constants.Recording.KEYFRAME_INTERVAL)
+        # wall-clock time at which the next tick should run
+        next_tick_time = time.monotonic()
+
+        # overruns since the last warning about them
+        overruns = 0
+        last_warning = -constants.TickTiming.WARNING_INTERVAL
 
-            for shell in self.shells:
-                shell.update()
-            for mine in self.mines:
-                mine.update()
-            # remove objects with .alive = False
-            self.tanks = {client_id: tank for client_id, tank in self.tanks.items() if tank.alive}
-            self.mines = [m for m in self.mines if m.alive]
-            self.shells = [s for s in self.shells if s.alive]
-
-            # check for a winner
-            if not self.debug and len(self.tanks) == 1 and not hasattr(self, "winner"):
-                self.winner = tuple(self.tanks.values())[0]
+        end_time = None
+        # the game also ends if the quit command is used
+        while self.server.game_running and (end_time is None or self.sim_time < end_time):
+            self.timer.start()
+            self.step(self.take_requests())
+            if self.winner is not None and end_time is None:
                 win_message = self.winner.name
                 if self.debug:
                     win_message += f" ({self.winner.client_id})"
                 win_message += " won"
                 print(win_message)
-                end_time = time.time() + constants.END_TIME
-
-            # allow other coroutines (including networking) to take place
-            await asyncio.sleep(0)
-
-    def setup_env(
-        self,
-    ) -> tuple[int, list[tuple[float]], list[tuple[float]], list[tuple[int, dict[str, Any]]]]:
+                end_time = self.sim_time + constants.END_TIME
+
+            if self.tick % ticks_per_snapshot == 0:
+                self.send_snapshot(self.tick % ticks_per_refresh == 0)
+            self.timer.lap("broadcast")
+            if self.checkpoint_writer is not None and self.tick % ticks_per_checkpoint == 0:
+                try:
+                    self.checkpoint_writer.save(self)
+                except Exception:
+                    # losing a checkpoint is better than losing the match
+                    logging.exception("couldn't save a checkpoint")
+            if self.recorder is not None and self.tick % ticks_per_keyframe == 0:
+                self.record_keyframe()
+            self.timer.lap("saving")
+            if tracing.enabled:
+                tracing.complete("tick", self.timer.started, self.timer.last, tick=self.tick)
+
+            if self.record_timings():
+                overruns += 1
+                now = time.monotonic()
+                if now - last_warning >= constants.TickTiming.WARNING_INTERVAL:
+                    durations = self.timer.durations
+                    slowest = max(durations, key=durations.get)
+                    logging.warning(
+                        f"tick {self.tick} took {sum(durations.values()) * 1000:.1f} ms, "
+                        f"{durations[slowest] * 1000:.1f} ms of it in {slowest} "
+                        f"({overruns} overrun(s) since the last warning)"
+                    )
+                    overruns = 0
+                    last_warning = now
+
+            # allow other coroutines (including networking) to take place until the
+            # next tick is due
+            next_tick_time += simulation.TICK_LENGTH
+            now = time.monotonic()
+            if now - next_tick_time > constants.MAX_TICK_LAG:
+                # we're too far behind to catch up; skip the missed ticks
+                next_tick_time = now
+            await asyncio.sleep(max(next_tick_time - now, 0))
+
+    def record_timings(self) -> bool:
         """
-        Returns ground half width and tank states.
-        Sets self.hill_poses and self.tree_poses.
+        Add the phases of the tick that just ran to the histograms.
+
+        Return whether the tick went over TickTiming.BUDGET.
         """
-        ground_area = constants.AREA_PER_PLAYER * len(self.server.clients)
-        # half the width of the ground
-        # useful because currently the origin is in the middle of the ground
-        # TODO: put the origin at one of the corners to simplify math
-        self.ground_hw = int(round(math.sqrt(ground_area) / 2))
-
-        self.hill_poses: list[tuple] = [
-            # (x, y, z)
-            (
-                random.uniform(
-                    -self.ground_hw + constants.HILL_BUFFER,
-                    self.ground_hw - constants.HILL_BUFFER,
-                ),
-                0.0,
-                random.uniform(
-                    -self.ground_hw + constants.HILL_BUFFER,
-                    self.ground_hw - constants.HILL_BUFFER,
-                ),
-            )
-            for _ in range(
-                # the number of hills
-                int(round(ground_area / constants.AREA_PER_HILL))
-            )
-        ]
-
-        def _gen_tree_pos():
-            valid = False
-            while not valid:
-                pos = (
-                    random.uniform(
-                        -self.ground_hw + constants.TREE_BUFFER,
-                        self.ground_hw - constants.TREE_BUFFER,
-                    ),
-                    0.0,
-                    random.uniform(
-                        -self.ground_hw + constants.TREE_BUFFER,
-                        self.ground_hw - constants.TREE_BUFFER,
-                    ),
-                )
-                valid = True
-                for hill_pos in self.hill_poses:
-                    if collisions.collide_hill(np.array(pos), np.array(hill_pos)):
-                        valid = False
-                        break
-            return pos
-
-        self.tree_poses: list[tuple] = [
-            _gen_tree_pos()
-            for _ in range(
-                # the number of trees
-                int(round(ground_area / constants.AREA_PER_TREE))
-            )
-        ]
-
-        # tank states: pos, angle, color
-
-        def _gen_tank_pos(tank_poses):
-            valid = False
-            while not valid:
-                pos = np.array(
-                    (
-                        random.uniform(-self.ground_hw, self.ground_hw),
-                        0.0,
-                        random.uniform(-self.ground_hw, self.ground_hw),
-                    )
-                )
-                valid = True
-                # can't be hitting a hill
-                for hill_pos in self.hill_poses:
-                    # TODO: technically we should compute an angle and use collide_hill_tank
-                    if collisions.collide_hill(np.array(hill_pos), pos):
-                        valid = False
-                        break
-                # can't be too close to a tank
-                if valid:
-                    for tank_pos in tank_poses:
-                        if utils_3d.mag(pos - tank_pos) < constants.MIN_SPAWN_DIST:
-                            valid = False
-                            break
-            tank_poses.append(pos)
-            return pos
-
-        # tank_poses is modified by _gen_tank_pos
-        tank_poses: list[np.ndarray[float]] = []
-        states: list[tuple[int, dict[str, Any]]] = [
-            (
-                client.client_id,
-                {
-                    "angle": random.uniform(0, 360),
-                    "color": [random.random() for _ in range(3)],
-                    "name": client.name,
-                    "pos": _gen_tank_pos(tank_poses),
-                },
+        total = sum(self.timer.durations.values())
+        for phase, duration in [*self.timer.durations.items(), ("total", total)]:
+            metrics.TICK_SECONDS.observe(duration, phase=phase)
+            if phase not in self.tick_timings:
+                self.tick_timings[phase] = metrics.Distribution()
+            self.tick_timings[phase].observe(duration)
+        if total > constants.TickTiming.BUDGET:
+            metrics.TICK_OVERRUNS.inc()
+            return True
+        return False
+
+    def print_timings(self) -> None:
+        """Print how long the phases of the ticks of the game took."""
+        print("Tick timings (ms):")
+        print(f"  {'phase':<12}{'p50':>8}{'p99':>8}{'max':>8}")
+        for phase, distribution in self.tick_timings.items():
+            print(
+                f"  {phase:<12}"
+                f"{distribution.percentile(50) * 1000:8.3f}"
+                f"{distribution.percentile(99) * 1000:8.3f}"
+                f"{distribution.max * 1000:8.3f}"
             )
-            for client in self.server.clients
-        ]
+        print(self.watchdog.report())
 
-        return states
+    def shell_died(self, shell: HeadlessShell, explo: bool) -> None:
+        self.server.message_clients(
+            {
+                "type": constants.Msg.SHELL_DIE,
+                "shell_id": shell.shell_id,
+                "explo": explo,
+                "time": time.time(),
+            },
+            shell.recipients,
+        )
 
-    async def start_game(self):
-        states = self.setup_env()
-        # Tanks indexed by client_id
-        self.tanks: dict[int, Tank] = {}
-        for client_id, state in states:
-            self.tanks[client_id] = Tank(
-                state["angle"],
-                client_id,
-                state["color"],
-                self.ground_hw,
-                state["name"],
-                state["pos"],
-                self,
-            )
-        self.mines: list[HeadlessMine] = []
-        self.shells: list[HeadlessShell] = []
+    def shell_fired(self, shell: HeadlessShell) -> None:
+        # ids of the clients that have been told about this shell
+        shell.recipients = set()
+        self.send_shell(shell, self.clients_near(shell.pos))
 
+    async def start_game(self):
+        self.bots = bots.Bots(self.server.get_next_id() for _ in range(self.bot_count))
+        self.new_game(
+            [(client.client_id, client.name) for client in self.server.clients] + self.bots.players,
+            random.getrandbits(64),
+        )
         # inform the network server that the game has started
         self.server.start_game()
+        await self.run_game()
+
+    def restore(self, world: dict) -> None:
+        """Set up a game from a checkpoint; every player has to reconnect to it."""
+        try:
+            super().restore(world)
+        except ValueError as e:
+            logging.error(f"can't resume: {e}")
+            exit()
+        for tank in self.tanks.values():
+            # the player isn't pressing anything until they come back
+            tank.update_actions(set(), tank.last_seq)
+        # nobody has been told about anything yet
+        for shape in self.shells + self.mines:
+            shape.recipients = set()
+        # only the players had tokens to come back with
+        self.bots = bots.Bots(state["client_id"] for state in world["tanks"] if not state["token"])
 
-        # broadcast a START message
-        self.server.message_all(
-            {
-                "type": constants.Msg.START,
-                "states": [(client_id, t.state) for client_id, t in self.tanks.items()],
-                "ground_hw": self.ground_hw,
-                "hill_poses": self.hill_poses,
-                "tree_poses": self.tree_poses,
-            }
+        self.server.start_game()
+        self.server.next_id = max(self.server.next_id, world["next_client_id"])
+        self.server.departed = {
+            state["token"]: state["client_id"] for state in world["tanks"] if state["token"]
+        }
+        print(f"Resumed a game with {len(self.tanks)} players; waiting for them to reconnect.")
+
+    def tanks_collided(self, tank1: simulation.Tank, tank2: simulation.Tank) -> None:
+        self.server.message_clients(
+            {"type": constants.Msg.TANK_COLLIDE}, self.clients_near(tank1.pos)
         )
 
+    async def wait_for_players(self) -> None:
+        """Hold a restored game until its players are back or Checkpoint.RESUME_TIMEOUT passes."""
+        deadline = time.monotonic() + constants.Checkpoint.RESUME_TIMEOUT
+        while (
+            self.server.game_running
+            and (self.server.departed or self.server.joining)
+            and time.monotonic() < deadline
+        ):
+            await asyncio.sleep(constants.Checkpoint.RESUME_POLL)
+        if self.server.departed:
+            print(f"Carrying on without {len(self.server.departed)} player(s).")
+
+    def record_keyframe(self) -> None:
+        """Record the whole world, logging rather than raising if that fails."""
+        try:
+            self.recorder.keyframe(self.tick, self)
+        except Exception:
+            # a gap in the recording is better than losing the match
+            logging.exception("couldn't record a keyframe")
+
+    async def run_game(self, wait_for_players: bool = False) -> None:
+        """
+        Run the game set up by start_game() or restore() until it is over.
+
+        If wait_for_players is True, the game doesn't start ticking until the players
+        have reconnected, so their tanks aren't sitting ducks in the meantime.
+        """
+        if self.record_dir is not None:
+            self.recorder = recording.Recorder(
+                os.path.join(self.record_dir, time.strftime("%Y%m%d-%H%M%S.bbrec"))
+            )
+
+        # broadcast a START message
+        self.server.message_all(self.start_message())
+        if self.recorder is not None:
+            # a replay can start here without the START message
+            self.record_keyframe()
+
+        if wait_for_players:
+            await self.wait_for_players()
         print("The game has started!")
 
+        self.tick_timings = {}
         # this will block until the game is over
         await self.send_updates()
 
         # the game is over; make the server allow new connections again
         self.server.end_game()
-        # existence of the winner attribute is used in victory logic
-        if hasattr(self, "winner"):
-            del self.winner
+        if self.recorder is not None:
+            # writes whatever is left, so don't block the event loop
+            await asyncio.to_thread(self.recorder.close)
+            self.recorder = None
+        if self.checkpoint_writer is not None:
+            # there's nothing left to resume
+            self.checkpoint_writer.remove()
+        self.print_timings()
+        if self.trace_path is not None:
+            tracing.write(self.trace_path)
+            print(f"Saved a trace of the end of the game to {self.trace_path}")
         print(constants.SERVER_INSTRUCTIONS)
 
 
-async def main(debug) -> None:
-    server = Server(debug)
+async def main(
+    debug,
+    checkpoint_path=None,
+    resume=None,
+    record_dir=None,
+    bot_count=0,
+    metrics_port=None,
+    trace_path=None,
+) -> None:
+    server = Server(debug, checkpoint_path, resume, record_dir, bot_count, metrics_port, trace_path)
     await server.initialize()
 
 
 if __name__ == "__main__":
-    debug = "-d" in sys.argv or "--debug" in sys.argv
+    parser = argparse.ArgumentParser(
+        description="Bang Bang " + constants.VERSION + " server", prog="server"
+    )
+    parser.add_argument(
+        "-d",
+        "--debug",
+        help="Allow starting alone, reload faster, and print debugging information",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "-c",
+        "--checkpoint",
+        help="Save running games to this file so they can be resumed after a crash",
+        metavar="FILE",
+    )
+    parser.add_argument(
+        "--resume",
+        help="Carry on with the game saved in this checkpoint; implies --checkpoint FILE",
+        metavar="FILE",
+    )
+    parser.add_argument(
+        "-r",
+        "--record",
+        help="Record every game to a file in this directory",
+        metavar="DIR",
+    )
+    parser.add_argument(
+        "-b",
+        "--bots",
+        help="Add this many computer players to every game",
+        type=int,
+        default=0,
+        metavar="N",
+    )
+    parser.add_argument(
+        "-m",
+        "--metrics",
+        help="Serve metrics in the Prometheus text format on this port of localhost",
+        type=int,
+        metavar="PORT",
+    )
+    parser.add_argument(
+        "--trace",
+        help="Save a timeline of the end of every game to this file; see tracing.py",
+        metavar="FILE",
+    )
+    args = parser.parse_args()
+    debug = args.debug
     logger = logging.getLogger("websockets")
     if debug:
         logger.setLevel(logging.INFO)
@@ -451,4 +610,26 @@ if __name__ == "__main__":
         logging.root.setLevel(logging.WARNING)
     logger.addHandler(logging.StreamHandler())
 
-    asyncio.run(main(debug))
+    resume = None
+    if args.resume is not None:
+        try:
+            resume = checkpoint.load(args.resume)
+        except (OSError, ValueError) as e:
+            logging.error(f"can't resume: {e}")
+            sys.exit(1)
+
+    if args.record is not None and not os.path.isdir(args.record):
+        logging.error(f"can't record: {args.record} is not a directory")
+        sys.exit(1)
+
+    asyncio.run(
+        main(
+            debug,
+            args.checkpoint or args.resume,
+            resume,
+            args.record,
+            args.bots,
+            args.metrics,
+            args.trace,
+        )
+    )
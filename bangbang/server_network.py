@@ -1,15 +1,27 @@
 """The part of the server that moves data around."""
 
 import asyncio
-from collections.abc import Coroutine
+import base64
+import collections
+from collections.abc import Collection, Coroutine
 import json
 import logging
+import re
+import secrets
 import socket
+import time
 import websockets
 import websockets.server  # only for typing, is that bad?
+import zlib
 
 import bbutils
 import constants
+import metrics
+from shapes import HeadlessMine, HeadlessShell
+import stream_transport
+import tracing
+import udp_transport
+import world_snapshot
 
 
 def get_local_ip():
@@ -26,6 +38,170 @@ def get_local_ip():
             return s.getsockname()[0]
 
 
+# every message is serialized from a dict that starts with its type
+MESSAGE_TYPE = re.compile(r'\{"type": (\d+)')
+
+
+def type_name(value) -> str:
+    """Return the name of a message type for metrics, even if the client made it up."""
+    try:
+        return constants.Msg(value).name
+    except ValueError:
+        return "unknown"
+
+
+def read_request(message: dict) -> tuple[set[constants.Action], int] | None:
+    """Return the (actions, seq) of a REQUEST message, or None if either is invalid."""
+    seq = message["seq"]
+    # seq is packed as a 32-bit int in snapshots, checkpoints and recordings
+    if type(seq) is not int or not -(2**31) <= seq < 2**31:
+        return None
+    try:
+        return {constants.Action(action) for action in message["actions"]}, seq
+    except (ValueError, TypeError):
+        return None
+
+
+def parse_request(raw: str | bytes) -> tuple[set[constants.Action], int] | None:
+    """Return the (actions, seq) of a serialized REQUEST, or None if it isn't a valid one."""
+    try:
+        message = json.loads(raw)
+        if message["type"] != constants.Msg.REQUEST:
+            return None
+        return read_request(message)
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def approve(server_time: float, entries: Collection[str], hidden: Collection[int]) -> str:
+    """Return an APPROVE message made of JSON-serialized (client_id, state, ack) entries."""
+    # the entries are already serialized, so just splice them together
+    return (
+        f'{{"type": {constants.Msg.APPROVE.value}, "time": {server_time!r}, '
+        f'"states": [{", ".join(entries)}], "hidden": {json.dumps(list(hidden))}}}'
+    )
+
+
+class SendQueue(constants.SendQueue):
+    """
+    Messages waiting to be sent to one client.
+
+    Reliable messages (SHELL, MINE_DIE, etc.) are sent in order and always go out
+    before tank states. A tank state replaces any unsent state of the same tank, and
+    all unsent states are sent together as a single APPROVE, so a slow client only
+    ever receives the newest state of each tank. Tanks that have left the client's
+    area of interest are listed in the APPROVE so the client can hide them. An
+    APPROVE only has to be delivered if some of its states were queued as such.
+    """
+
+    def __init__(self) -> None:
+        self.reliable: collections.deque[str] = collections.deque()
+        # JSON-serialized (client_id, state, ack) entries indexed by tank id
+        self.states: dict[int, str] = {}
+        # ids of tanks to hide
+        self.hidden: set[int] = set()
+        # whether the APPROVE made of self.states and self.hidden must be delivered
+        self.states_reliable = False
+        # server time of the newest entry in self.states
+        self.states_time = 0.0
+        # total length of all queued messages
+        self.nbytes = 0
+        # set when the byte budget is exceeded; nothing more will be queued
+        self.overflowed = False
+        # set whenever there is something to send
+        self.ready = asyncio.Event()
+
+    def get(self) -> tuple[str, bool] | None:
+        """
+        Remove and return the next message to send and whether it must be delivered.
+
+        Return None if the queue is empty.
+        """
+        if self.reliable:
+            data = self.reliable.popleft()
+            self.nbytes -= len(data)
+            return data, True
+        if self.states or self.hidden:
+            entries = self.states.values()
+            self.nbytes -= sum(len(e) for e in entries)
+            data = approve(self.states_time, entries, self.hidden)
+            reliable = self.states_reliable
+            self.states = {}
+            self.hidden = set()
+            self.states_reliable = False
+            return data, reliable
+        return None
+
+    def put(self, data: str) -> None:
+        """Queue a message that must be delivered."""
+        if self.overflowed:
+            return
+        self.reliable.append(data)
+        self._added(len(data))
+
+    def put_states(
+        self,
+        server_time: float,
+        entries: dict[int, str],
+        hidden: Collection[int] = (),
+        reliable: bool = False,
+    ) -> None:
+        """
+        Queue tank states, replacing any unsent states of the same tanks.
+
+        If reliable is True, the APPROVE they are sent in must be delivered.
+        """
+        if self.overflowed:
+            return
+        self.states_reliable |= reliable
+        added = 0
+        for key, data in entries.items():
+            if (old := self.states.pop(key, None)) is not None:
+                added -= len(old)
+            self.states[key] = data
+            added += len(data)
+            self.hidden.discard(key)
+        for key in hidden:
+            if (old := self.states.pop(key, None)) is not None:
+                added -= len(old)
+            self.hidden.add(key)
+        self.states_time = server_time
+        self._added(added)
+
+    def _added(self, nbytes: int) -> None:
+        self.nbytes += nbytes
+        if self.nbytes > self.BYTE_BUDGET:
+            # the client can't keep up; drop everything so the writer can close it
+            self.overflowed = True
+            self.reliable.clear()
+            self.states.clear()
+            self.nbytes = 0
+        self.ready.set()
+
+    @property
+    def depth(self) -> int:
+        """Return the number of messages waiting to be sent."""
+        return len(self.reliable) + bool(self.states or self.hidden)
+
+
+class TokenBucket(constants.TokenBucket):
+    """Rate limiter that allows short bursts."""
+
+    def __init__(self) -> None:
+        self.tokens = float(self.BURST)
+        self.last_time = time.monotonic()
+
+    def take(self) -> bool:
+        """Return True and use up a token if one is available, otherwise False."""
+        now = time.monotonic()
+        self.tokens = min(self.tokens + (now - self.last_time) * self.RATE, self.BURST)
+        self.last_time = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
 class Client:
     """Server's representation of a network client."""
 
@@ -40,33 +216,205 @@ class Client:
 
         self.server = s
         self.ws = ws
+        # set once the client connects over UDP; used instead of ws from then on
+        self.udp: udp_transport.Channel | None = None
+        self.tg = tg
 
-        # set by a REQUEST message
-        self.actions = set()
+        # (actions, seq) of the newest REQUEST not yet applied by the server
+        self.pending_request: tuple[set[constants.Action], int] | None = None
+        # a newer REQUEST than pending_request that arrived over the rate limit; it
+        # is only parsed when the next tick takes it
+        self.deferred_request: str | bytes | None = None
+        # limits how many messages this client can make the server parse
+        self.bucket = TokenBucket()
+        self.inputs_dropped = 0
+        self.inputs_coalesced = 0
         # assign this client a unique id
         self.client_id = client_id
+        # secret that lets the client identify itself on other connections
+        self.token = secrets.token_hex(16)
         # set by a GREET message
         self.name = None
+        # ids of the tanks this client has been told about and not told to hide
+        self.relevant: set[int] = set()
+        # round-trip time measured by the client; None until its first PING
+        self.reported_rtt: float | None = None
+
+        self.queue = SendQueue()
+        # tracks of the trace for what this client sends and receives
+        self.in_track = tracing.track(f"client {client_id} in")
+        self.out_track = tracing.track(f"client {client_id} out")
 
         # start listening to messages coming in from the client
-        handler = tg.create_task(self.handler())
+        handler = tg.create_task(self.handler(self.ws))
+        # start sending the messages put in self.queue
+        self.writer_task = tg.create_task(self.writer())
 
-    async def initialize(self) -> None:
-        """Code that should go in __init__ but needs to be awaited."""
-        await self.ws.send({"type": constants.Msg.ID, "id": self.client_id})
+    async def initialize(self, running: bool) -> None:
+        """
+        Code that should go in __init__ but needs to be awaited.
 
-    async def handler(self) -> None:
-        """Listen for messages coming in from client ws."""
-        async for json_message in self.ws:
-            # convert JSON string to dict
-            message = json.loads(json_message)
-            match message["type"]:
-                case constants.Msg.GREET:
-                    self.name = message["name"]
-                    print(f"{message['name']} has joined.")
+        running tells the client whether a game is in progress, in which case it
+        should RESUME.
+        """
+        await self.ws.send(
+            {
+                "type": constants.Msg.ID,
+                "id": self.client_id,
+                "token": self.token,
+                "udp_port": constants.UDP_PORT,
+                "running": running,
+            }
+        )
 
-                case constants.Msg.REQUEST:
-                    self.server.handle_request(self.client_id, message["actions"])
+    def attach_udp(self, channel: udp_transport.Channel) -> None:
+        """Send and receive over channel instead of the websocket from now on."""
+        channel.fallback = self.ws
+        self.udp = channel
+        self.tg.create_task(self.handler(channel))
+        logging.debug(f"player {self.client_id} switched to UDP")
+
+    async def handler(self, connection) -> None:
+        """Listen for messages coming in on connection (ws or udp)."""
+        async for json_message in connection:
+            # don't even parse messages from clients that send too many, except for
+            # their newest input and the messages they need to get into the game
+            if not self.bucket.take() and not self.exempt(json_message):
+                continue
+            start = time.perf_counter()
+
+            try:
+                # convert JSON string to dict
+                message = json.loads(json_message)
+                kind = type_name(message["type"])
+                metrics.MESSAGES_RECEIVED.inc(type=kind)
+                metrics.BYTES_RECEIVED.inc(len(json_message), type=kind)
+                match message["type"]:
+                    case constants.Msg.GREET:
+                        if not isinstance(message["name"], str):
+                            raise TypeError("the name is not a string")
+                        self.name = message["name"]
+                        print(f"{message['name']} has joined.")
+
+                    case constants.Msg.REQUEST:
+                        # the actions and seq end up packed into snapshots, checkpoints
+                        # and recordings, so they have to be valid
+                        if (request := read_request(message)) is None:
+                            raise ValueError("invalid actions or seq")
+                        metrics.INPUTS_RECEIVED.inc()
+                        if tracing.enabled:
+                            tracing.flow(
+                                "t", tracing.input_id(self.client_id, request[1]), self.in_track
+                            )
+                        # only the newest REQUEST matters; it is applied on the next tick
+                        if self.pending_request is not None or self.deferred_request is not None:
+                            self.inputs_coalesced += 1
+                            metrics.INPUTS_COALESCED.inc()
+                        self.pending_request = request
+                        self.deferred_request = None
+
+                    case constants.Msg.RESUME:
+                        self.tg.create_task(self.server.server.resume(self, message["token"]))
+
+                    case constants.Msg.PING:
+                        if isinstance(message["rtt"], (int, float)):
+                            self.reported_rtt = message["rtt"]
+                        self.queue.put(
+                            json.dumps(
+                                {
+                                    "type": constants.Msg.PONG,
+                                    "client_time": message["client_time"],
+                                    "server_time": time.time(),
+                                }
+                            )
+                        )
+            except (ValueError, KeyError, TypeError):
+                # a malformed message
+                self.drop()
+                continue
+            if tracing.enabled:
+                tracing.complete(f"receive {kind}", start, time.perf_counter(), self.in_track)
+
+    def exempt(self, json_message: str | bytes) -> bool:
+        """
+        Decide what to do with a message that arrived over the rate limit.
+
+        A REQUEST is kept unparsed as the newest input, and a GREET or RESUME that
+        the client (or relay) still needs is let through (return True). Anything else
+        is dropped.
+        """
+        # the type comes first, so it can be read without parsing the message
+        prefix = json_message[:16]
+        if isinstance(prefix, bytes):
+            prefix = prefix.decode(errors="replace")
+        match = MESSAGE_TYPE.match(prefix)
+        kind = int(match[1]) if match else None
+        if kind == constants.Msg.REQUEST:
+            if self.pending_request is not None or self.deferred_request is not None:
+                self.inputs_coalesced += 1
+                metrics.INPUTS_COALESCED.inc()
+            self.deferred_request = json_message
+            return False
+        network = self.server.server
+        if (kind == constants.Msg.GREET and self.name is None) or (
+            kind == constants.Msg.RESUME
+            and (self in network.joining or self in network.subscribers)
+        ):
+            return True
+        self.drop()
+        return False
+
+    def drop(self) -> None:
+        """Count a message from the client that was thrown away."""
+        self.inputs_dropped += 1
+        metrics.INPUTS_DROPPED.inc()
+
+    def take_request(self) -> tuple[set[constants.Action], int] | None:
+        """Return and clear the newest unapplied (actions, seq), or None."""
+        if self.deferred_request is not None:
+            # at most one deferred REQUEST is parsed per tick
+            if (request := parse_request(self.deferred_request)) is not None:
+                self.pending_request = request
+            self.deferred_request = None
+        request = self.pending_request
+        self.pending_request = None
+        return request
+
+    async def writer(self) -> None:
+        """Send messages from self.queue as fast as the client accepts them."""
+        try:
+            while True:
+                await self.queue.ready.wait()
+                self.queue.ready.clear()
+                while (item := self.queue.get()) is not None:
+                    start = time.perf_counter()
+                    # waits if the client's write buffer is full
+                    await (self.udp or self.ws).send_serialized(*item)
+                    match = MESSAGE_TYPE.match(item[0])
+                    kind = type_name(int(match[1])) if match else "unknown"
+                    metrics.MESSAGES_SENT.inc(type=kind)
+                    metrics.BYTES_SENT.inc(len(item[0]), type=kind)
+                    if tracing.enabled:
+                        tracing.complete(f"send {kind}", start, time.perf_counter(), self.out_track)
+                if self.queue.overflowed:
+                    logging.warning(f"disconnecting player {self.client_id}: too far behind")
+                    await self.ws.close()
+                    return
+        except (websockets.exceptions.ConnectionClosed, ConnectionError):
+            pass
+
+    @property
+    def rtt(self) -> float:
+        """Return the round-trip time to the client in seconds, or 0 if it's unknown."""
+        if self.reported_rtt is not None:
+            return self.reported_rtt
+        # websockets also measures this with its keepalive pings
+        return getattr(self.ws, "latency", 0.0)
+
+    @property
+    def queue_depth(self) -> int:
+        """Return the number of messages waiting to be sent to this client."""
+        return self.queue.depth
 
 
 class ServerNetwork:
@@ -81,6 +429,15 @@ class ServerNetwork:
         self.game_running = False
 
         self.clients: list[Client] = []
+        # clients that connected during a game and are waiting for a snapshot
+        self.joining: set[Client] = set()
+        # ids of players who lost connection during the current game, indexed by token
+        self.departed: dict[str, int] = {}
+        # relays receiving every message of the match on behalf of spectators; see
+        # relay.py. They are Clients without a tank.
+        self.subscribers: list[Client] = []
+        # relays must present this to subscribe
+        self.relay_key = secrets.token_hex(8)
 
         self.server = s
 
@@ -99,48 +456,257 @@ class ServerNetwork:
             ping_interval=5,
             ping_timeout=10,
         ):
-            print(f"Server started on {self.ip}:{constants.PORT}")
-            await asyncio.create_task(start_func())
-            # wait until end_event is set
-            await end_event.wait()
+            # clients may switch to UDP once they have an id
+            udp, self.udp_endpoint = await asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: udp_transport.ServerEndpoint(self.attach_udp),
+                local_addr=(self.ip, constants.UDP_PORT),
+            )
+            # clients may also connect with plain length-prefixed TCP instead of websockets
+            stream_server = await asyncio.start_server(
+                self.handle_new_stream, self.ip, constants.STREAM_PORT
+            )
+            async with stream_server:
+                print(f"Server started on {self.ip}:{constants.PORT}")
+                print(f"Relays can subscribe with the key {self.relay_key}")
+                await asyncio.create_task(start_func())
+                # wait until end_event is set
+                await end_event.wait()
+            udp.close()
+
+    def attach_udp(self, token: str, channel: udp_transport.Channel) -> bool:
+        """Hand channel to the client with the given token; return False if none has it."""
+        for c in self.clients:
+            if c.udp is None and secrets.compare_digest(c.token, token):
+                c.attach_udp(channel)
+                return True
+        return False
 
     def end_game(self) -> None:
         self.game_running = False
+        self.departed.clear()
+        # clients that were still waiting for a snapshot can play in the next game
+        self.clients += self.joining
+        self.joining.clear()
 
     def get_next_id(self) -> int:
         """Return a unique integer ID for the next connected client."""
         self.next_id += 1
         return self.next_id
 
-    async def handle_new_connection(self, ws: websockets.server.WebSocketServer) -> None:
+    async def handle_new_stream(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Handle a new connection to the length-prefixed TCP transport."""
+        await self.handle_new_connection(stream_transport.StreamConnection(reader, writer))
+
+    async def handle_new_connection(
+        self, ws: websockets.server.WebSocketServer | stream_transport.StreamConnection
+    ) -> None:
         """Start server communications with ws and add ws to self.clients."""
-        # prevent new clients from connecting if the game has already started
-        if self.game_running:
-            await ws.close()
-            print("rejected a player because the game has already started")
+        # StreamConnection has no request; relays always use websockets
+        request = getattr(ws, "request", None)
+        if request is not None and request.path == constants.RELAY_PATH:
+            await self.handle_new_subscriber(ws)
             return
 
         async with asyncio.TaskGroup() as tg:
             # add ws to the self.clients set and remove it upon disconnect
             client = Client(self.server, ws, tg, self.get_next_id())
-            await client.initialize()
-            self.clients.append(client)
+            await client.initialize(self.game_running)
+            if self.game_running:
+                # added to self.clients by resume() once it has a snapshot
+                self.joining.add(client)
+            else:
+                self.clients.append(client)
             logging.debug(f"added player with id {client.client_id}")
             try:
                 await client.ws.wait_closed()
             finally:
-                self.clients.remove(client)
+                client.writer_task.cancel()
+                if client.udp is not None:
+                    self.udp_endpoint.detach(client.udp)
+                self.joining.discard(client)
+                if client in self.clients:
+                    self.clients.remove(client)
+                if self.game_running and (tank := self.server.tanks.get(client.client_id)):
+                    # keep the tank where it is so the player can come back to it
+                    tank.update_actions(set(), tank.last_seq)
+                    self.departed[client.token] = client.client_id
+                    print(f"{client.name} lost connection.")
                 logging.debug(f"removed player with id {client.client_id}")
 
+    async def resume(self, client: Client, token: str) -> None:
+        """Send a client that connected during a game a SNAPSHOT, then add it to self.clients."""
+        if client in self.subscribers:
+            # a relay has new spectators to bring up to date
+            if self.game_running:
+                self.send_world(client)
+            return
+        if client not in self.joining:
+            return
+
+        # a player who lost connection gets their tank back; anyone else can only watch
+        if isinstance(token, str) and (client_id := self.departed.pop(token, None)) is not None:
+            client.client_id = client_id
+            client.token = token
+            if (tank := self.server.tanks.get(client_id)) is not None:
+                client.name = tank.name
+            print(f"{client.name} has reconnected.")
+
+        # the shells and mines the snapshot tells the client about
+        captured: list[HeadlessShell | HeadlessMine] = []
+        data = await world_snapshot.encode(self.server, time.time(), captured)
+        # the client may have left, or sent another RESUME, while we were waiting
+        if client not in self.joining or not self.game_running:
+            return
+        self.joining.discard(client)
+        client.queue.put(
+            json.dumps({"type": constants.Msg.SNAPSHOT, "data": base64.b64encode(data).decode()})
+        )
+        # like START, the snapshot has every tank in it
+        client.relevant = set(self.server.tanks)
+        # so send_snapshot() doesn't send them again
+        for shape in captured:
+            shape.recipients.add(client.client_id)
+        self.clients.append(client)
+
+    def send_world(self, subscriber: Client) -> None:
+        """
+        Queue a SNAPSHOT of the game for a relay.
+
+        Unlike the one resume() makes, it is made all at once, so it is exactly the
+        world as of the messages queued for the relay before it, and the relay can
+        start new spectators on it and then pass them the messages that follow it.
+        """
+        captured: list[HeadlessShell | HeadlessMine] = []
+        raw = world_snapshot.pack(self.server, time.time(), captured)
+        data = zlib.compress(raw, constants.WorldSnapshot.COMPRESSION)
+        subscriber.queue.put(
+            json.dumps({"type": constants.Msg.SNAPSHOT, "data": base64.b64encode(data).decode()})
+        )
+        # like START, the snapshot has every tank in it
+        subscriber.relevant = set(self.server.tanks)
+        # so send_snapshot() doesn't send them again
+        for shape in captured:
+            shape.recipients.add(subscriber.client_id)
+
+    async def handle_new_subscriber(self, ws: websockets.server.WebSocketServer) -> None:
+        """Add a relay to self.subscribers if its SUBSCRIBE has the right key."""
+        try:
+            message = json.loads(await asyncio.wait_for(ws.recv(), constants.SUBSCRIBE_TIMEOUT))
+        except (TimeoutError, ValueError, websockets.exceptions.ConnectionClosed):
+            message = {}
+        if not (
+            isinstance(message, dict)
+            and message.get("type") == constants.Msg.SUBSCRIBE
+            and isinstance(message.get("key"), str)
+            and secrets.compare_digest(message["key"], self.relay_key)
+        ):
+            await ws.close()
+            print("rejected a relay with the wrong key")
+            return
+
+        async with asyncio.TaskGroup() as tg:
+            subscriber = Client(self.server, ws, tg, self.get_next_id())
+            # a relay can join in the middle of a game
+            if self.game_running:
+                self.send_world(subscriber)
+            self.subscribers.append(subscriber)
+            print("a relay has subscribed")
+            try:
+                await ws.wait_closed()
+            finally:
+                subscriber.writer_task.cancel()
+                self.subscribers.remove(subscriber)
+                print("a relay has unsubscribed")
+
+    @property
+    def everyone(self) -> list[Client]:
+        """Return the clients and the subscribed relays."""
+        return self.clients + self.subscribers
+
     def message_all(self, message: bbutils.Message) -> None:
-        """Serialize message to JSON and broadcast it to all members of self.clients."""
+        """Serialize message to JSON and queue it for all clients and relays."""
         # check for message validity - raises ValueError if not valid
         bbutils.is_message_valid(message)
 
         # turn the bbutils.Message into a JSON-formated str
         data = json.dumps(message)
-        websockets.broadcast([c.ws for c in self.clients], data)
+        self.record(data)
+        for c in self.everyone:
+            c.queue.put(data)
+
+    def message_clients(
+        self, message: bbutils.Message, client_ids: Collection[int], record: bool = True
+    ) -> None:
+        """
+        Serialize message to JSON and queue it for the clients and relays in client_ids.
+
+        Pass record=False for messages that are only being repeated for clients that
+        missed them; the recording already has them.
+        """
+        record = record and self.server.recorder is not None
+        if not client_ids and not record:
+            return
+        bbutils.is_message_valid(message)
+        data = json.dumps(message)
+        if record:
+            self.record(data)
+        for c in self.everyone:
+            if c.client_id in client_ids:
+                c.queue.put(data)
+
+    def message_states(
+        self,
+        server_time: float,
+        states: list[tuple[int, dict, int]],
+        wanted: dict[int, tuple[set[int], set[int], bool]],
+    ) -> None:
+        """
+        Queue (client_id, state, ack) tank states.
+
+        wanted maps each client id to the ids of the tanks to send to it, the ids of
+        the tanks it should hide, and whether they must be delivered. Every state is
+        recorded, so states is a superset of the ones wanted when the game is being
+        recorded.
+        """
+        bbutils.is_message_valid(
+            {"type": constants.Msg.APPROVE, "time": server_time, "states": states}
+        )
+
+        # serialize each state once; the queues splice them into APPROVE messages
+        entries = {state[0]: json.dumps(state) for state in states}
+        if self.server.recorder is not None:
+            # recordings get every state, including the ones no client wants
+            self.record(approve(server_time, entries.values(), ()))
+        for c in self.everyone:
+            if c.client_id not in wanted:
+                continue
+            send, hidden, reliable = wanted[c.client_id]
+            c.queue.put_states(server_time, {i: entries[i] for i in send}, hidden, reliable)
+
+    def queue_depths(self) -> dict[int, int]:
+        """Return the number of queued outbound messages for each client id."""
+        return {c.client_id: c.queue_depth for c in self.clients}
+
+    def record(self, data: str) -> None:
+        """Add a JSON-serialized broadcast message to the game's recording, if any."""
+        if (recorder := self.server.recorder) is not None:
+            recorder.message(self.server.tick, data)
+
+    def rtt(self, client_id: int) -> float:
+        """Return the round-trip time to a client in seconds, or 0 if it's unknown."""
+        for c in self.clients:
+            if c.client_id == client_id:
+                return c.rtt
+        return 0.0
 
     def start_game(self) -> None:
         """Call this method when the game starts."""
         self.game_running = True
+        # forget any input and tanks left over from a previous game
+        for c in self.everyone:
+            c.pending_request = None
+            c.deferred_request = None
+            # START tells everyone about every tank, so any of them may need hiding
+            c.relevant = set(self.server.tanks)
@@ -8,9 +8,11 @@ import numpy as np
 with contextlib.redirect_stdout(None):
     import pygame
 
+import base_shapes
 from base_shapes import Shape
 from collections.abc import Iterable
 import constants
+import interpolation
 import utils_3d
 
 pygame.mixer.init()
@@ -38,7 +40,7 @@ class Explosion(Shape, constants.Explosion):
 
     def update(self):
         # don't play animation too fast
-        clock = time.time()
+        clock = base_shapes.now()
 
         self._draw()
 
@@ -91,13 +93,19 @@ class HeadlessMine(Shape, constants.Mine):
         self.mine_id = mine_id
         self.pos = tuple(pos)
 
-        self.spawn_time = time.time()
+        # self._clock is initialized in Shape.__init__
+        self.spawn_time = self.clock
+        # seconds since the mine was laid
+        self.age = 0.0
 
     def update(self):
         # update self.clock
-        self.delta_time()
+        self.step(self.delta_time())
 
-        if self.clock - self.spawn_time >= Mine.LIFETIME:
+    def step(self, delta: float) -> None:
+        """Advance the mine by delta seconds."""
+        self.age += delta
+        if self.age >= Mine.LIFETIME:
             self.die()
 
 
@@ -120,9 +128,16 @@ class HeadlessShell(Shape, constants.Shell):
         # raise the shell to make it appear like it's exiting the turret
         self.pos[1] += constants.Shell.START_HEIGHT
         self.out = np.array(out)
+        # seconds since the shell was fired
+        self.age = 0.0
 
     def update(self):
-        self.pos += self.out * constants.Shell.SPEED * self.delta_time()
+        self.step(self.delta_time())
+
+    def step(self, delta: float) -> None:
+        """Advance the shell by delta seconds."""
+        self.age += delta
+        self.pos += self.out * constants.Shell.SPEED * delta
 
 
 class HeadlessTank(Shape, constants.Tank):
@@ -183,8 +198,10 @@ class HeadlessTank(Shape, constants.Tank):
         return incr * direction, True
 
     def update(self) -> None:
-        delta = self.delta_time()
+        self.step(self.delta_time())
 
+    def step(self, delta: float) -> None:
+        """Advance the tank by delta seconds using the current actions."""
         ip_bangle = 0
         ip_tangle = 0
 
@@ -474,9 +491,9 @@ class ReloadingBar(constants.ReloadingBar):
         self.screen_width = screen_width
         self.spawn_time = 0
 
-    def fire(self):
-        """Call right after the player fires."""
-        self.spawn_time = time.time()
+    def fire(self, fire_time: float):
+        """Call when the player fires; fire_time is on the local clock."""
+        self.spawn_time = fire_time
 
     def update(self):
         """Draw the reloading bar"""
@@ -537,14 +554,14 @@ class Shell(HeadlessShell):
 
         self.SOUND.play()
 
-        # None until the shell hits a hill; time.time() thereafter
+        # None until the shell hits a hill; the local time it did thereafter
         self.hill_time = None
 
     def update(self) -> None:
         if not self.collided:
             super().update()
 
-        if self.collided and time.time() - self.hill_time >= Shell.HILL_TIME:
+        if self.collided and base_shapes.now() - self.hill_time >= Shell.HILL_TIME:
             self.die()
             return
 
@@ -562,8 +579,8 @@ class Shell(HeadlessShell):
 
         glPopMatrix()
 
-    def hill(self):
-        self.hill_time = time.time()
+    def hill(self, hill_time: float):
+        self.hill_time = hill_time
 
     @property
     def collided(self):
@@ -572,6 +589,9 @@ class Shell(HeadlessShell):
 
 # TODO: make an abstract class containing shared code from Tank, Player, and Spectator
 class Spectator(Shape, constants.Spectator):
+    # the camera moves at the same speed even if a replay is paused or sped up
+    real_time = True
+
     def __init__(self, pos, out, angle):
         super().__init__()
 
@@ -636,6 +656,8 @@ class Tank(HeadlessTank):
 
         self.game = game
         self.client_id = client_id
+        # added to pos when drawing; used to smooth out prediction corrections
+        self.render_offset = np.zeros(3)
         self.update_state(state)
 
     def gl_update(self) -> None:
@@ -645,7 +667,7 @@ class Tank(HeadlessTank):
         ):
             glPushMatrix()
             glColor(*self.color)
-            glTranslate(*self.pos)
+            glTranslate(*(self.pos + self.render_offset))
             glRotate(angle, *constants.UP)
             glCallList(gllist)
             glPopMatrix()
@@ -666,6 +688,38 @@ class Tank(HeadlessTank):
         self.__dict__.update(state)
 
 
+class RemoteTank(Tank):
+    """A tank controlled by another player, drawn slightly in the past."""
+
+    def __init__(self, game: "game.Game", client_id: int, state: dict):
+        super().__init__(game, client_id, state)
+        self.snapshots = interpolation.SnapshotBuffer()
+        # False while the tank is outside this player's area of interest
+        self.visible = True
+
+    def hide(self) -> None:
+        """Stop drawing the tank until the server sends its state again."""
+        self.visible = False
+        # don't interpolate from where the tank was before it left
+        self.snapshots = interpolation.SnapshotBuffer()
+
+    def push_state(self, server_time: float, state: dict) -> None:
+        """Buffer a state from the server, applying non-positional values right away."""
+        self.visible = True
+        self.snapshots.push(server_time, state)
+        self.update_state(
+            {k: v for k, v in state.items() if k not in interpolation.KINEMATIC_KEYS}
+        )
+
+    def update(self) -> None:
+        if not self.visible:
+            return
+        self.snapshots.apply(
+            self, self.game.clock_sync.server_now() - constants.Interpolation.DELAY
+        )
+        self.gl_update()
+
+
 class Tree(Shape, constants.Tree):
     gllist = "Unknown"
     FALL_SOUND = pygame.mixer.Sound("../data/sound/tree.wav")
@@ -711,6 +765,13 @@ class Tree(Shape, constants.Tree):
             self.falling = -right
         self.speed = speed
 
+    def fallen(self, falling, speed):
+        """Show a tree that fell before this client knew about it lying on the ground."""
+        self.falling = np.array(falling)
+        self.speed = speed
+        self.fall_angle = 90.0
+        self.played_sound = True
+
     @property
     def is_falling(self):
         return self.speed is not None
@@ -0,0 +1,474 @@
+"""
+The rules of the game, without networking or wall-clock time.
+
+Simulation advances a game by fixed ticks of 1 / TICK_RATE seconds, as fast as the
+CPU allows. It knows nothing about clients: things that happen are reported through
+the hook methods (shell_fired(), tanks_collided(), etc.), which do nothing here and
+which server.Server overrides to tell the clients. This keeps the simulation usable
+on its own for balancing, regression tests, and benchmarks:
+
+    sim = Simulation()
+    sim.new_game([(0, "a"), (1, "b")], seed=1)
+    sim.run(60 * 60 * constants.TICK_RATE, inputs)
+"""
+
+from collections.abc import Mapping, Sequence
+import math
+import random
+
+import numpy as np
+
+import collisions
+import constants
+import history
+import mapgen
+import metrics
+from shapes import HeadlessMine, HeadlessShell, HeadlessTank
+import utils_3d
+
+# seconds of game time per tick
+TICK_LENGTH = 1 / constants.TICK_RATE
+
+
+class Tank(HeadlessTank):
+    def __init__(self, angle, client_id, color, ground_hw, name, pos, sim):
+        super().__init__(angle, client_id, color, ground_hw, name, pos)
+
+        # game times (see Simulation.sim_time) of the last mine and shell
+        self.mine_reloading = -constants.Mine.RELOAD_TIME
+        self.shell_reloading = -constants.Shell.RELOAD_TIME
+
+        # sequence number of the last REQUEST applied; echoed back to the client
+        self.last_seq = -1
+
+        # whether a tank state change has occurred that needs to be sent to the clients
+        self.__needs_update = False
+        self.sim = sim
+
+    def tick(self, delta: float) -> bool:
+        """Advance the tank by one server tick and return whether it needs to be sent."""
+        old_motion = (self.bangle, self.tangle, self.speed)
+        self.step(delta)
+        # a moving tank changes every tick; SNAPSHOT_RATE limits how often it's sent
+        if self.speed or (self.bangle, self.tangle, self.speed) != old_motion:
+            self.__needs_update = True
+        clock = self.sim.sim_time
+
+        if constants.Action.MINE in self.actions:
+            if clock >= self.mine_reloading + constants.Mine.RELOAD_TIME:
+                self.mine_reloading = clock
+                self.sim.make_mine(self.client_id, self.pos)
+
+        if constants.Action.SHELL in self.actions:
+            if clock >= self.shell_reloading + constants.Shell.RELOAD_TIME:
+                self.shell_reloading = clock
+                self.sim.make_shell(
+                    self.tangle,
+                    self.client_id,
+                    self.tout + (self.bout * self.speed / constants.Shell.SPEED),
+                    self.pos + constants.Shell.START_DISTANCE * self.tout,
+                )
+
+        temp_needs_update = self.__needs_update
+        self.__needs_update = False
+        return temp_needs_update
+
+    def update_actions(self, actions: set, seq: int) -> None:
+        self.__needs_update = True
+        self.actions = actions
+        self.last_seq = seq
+
+    def set_needs_update(self) -> None:
+        """Make this Tank send a network update on the next call to tick()."""
+        self.__needs_update = True
+
+
+class Simulation:
+    """
+    One game's worth of tanks, shells, mines, and map.
+
+    If debug is True, the game doesn't end when only one tank is left.
+    """
+
+    def __init__(self, debug: bool = False) -> None:
+        self.debug = debug
+
+        self.next_mine_id = 0
+        self.next_shell_id = 0
+        # how long each phase of the last tick took; started by whoever drives step()
+        self.timer = metrics.PhaseTimer()
+
+    def new_game(self, players: Sequence[tuple[int, str]], seed: int) -> None:
+        """
+        Set up a new game for (client id, name) players.
+
+        The map, the spawn points, and the tank colors all come from seed.
+        """
+        rng = random.Random(seed)
+        ground_area = constants.AREA_PER_PLAYER * len(players)
+        # half the width of the ground
+        # useful because currently the origin is in the middle of the ground
+        # TODO: put the origin at one of the corners to simplify math
+        self.ground_hw = int(round(math.sqrt(ground_area) / 2))
+        self.set_map(
+            rng.getrandbits(64),
+            int(round(ground_area / constants.AREA_PER_HILL)),
+            int(round(ground_area / constants.AREA_PER_TREE)),
+        )
+
+        def _gen_tank_pos(tank_poses):
+            valid = False
+            while not valid:
+                pos = np.array(
+                    (
+                        rng.uniform(-self.ground_hw, self.ground_hw),
+                        0.0,
+                        rng.uniform(-self.ground_hw, self.ground_hw),
+                    )
+                )
+                valid = True
+                # can't be hitting a hill
+                for hill_pos in self.hill_poses:
+                    # TODO: technically we should compute an angle and use collide_hill_tank
+                    if collisions.collide_hill(np.array(hill_pos), pos):
+                        valid = False
+                        break
+                # can't be too close to a tank
+                if valid:
+                    for tank_pos in tank_poses:
+                        if utils_3d.mag(pos - tank_pos) < constants.MIN_SPAWN_DIST:
+                            valid = False
+                            break
+            tank_poses.append(pos)
+            return pos
+
+        # tank_poses is modified by _gen_tank_pos
+        tank_poses: list[np.ndarray[float]] = []
+        # Tanks indexed by client_id
+        self.tanks: dict[int, Tank] = {}
+        for client_id, name in players:
+            self.tanks[client_id] = Tank(
+                rng.uniform(0, 360),
+                client_id,
+                [rng.random() for _ in range(3)],
+                self.ground_hw,
+                name,
+                _gen_tank_pos(tank_poses),
+                self,
+            )
+        self.mines: list[HeadlessMine] = []
+        self.shells: list[HeadlessShell] = []
+        # trees knocked over so far: index into self.tree_poses -> (falling x, falling z,
+        # speed of the tank)
+        self.fallen_trees: dict[int, tuple[float, float, float]] = {}
+
+        # number of ticks since the game started
+        self.tick = 0
+        # game time in seconds; advances by exactly TICK_LENGTH per tick
+        self.sim_time = 0.0
+        self._prepare()
+
+    def restore(self, world: dict) -> None:
+        """
+        Set up a game from a checkpoint returned by checkpoint.load().
+
+        Raises ValueError if the checkpoint's map can't be recreated.
+        """
+        self.ground_hw = world["ground_hw"]
+        params = world["map"]
+        self.set_map(params["seed"], params["hills"], params["trees"])
+        if self.map_params != params:
+            raise ValueError("the checkpoint's map was made by a different version")
+
+        self.tanks = {}
+        for state in world["tanks"]:
+            tank = Tank(
+                state["bangle"],
+                state["client_id"],
+                state["color"],
+                self.ground_hw,
+                state["name"],
+                state["pos"],
+                self,
+            )
+            for attr in (
+                "health",
+                "mine_reloading",
+                "shell_reloading",
+                "snapping_back",
+                "speed",
+                "tangle",
+                "turning_back",
+            ):
+                setattr(tank, attr, state[attr])
+            tank.update_actions(state["actions"], state["last_seq"])
+            self.tanks[tank.client_id] = tank
+
+        self.shells = []
+        for s in world["shells"]:
+            shell = HeadlessShell(s["id"], s["shell_id"], s["angle"], s["out"], s["pos"])
+            # HeadlessShell raises the position it's given, but this one already is
+            shell.pos = np.array(s["pos"])
+            shell.age = s["age"]
+            shell.rewind = s["rewind"]
+            self.shells.append(shell)
+        self.mines = []
+        for m in world["mines"]:
+            mine = HeadlessMine(m["id"], m["mine_id"], m["pos"])
+            mine.age = m["age"]
+            mine.spawn_time -= mine.age
+            self.mines.append(mine)
+        self.fallen_trees = world["fallen_trees"]
+
+        self.tick = world["tick"]
+        self.sim_time = world["sim_time"]
+        self.next_mine_id = world["next_mine_id"]
+        self.next_shell_id = world["next_shell_id"]
+        self._prepare()
+
+    def _prepare(self) -> None:
+        """Set up what is derived from the tanks and trees of a new or restored game."""
+        self.trees_standing = np.ones(len(self.tree_poses), dtype=bool)
+        self.trees_standing[list(self.fallen_trees)] = False
+        # recent tank positions for lag-compensated shell hits
+        self.history = history.TankHistory(self.tanks)
+        # tanks whose state has changed since the last snapshot, indexed by client_id
+        self.changed_tanks: dict[int, Tank] = {}
+        # the last tank standing, once there is one
+        self.winner: Tank | None = None
+
+    def set_map(self, seed: int, hill_count: int, tree_count: int) -> None:
+        """
+        Generate the hills and trees of a self.ground_hw map.
+
+        Sets self.hill_poses, self.tree_poses, their arrays, and self.map_params.
+        """
+        # the clients generate the same hills and trees from these parameters
+        self.hill_poses, self.tree_poses = mapgen.generate(
+            seed, self.ground_hw, hill_count, tree_count
+        )
+        self.hill_array = np.array(self.hill_poses).reshape(-1, 3)
+        self.tree_array = np.array(self.tree_poses).reshape(-1, 3)
+        self.map_params = {
+            "version": mapgen.VERSION,
+            "seed": seed,
+            "hills": hill_count,
+            "trees": tree_count,
+            "checksum": mapgen.checksum(self.hill_poses, self.tree_poses),
+        }
+
+    def run(self, ticks: int, inputs: Sequence[Mapping[int, tuple[set, int]]] = ()) -> int:
+        """
+        Advance the game by up to ticks ticks and return how many were run.
+
+        inputs[i] is passed to step() on the i-th tick; ticks past the end of inputs
+        get none. Stops early once there is a winner.
+        """
+        for i in range(ticks):
+            self.timer.start()
+            self.step(inputs[i] if i < len(inputs) else {})
+            if self.winner is not None:
+                return i + 1
+        return ticks
+
+    def step(self, inputs: Mapping[int, tuple[set, int]]) -> None:
+        """
+        Advance the game by one tick.
+
+        inputs maps client ids to the (actions, seq) of their newest REQUEST.
+        """
+        for client_id, (actions, seq) in inputs.items():
+            # the tank may have been destroyed since the REQUEST was sent
+            if client_id in self.tanks:
+                self.tanks[client_id].update_actions(actions, seq)
+        self.timer.lap("inputs")
+
+        self.collisions()
+        self.timer.lap("collisions")
+        for client_id, tank in self.tanks.items():
+            # tank.tick() returns whether a network update is necessary
+            if tank.tick(TICK_LENGTH):
+                # dead tanks are kept here until their final state is sent
+                self.changed_tanks[client_id] = tank
+        self.timer.lap("tanks")
+
+        for shell in self.shells:
+            shell.step(TICK_LENGTH)
+        for mine in self.mines:
+            mine.step(TICK_LENGTH)
+        self.timer.lap("projectiles")
+        # remove objects with .alive = False
+        self.tanks = {client_id: tank for client_id, tank in self.tanks.items() if tank.alive}
+        self.mines = [m for m in self.mines if m.alive]
+        self.shells = [s for s in self.shells if s.alive]
+        self.history.record(self.tick, self.tanks)
+
+        # check for a winner
+        if not self.debug and len(self.tanks) == 1 and self.winner is None:
+            self.winner = tuple(self.tanks.values())[0]
+
+        self.tick += 1
+        self.sim_time += TICK_LENGTH
+        self.timer.lap("pruning")
+
+    def collisions(self) -> None:
+        """Check for and handle all shape collisions."""
+        tanks = list(self.tanks.values())
+        # tanks only move in here, they don't turn
+        bouts = [tank.bout for tank in tanks]
+
+        def tank_poses() -> np.ndarray:
+            return np.array([tank.pos for tank in tanks]).reshape(-1, 3)
+
+        # Pairs of objects that are far apart can't collide, so the exact checks only
+        # run for pairs that within() finds close enough, plus tanks that have been
+        # pushed since it ran.
+
+        # tank-tank collisions
+        # this should be first in case the tank back up causes another collision
+        near = collisions.within(tank_poses(), tank_poses(), 2 * collisions.TANK_BOUND)
+        moved: set[int] = set()
+        already_checked: list[set[Tank, Tank]] = []
+        for i, tank1 in enumerate(tanks):
+            for j, tank2 in enumerate(tanks):
+                if i == j or not (near[i, j] or i in moved or j in moved):
+                    continue
+                pair = {tank1, tank2}
+                if pair in already_checked:
+                    continue
+                if collisions.collide_tank_tank(tank1.pos, tank2.pos, bouts[i], bouts[j]):
+                    self.tanks_collided(tank1, tank2)
+
+                    # move the tanks away from each other
+                    away = (
+                        utils_3d.normalize(tank1.pos - tank2.pos)
+                        * constants.Tank.COLLISION_SPRINGBACK
+                    )
+                    tank1.pos += away
+                    tank2.pos -= away
+                    tank1.speed = 0.0
+                    tank2.speed = 0.0
+                    already_checked.append(pair)
+                    tank1.set_needs_update()
+                    tank2.set_needs_update()
+                    moved |= {i, j}
+
+        near = collisions.within(
+            tank_poses(), self.hill_array, constants.Hill.RADIUS + collisions.TANK_BOUND
+        )
+        moved = set()
+        shell_poses = np.array([shell.pos for shell in self.shells]).reshape(-1, 3)
+        # same as collisions.collide_hill()
+        shell_hits = collisions.within(shell_poses, self.hill_array, constants.Hill.RADIUS)
+        # hills with anything close enough to hit them
+        busy = near.any(axis=0) | shell_hits.any(axis=0)
+        for h, hill_pos in enumerate(self.hill_poses):
+            if not (busy[h] or moved):
+                continue
+            # tank vs. hill
+            for i in sorted(set(np.flatnonzero(near[:, h])) | moved):
+                tank = tanks[i]
+                if collisions.collide_hill_tank(hill_pos, tank.pos, bouts[i]):
+                    # back up the tank away from the hill so they aren't permanently stuck
+                    tank.pos += (
+                        utils_3d.normalize(tank.pos - hill_pos) * constants.Hill.COLLIDE_DIST
+                    )
+                    tank.speed = 0.0
+                    tank.set_needs_update()
+                    moved.add(i)
+
+            # shell vs. hill
+            for s in np.flatnonzero(shell_hits[:, h]):
+                self.kill_shell(self.shells[s])
+
+        for shell in self.shells:
+            # remove shells exiting the playing area
+            if collisions.collide_shell_world(shell.pos, self.ground_hw):
+                self.kill_shell(shell)
+                break
+
+            # handle tank-shell collisions against the tanks as the shooter saw them;
+            # the newest row of self.history is the end of the previous tick
+            for client_id in self.history.hits(self.tick - 1 - shell.rewind, shell.pos):
+                # the tank may have been destroyed since
+                if client_id != shell.client_id and (tank := self.tanks.get(client_id)):
+                    tank.recv_hit(constants.Shell.DAMAGE)
+                    tank.set_needs_update()
+                    self.kill_shell(shell, False)
+
+        # tank vs. tree
+        # the clients knock trees over on their own, but world snapshots need to know
+        # which trees are down
+        if tanks and self.trees_standing.any():
+            standing = np.flatnonzero(self.trees_standing)
+            hits = collisions.collide_tanks_points(
+                tank_poses(), np.array(bouts), self.tree_array[standing]
+            )
+            for tank_index, tree_index in zip(*np.nonzero(hits)):
+                index = int(standing[tree_index])
+                if not self.trees_standing[index]:
+                    continue
+                tank = tanks[tank_index]
+                # same as shapes.Tree.fall()
+                falling = np.sign(tank.speed) * tank.bright
+                self.fallen_trees[index] = (falling[0], falling[2], tank.speed)
+                self.trees_standing[index] = False
+
+        # mine vs. tank
+        mine_poses = np.array([mine.pos for mine in self.mines]).reshape(-1, 3)
+        near = collisions.within(
+            mine_poses, tank_poses(), constants.Mine.RADIUS + collisions.TANK_BOUND
+        )
+        for m, mine in enumerate(self.mines):
+            for i in np.flatnonzero(near[m]):
+                tank = tanks[i]
+                if tank.client_id != mine.client_id and collisions.collide_tank_mine(
+                    tank.pos, mine.pos, bouts[i]
+                ):
+                    tank.recv_hit(constants.Mine.DAMAGE)
+                    tank.set_needs_update()
+                    self.kill_mine(mine)
+
+    def make_mine(self, client_id: int, pos: np.ndarray) -> None:
+        mine = HeadlessMine(client_id, self.next_mine_id, pos)
+        self.mines.append(mine)
+        self.next_mine_id += 1
+        self.mine_laid(mine)
+
+    def make_shell(self, angle: float, client_id: int, out: np.ndarray, pos: np.ndarray) -> None:
+        shell = HeadlessShell(client_id, self.next_shell_id, angle, out, pos)
+        # how many ticks to rewind the other tanks by when checking for hits
+        shell.rewind = self.rewind_ticks(client_id)
+        self.shells.append(shell)
+        self.next_shell_id += 1
+        self.shell_fired(shell)
+
+    def kill_mine(self, mine: HeadlessMine) -> None:
+        mine.die()
+        self.mine_died(mine)
+
+    def kill_shell(self, shell: HeadlessShell, explo: bool = True) -> None:
+        """Remove a shell; explo is False if it hit a tank instead of the ground or a hill."""
+        shell.die()
+        self.shell_died(shell, explo)
+
+    # hooks for subclasses
+
+    def rewind_ticks(self, client_id: int) -> int:
+        """Return how many ticks back the shells of client_id are checked for hits."""
+        return 0
+
+    def tanks_collided(self, tank1: Tank, tank2: Tank) -> None:
+        pass
+
+    def mine_laid(self, mine: HeadlessMine) -> None:
+        pass
+
+    def mine_died(self, mine: HeadlessMine) -> None:
+        pass
+
+    def shell_fired(self, shell: HeadlessShell) -> None:
+        pass
+
+    def shell_died(self, shell: HeadlessShell, explo: bool) -> None:
+        pass
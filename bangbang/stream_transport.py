@@ -0,0 +1,90 @@
+"""
+Length-prefixed JSON frames over a plain TCP stream.
+
+This is a lighter alternative to websockets for LANs: there's no HTTP upgrade, no
+masking, and each frame costs only a 4-byte length header. StreamConnection mimics
+the parts of bbutils.BBClientProtocol and BBServerProtocol that the rest of the code
+uses.
+"""
+
+import asyncio
+import contextlib
+import json
+import struct
+
+import bbutils
+import constants
+
+# length of the frame that follows, in bytes
+LENGTH = struct.Struct("!I")
+
+
+class StreamConnection:
+    """One end of a length-prefixed TCP connection."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+        # set when either end closes the connection
+        self.closed = asyncio.Event()
+
+    async def send(self, message: bbutils.Message) -> None:
+        """Validate message, serialize it to JSON, and send it."""
+        bbutils.is_message_valid(message)
+        await self.send_serialized(json.dumps(message))
+
+    async def send_serialized(self, data: str, reliable: bool = True) -> None:
+        """
+        Send a message that has already been validated and serialized to JSON.
+
+        reliable is ignored; it is only there to match udp_transport.Channel.
+        """
+        payload = data.encode()
+        self.writer.write(LENGTH.pack(len(payload)) + payload)
+        # waits if the other end isn't reading fast enough
+        await self.writer.drain()
+
+    async def recv(self) -> str:
+        """Return the next message; raises EOFError once the connection is closed."""
+        try:
+            (length,) = LENGTH.unpack(await self.reader.readexactly(LENGTH.size))
+            if length > constants.MAX_FRAME_SIZE:
+                raise EOFError(f"frame of {length} bytes is too long")
+            return (await self.reader.readexactly(length)).decode()
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            self.closed.set()
+            raise EOFError from e
+
+    async def close(self) -> None:
+        self.closed.set()
+        self.writer.close()
+        with contextlib.suppress(ConnectionError):
+            await self.writer.wait_closed()
+
+    async def wait_closed(self) -> None:
+        await self.closed.wait()
+
+    @property
+    def remote_address(self) -> tuple:
+        return self.writer.get_extra_info("peername")
+
+    def __aiter__(self) -> "StreamConnection":
+        return self
+
+    async def __anext__(self) -> str:
+        try:
+            return await self.recv()
+        except EOFError:
+            await self.close()
+            raise StopAsyncIteration
+
+
+@contextlib.asynccontextmanager
+async def connect(host: str, port: int):
+    """Open a StreamConnection to host:port and close it when the block exits."""
+    reader, writer = await asyncio.open_connection(host, port)
+    connection = StreamConnection(reader, writer)
+    try:
+        yield connection
+    finally:
+        await connection.close()
@@ -0,0 +1,156 @@
+"""
+An opt-in timeline of what the server or client is doing, for chrome://tracing.
+
+After enable(), spans and flow events are recorded into a ring buffer that is
+allocated up front, so a long session keeps only its newest Tracing.CAPACITY events
+and recording one costs little more than building a tuple. Until then, call sites
+check tracing.enabled and skip all of it. write() saves the buffer in Chrome's trace
+event format, which chrome://tracing and https://ui.perfetto.dev open.
+
+Timestamps are wall-clock time, so the traces of a server and its clients on the
+same computer line up once merged:
+    python tracing.py -o merged.json server.json client.json
+
+Inputs can be followed from one process to another by their flow id,
+input_id(client_id, seq): the client starts the flow in the frame that sends the
+REQUEST, the server continues it when it receives the REQUEST and in the tick that
+applies it, and the client ends it when an APPROVE acknowledges it, right before the
+frame that shows the result. Server ticks are labelled with their tick number.
+"""
+
+import argparse
+import json
+import os
+import time
+
+import constants
+
+# whether events are being recorded; check this before doing any work for a trace
+enabled = False
+
+# the ring buffer of (phase, name, timestamp, duration, tid, args, id) events
+_events: list[tuple | None] = []
+# the number of events ever recorded; the next one goes in _events[_count % capacity]
+_count = 0
+# add to time.perf_counter() to get wall-clock time
+_offset = 0.0
+# metadata events, which are never overwritten
+_metadata: list[dict] = []
+_next_tid = 1
+
+
+def enable(process_name: str, capacity: int = constants.Tracing.CAPACITY) -> None:
+    """Start recording events, naming this process process_name in the trace."""
+    global enabled, _events, _count, _offset
+    _events = [None] * capacity
+    _count = 0
+    _offset = time.time() - time.perf_counter()
+    _metadata.append(_meta("process_name", 0, process_name))
+    _metadata.append(_meta("thread_name", 0, "main"))
+    enabled = True
+
+
+def _meta(kind: str, tid: int, name: str) -> dict:
+    return {"name": kind, "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+
+
+def _record(event: tuple) -> None:
+    global _count
+    _events[_count % len(_events)] = event
+    _count += 1
+
+
+def track(name: str) -> int:
+    """
+    Return the tid of a new track of the timeline called name.
+
+    Spans in a coroutine that awaits in the middle of them need a track of their own
+    so they don't overlap the spans of the rest of the event loop.
+    """
+    global _next_tid
+    if not enabled:
+        return 0
+    tid = _next_tid
+    _next_tid += 1
+    _metadata.append(_meta("thread_name", tid, name))
+    return tid
+
+
+def complete(name: str, start: float, end: float, tid: int = 0, **args) -> None:
+    """Record a span from start to end, both from time.perf_counter()."""
+    _record(("X", name, start, end - start, tid, args, None))
+
+
+def instant(name: str, tid: int = 0, **args) -> None:
+    """Record something that happened now."""
+    _record(("i", name, time.perf_counter(), None, tid, args, None))
+
+
+def flow(phase: str, flow_id: int, tid: int = 0) -> None:
+    """
+    Record the start ("s"), a step ("t"), or the end ("f") of the flow flow_id now.
+
+    The viewer draws an arrow through the spans that are open on tid at each of the
+    flow's events.
+    """
+    _record((phase, "input", time.perf_counter(), None, tid, None, flow_id))
+
+
+def input_id(client_id: int, seq: int) -> int:
+    """Return the flow id of the input with sequence number seq of client_id."""
+    return client_id << 32 | seq
+
+
+def events() -> list[dict]:
+    """Return the recorded events, oldest first, in the trace event format."""
+    capacity = len(_events)
+    if _count > capacity:
+        ring = _events[_count % capacity :] + _events[: _count % capacity]
+    else:
+        ring = _events[:_count]
+    pid = os.getpid()
+    out = list(_metadata)
+    for phase, name, timestamp, duration, tid, args, flow_id in ring:
+        event = {
+            "name": name,
+            "ph": phase,
+            "ts": (timestamp + _offset) * 1e6,
+            "pid": pid,
+            "tid": tid,
+        }
+        if duration is not None:
+            event["dur"] = duration * 1e6
+        if args:
+            event["args"] = args
+        if flow_id is not None:
+            event["id"] = flow_id
+            event["cat"] = "input"
+            # attach the end to the span that is open at the time, not the next one
+            if phase == "f":
+                event["bp"] = "e"
+        if phase == "i":
+            event["s"] = "t"
+        out.append(event)
+    return out
+
+
+def write(path: str) -> None:
+    """Save the recorded events to path as JSON."""
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events(), "displayTimeUnit": "ms"}, f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Merge traces from the server and clients into one", prog="tracing"
+    )
+    parser.add_argument("traces", nargs="+", help="Traces written with --trace", metavar="FILE")
+    parser.add_argument("-o", "--output", required=True, help="Merged trace", metavar="FILE")
+    args = parser.parse_args()
+
+    merged = []
+    for path in args.traces:
+        with open(path) as f:
+            merged += json.load(f)["traceEvents"]
+    with open(args.output, "w") as f:
+        json.dump({"traceEvents": merged, "displayTimeUnit": "ms"}, f)
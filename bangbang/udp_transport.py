@@ -0,0 +1,268 @@
+"""
+A UDP alternative to sending game traffic over the websocket.
+
+Connection setup still happens over the websocket: the server puts a token in its ID
+message, and the client proves it owns that token with a HELLO datagram. After that,
+APPROVE messages travel on an unreliable channel where late packets are simply
+dropped (a newer state is always on its way), and every other message travels on a
+reliable channel that acknowledges, resends, and reorders packets. So do APPROVEs
+that hide, show or destroy a tank, which are never sent again, and the APPROVE with
+every tank a client can see that the server sends every Udp.REFRESH_INTERVAL in case
+a tank's last change was lost. Messages too big
+for a datagram, and everything sent after the other end has stopped answering, go
+over the websocket instead.
+
+Channel mimics the parts of bbutils.BBClientProtocol and BBServerProtocol that the
+rest of the code uses, so it can be used in place of a websocket connection.
+"""
+
+import asyncio
+from collections.abc import Callable
+import enum
+import json
+import logging
+import struct
+import time
+
+import bbutils
+import constants
+
+# packet type, sequence number
+HEADER = struct.Struct("!BI")
+
+
+@enum.unique
+class Packet(enum.IntEnum):
+    """Enum for datagram types."""
+
+    ACK = enum.auto()         # acknowledges a RELIABLE packet
+    HELLO = enum.auto()       # client sends its token; server echoes it back
+    RELIABLE = enum.auto()    # message that must arrive, in order
+    UNRELIABLE = enum.auto()  # message that is worthless once a newer one exists
+
+
+class Channel(constants.Udp):
+    """One end of a UDP connection."""
+
+    def __init__(self, transport: asyncio.DatagramTransport, addr: tuple | None) -> None:
+        self.transport = transport
+        # None if the transport is already connected to the other end
+        self.addr = addr
+        # the websocket connection, for messages the channel can't carry
+        self.fallback = None
+
+        # received messages, in order; None means the channel was closed
+        self.inbox: asyncio.Queue[str | None] = asyncio.Queue()
+        self.closed = False
+
+        # unreliable channel
+        self.next_unreliable_seq = 0
+        self.last_unreliable_seq = -1
+
+        # reliable channel
+        self.next_reliable_seq = 0
+        # sequence number of the next packet to deliver to inbox
+        self.expected_seq = 0
+        # payloads of packets received ahead of expected_seq, indexed by seq
+        self.out_of_order: dict[int, str] = {}
+        # packets the other end hasn't acknowledged: seq -> (packet, time last sent,
+        # times resent)
+        self.unacked: dict[int, tuple[bytes, float, int]] = {}
+        # set while fewer than WINDOW packets are unacknowledged
+        self.window_open = asyncio.Event()
+        self.window_open.set()
+        # set while every packet has been acknowledged
+        self.all_acked = asyncio.Event()
+        self.all_acked.set()
+
+        self.resend_task = asyncio.create_task(self.resend_loop())
+
+    async def send(self, message: bbutils.Message) -> None:
+        """Validate message, serialize it to JSON, and send it on the right channel."""
+        bbutils.is_message_valid(message)
+        await self.send_serialized(
+            json.dumps(message), reliable=message["type"] != constants.Msg.APPROVE
+        )
+
+    async def send_serialized(self, data: str, reliable: bool = True) -> None:
+        """Send a message that has already been validated and serialized to JSON."""
+        payload = data.encode()
+        if reliable:
+            # waiting here is what gives the reliable channel backpressure
+            while len(self.unacked) >= self.WINDOW and not self.closed:
+                self.window_open.clear()
+                await self.window_open.wait()
+
+        if self.closed or HEADER.size + len(payload) > self.MAX_DATAGRAM:
+            if self.fallback is None:
+                raise ConnectionError("UDP channel is closed or the message is too big")
+            if reliable:
+                # let the reliable messages sent before this one arrive first
+                await self.all_acked.wait()
+            await self.fallback.send_serialized(data, reliable)
+            return
+
+        if reliable:
+            seq = self.next_reliable_seq
+            self.next_reliable_seq += 1
+            packet = HEADER.pack(Packet.RELIABLE, seq) + payload
+            self.unacked[seq] = (packet, time.monotonic(), 0)
+            self.all_acked.clear()
+        else:
+            seq = self.next_unreliable_seq
+            self.next_unreliable_seq += 1
+            packet = HEADER.pack(Packet.UNRELIABLE, seq) + payload
+        self.transport.sendto(packet, self.addr)
+
+    def packet_received(self, kind: int, seq: int, payload: bytes) -> None:
+        """Handle a datagram addressed to this channel."""
+        match kind:
+            case Packet.UNRELIABLE:
+                # drop anything older than what we already have
+                if seq > self.last_unreliable_seq:
+                    self.last_unreliable_seq = seq
+                    self.inbox.put_nowait(payload.decode())
+
+            case Packet.RELIABLE:
+                # the other end never has more than WINDOW packets unacknowledged, so
+                # this is bogus; don't acknowledge it or keep it around
+                if seq >= self.expected_seq + self.WINDOW:
+                    return
+                # always acknowledge, even duplicates, in case the first ACK was lost
+                self.transport.sendto(HEADER.pack(Packet.ACK, seq), self.addr)
+                if seq >= self.expected_seq:
+                    self.out_of_order[seq] = payload.decode()
+                while self.expected_seq in self.out_of_order:
+                    self.inbox.put_nowait(self.out_of_order.pop(self.expected_seq))
+                    self.expected_seq += 1
+
+            case Packet.ACK:
+                self.unacked.pop(seq, None)
+                if len(self.unacked) < self.WINDOW:
+                    self.window_open.set()
+                if not self.unacked:
+                    self.all_acked.set()
+
+    async def resend_loop(self) -> None:
+        """Resend reliable packets that haven't been acknowledged in time."""
+        while True:
+            await asyncio.sleep(self.RESEND_INTERVAL)
+            now = time.monotonic()
+            for seq, (packet, sent, resends) in tuple(self.unacked.items()):
+                if now - sent < self.RESEND_TIMEOUT:
+                    continue
+                if resends >= self.MAX_RESENDS:
+                    logging.warning(
+                        f"no ACK after {resends} resends; giving up on UDP to {self.addr}"
+                    )
+                    self.close()
+                    return
+                self.transport.sendto(packet, self.addr)
+                self.unacked[seq] = (packet, now, resends + 1)
+
+    def close(self) -> None:
+        """
+        Stop resending and end any iteration over the channel.
+
+        Messages sent from now on go over the fallback, if there is one.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.resend_task.cancel()
+        self.unacked.clear()
+        # release any senders waiting for room or for ACKs
+        self.window_open.set()
+        self.all_acked.set()
+        self.inbox.put_nowait(None)
+
+    def __aiter__(self) -> "Channel":
+        return self
+
+    async def __anext__(self) -> str:
+        message = await self.inbox.get()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+
+def _parse(data: bytes) -> tuple[int, int, bytes] | None:
+    """Split a datagram into (kind, seq, payload), or return None if it is malformed."""
+    if len(data) < HEADER.size:
+        return None
+    kind, seq = HEADER.unpack_from(data)
+    return kind, seq, data[HEADER.size :]
+
+
+class ServerEndpoint(asyncio.DatagramProtocol):
+    """The server's UDP socket, shared by all clients."""
+
+    def __init__(self, attach: Callable[[str, Channel], bool]) -> None:
+        # attach(token, channel) returns whether token belongs to a connected client
+        self.attach = attach
+        # Channels indexed by client address
+        self.channels: dict[tuple, Channel] = {}
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        if (parsed := _parse(data)) is None:
+            return
+        kind, seq, payload = parsed
+
+        if kind == Packet.HELLO:
+            if addr not in self.channels:
+                channel = Channel(self.transport, addr)
+                if not self.attach(payload.decode(errors="replace"), channel):
+                    channel.close()
+                    logging.debug(f"ignored HELLO with unknown token from {addr}")
+                    return
+                self.channels[addr] = channel
+            # echo the HELLO so the client knows it's connected
+            self.transport.sendto(data, addr)
+        elif addr in self.channels:
+            self.channels[addr].packet_received(kind, seq, payload)
+
+    def detach(self, channel: Channel) -> None:
+        """Forget a channel and close it."""
+        self.channels.pop(channel.addr, None)
+        channel.close()
+
+
+class ClientEndpoint(asyncio.DatagramProtocol):
+    """The client's UDP socket, connected to the server."""
+
+    def __init__(self) -> None:
+        # set once the server has echoed our HELLO
+        self.hello_received = asyncio.Event()
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        self.channel = Channel(transport, None)
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        if (parsed := _parse(data)) is None:
+            return
+        kind, seq, payload = parsed
+        if kind == Packet.HELLO:
+            self.hello_received.set()
+        else:
+            self.channel.packet_received(kind, seq, payload)
+
+
+async def connect(host: str, port: int, token: str) -> Channel:
+    """Open a UDP channel to the server; raises ConnectionError if it doesn't answer."""
+    transport, endpoint = await asyncio.get_running_loop().create_datagram_endpoint(
+        ClientEndpoint, remote_addr=(host, port)
+    )
+    hello = HEADER.pack(Packet.HELLO, 0) + token.encode()
+    for _ in range(constants.Udp.HELLO_ATTEMPTS):
+        transport.sendto(hello)
+        try:
+            await asyncio.wait_for(endpoint.hello_received.wait(), constants.Udp.HELLO_INTERVAL)
+        except TimeoutError:
+            continue
+        return endpoint.channel
+    endpoint.channel.close()
+    transport.close()
+    raise ConnectionError(f"no answer from UDP port {port}")
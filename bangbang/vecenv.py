@@ -0,0 +1,433 @@
+"""
+Thousands of small matches stepped at once, for bot training and balance sweeps.
+
+VecEnv holds K independent matches of P players each in stacked NumPy arrays and
+advances all of them by one tick per step(), from a (K, P) array of action bitmasks
+with bit 1 << action set for every constants.Action held (see
+world_snapshot.pack_actions()).
+
+The rules are those of simulation.Simulation, with the changes that let every match
+be handled at once:
+
+- Everything happens on the ground plane. There are no trees since they don't
+  affect play.
+- Shells hit tanks where they are, without lag compensation.
+- Collisions found on the same tick are resolved together, not one after another.
+- Each tank has a fixed number of shell and mine slots. Firing into a slot that is
+  still in use replaces the oldest shell or mine, which with the normal reload
+  times has always gone by then.
+
+A match is done once at most one tank is left. Done matches stay as they are until
+they are passed to reset().
+"""
+
+import math
+
+import numpy as np
+
+import constants
+import mapgen
+
+# seconds of game time per tick, as in simulation.py
+TICK_LENGTH = 1 / constants.TICK_RATE
+
+# keys of the dicts of (K, P) arrays returned by step()
+EVENTS = (
+    "fired",    # shells fired
+    "laid",     # mines laid
+    "dealt",    # damage done to other tanks
+    "damage",   # damage taken
+    "died",     # destroyed on this tick
+)
+
+
+def _snap(target: np.ndarray, approaching: np.ndarray, incr: float) -> tuple[np.ndarray]:
+    """HeadlessTank.snap_logic() for arrays of angles."""
+    diff = approaching - target
+    # the sign of the increment
+    direction = (diff < 0).astype(float) - (diff > 0)
+    diff = np.abs(diff)
+    # always choose the shortest path
+    wrap = diff > 180.0
+    diff = np.where(wrap, 360 - diff, diff)
+    direction = np.where(wrap, -direction, direction)
+    done = diff <= incr
+    return np.where(done, diff, incr) * direction, ~done
+
+
+def _out(angle: np.ndarray) -> np.ndarray:
+    """Return the (x, z) of the out vector of each angle, like HeadlessTank.bout."""
+    radians = np.radians(angle)
+    return np.stack((np.sin(radians), np.cos(radians)), axis=-1)
+
+
+def _spheres(pos: np.ndarray, bout: np.ndarray) -> np.ndarray:
+    """collisions.tank_collision_spheres() with the spheres along axis -2."""
+    return np.stack(
+        (
+            pos,
+            pos - bout * constants.Tank.COLLISION_SPHERE_BACK,
+            pos + bout * constants.Tank.COLLISION_SPHERE_FRONT,
+        ),
+        axis=-2,
+    )
+
+
+def _squared(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Return the squared distances between the (x, z) points of a and b."""
+    return (a[..., 0] - b[..., 0]) ** 2 + (a[..., 1] - b[..., 1]) ** 2
+
+
+def _normalize(v: np.ndarray) -> np.ndarray:
+    """utils_3d.normalize() along the last axis."""
+    length = np.sqrt((v**2).sum(axis=-1, keepdims=True))
+    return np.divide(v, length, out=np.zeros_like(v), where=length > 0)
+
+
+class VecEnv:
+    """K matches of P players each, stepped together."""
+
+    def __init__(self, matches: int, players: int, seed: int = 0) -> None:
+        if matches < 1 or players < 1:
+            raise ValueError("need at least one match and one player")
+        self.matches = matches
+        self.players = players
+        self.rng = np.random.default_rng(seed)
+
+        # the same map size as Simulation.new_game() makes for this many players
+        ground_area = constants.AREA_PER_PLAYER * players
+        self.ground_hw = int(round(math.sqrt(ground_area) / 2))
+        self.hill_count = int(round(ground_area / constants.AREA_PER_HILL))
+
+        # enough slots that a shell is out of the world before its slot comes around
+        # again; shells can be a little faster than Shell.SPEED when fired on the move
+        flight = 2 * math.sqrt(2) * self.ground_hw / constants.Shell.SPEED
+        self.shell_slots = math.ceil(1.5 * flight / constants.Shell.RELOAD_TIME) + 1
+        self.mine_slots = math.ceil(constants.Mine.LIFETIME / constants.Mine.RELOAD_TIME) + 1
+
+        k, p = matches, players
+        self.hills = np.zeros((k, self.hill_count, 2))
+        self.pos = np.zeros((k, p, 2))
+        self.bangle = np.zeros((k, p))
+        self.tangle = np.zeros((k, p))
+        self.speed = np.zeros((k, p))
+        self.health = np.zeros((k, p), dtype=np.int64)
+        self.alive = np.zeros((k, p), dtype=bool)
+        self.snapping_back = np.zeros((k, p), dtype=bool)
+        self.turning_back = np.zeros((k, p), dtype=bool)
+        # game times of the last mine and shell
+        self.mine_reloading = np.zeros((k, p))
+        self.shell_reloading = np.zeros((k, p))
+
+        self.shell_pos = np.zeros((k, p, self.shell_slots, 2))
+        self.shell_out = np.zeros((k, p, self.shell_slots, 2))
+        self.shell_alive = np.zeros((k, p, self.shell_slots), dtype=bool)
+        # slot the next shell of each tank goes in
+        self.next_shell = np.zeros((k, p), dtype=np.int64)
+        self.mine_pos = np.zeros((k, p, self.mine_slots, 2))
+        self.mine_age = np.zeros((k, p, self.mine_slots))
+        self.mine_alive = np.zeros((k, p, self.mine_slots), dtype=bool)
+        self.next_mine = np.zeros((k, p), dtype=np.int64)
+
+        self.tick = np.zeros(k, dtype=np.int64)
+        self.sim_time = np.zeros(k)
+        self.done = np.zeros(k, dtype=bool)
+        # index of the last tank standing, or -1
+        self.winner = np.full(k, -1)
+
+        self.reset()
+
+    def reset(self, which: np.ndarray | None = None) -> dict[str, np.ndarray]:
+        """
+        Start new matches in place of the ones where which is True, or all of them.
+
+        Returns the observation of every match; see observe().
+        """
+        if which is None:
+            which = np.ones(self.matches, dtype=bool)
+        for i in np.flatnonzero(which):
+            hill_poses, _ = mapgen.generate(
+                int(self.rng.integers(1 << 63)), self.ground_hw, self.hill_count, 0
+            )
+            hills = np.array(hill_poses).reshape(-1, 3)[:, (0, 2)]
+            self.hills[i] = hills
+            # the same rules as Simulation.new_game()
+            for p in range(self.players):
+                while True:
+                    pos = self.rng.uniform(-self.ground_hw, self.ground_hw, 2)
+                    # can't be hitting a hill or too close to a tank
+                    hill_squared = ((hills - pos) ** 2).sum(axis=1)
+                    tank_squared = ((self.pos[i, :p] - pos) ** 2).sum(axis=1)
+                    if (hill_squared >= constants.Hill.RADIUS**2).all() and (
+                        tank_squared >= constants.MIN_SPAWN_DIST**2
+                    ).all():
+                        break
+                self.pos[i, p] = pos
+
+        angles = self.rng.uniform(0, 360, (np.count_nonzero(which), self.players))
+        self.bangle[which] = angles
+        self.tangle[which] = angles
+        self.speed[which] = 0.0
+        self.health[which] = constants.Tank.INITIAL_HEALTH
+        self.alive[which] = True
+        self.snapping_back[which] = False
+        self.turning_back[which] = False
+        self.mine_reloading[which] = -constants.Mine.RELOAD_TIME
+        self.shell_reloading[which] = -constants.Shell.RELOAD_TIME
+        self.shell_alive[which] = False
+        self.mine_alive[which] = False
+        self.tick[which] = 0
+        self.sim_time[which] = 0.0
+        self.done[which] = False
+        self.winner[which] = -1
+        return self.observe()
+
+    def observe(self) -> dict[str, np.ndarray]:
+        """
+        Return copies of what the players can see, as (K, P, ...) arrays.
+
+        Reload times are the seconds left until the tank can fire again.
+        """
+        clock = self.sim_time[:, np.newaxis]
+        return {
+            "pos": self.pos.copy(),
+            "bangle": self.bangle.copy(),
+            "tangle": self.tangle.copy(),
+            "speed": self.speed.copy(),
+            "health": self.health.copy(),
+            "alive": self.alive.copy(),
+            "mine_reload": np.maximum(
+                self.mine_reloading + constants.Mine.RELOAD_TIME - clock, 0.0
+            ),
+            "shell_reload": np.maximum(
+                self.shell_reloading + constants.Shell.RELOAD_TIME - clock, 0.0
+            ),
+        }
+
+    def step(
+        self, actions: np.ndarray
+    ) -> tuple[dict[str, np.ndarray], dict[str, np.ndarray], np.ndarray]:
+        """
+        Advance every match that isn't done by one tick.
+
+        Returns the observation (see observe()), the EVENTS of this tick as (K, P)
+        arrays, and which matches are done.
+        """
+        actions = np.asarray(actions)
+        if actions.shape != (self.matches, self.players):
+            raise ValueError(f"expected actions of shape {(self.matches, self.players)}")
+        live = ~self.done
+        # tanks that take part in this tick
+        active = self.alive & live[:, np.newaxis]
+        events = {name: np.zeros((self.matches, self.players), dtype=np.int64) for name in EVENTS}
+
+        self._collide(active, events)
+        self.health -= events["damage"]
+        died = active & (self.health <= 0)
+        events["died"] = died.astype(np.int64)
+        self.alive &= ~died
+        active &= ~died
+
+        self._move(actions, active)
+        self._fire(actions, active, events)
+
+        shells = self.shell_alive & live[:, np.newaxis, np.newaxis]
+        self.shell_pos += (
+            self.shell_out * constants.Shell.SPEED * TICK_LENGTH * shells[..., np.newaxis]
+        )
+        self.mine_age += TICK_LENGTH * live[:, np.newaxis, np.newaxis]
+        self.mine_alive &= self.mine_age < constants.Mine.LIFETIME
+
+        self.tick += live
+        self.sim_time += TICK_LENGTH * live
+
+        if self.players > 1:
+            left = self.alive.sum(axis=1)
+            ended = live & (left <= 1)
+            self.done |= ended
+            self.winner = np.where(ended & (left == 1), self.alive.argmax(axis=1), self.winner)
+        return self.observe(), events, self.done.copy()
+
+    def _collide(self, active: np.ndarray, events: dict[str, np.ndarray]) -> None:
+        """Simulation.collisions() for every match at once."""
+        p = self.players
+        bout = _out(self.bangle)
+
+        # tank vs. tank
+        spheres = _spheres(self.pos, bout)
+        # (K, P, P, spheres, spheres)
+        squared = _squared(
+            spheres[:, :, np.newaxis, :, np.newaxis], spheres[:, np.newaxis, :, np.newaxis]
+        )
+        hit = (
+            (squared < (2 * constants.Tank.RADIUS) ** 2).any(axis=(3, 4))
+            & active[:, :, np.newaxis]
+            & active[:, np.newaxis, :]
+            & ~np.eye(p, dtype=bool)
+        )
+        if hit.any():
+            away = _normalize(self.pos[:, :, np.newaxis] - self.pos[:, np.newaxis, :])
+            self.pos += (away * hit[..., np.newaxis]).sum(axis=2) * (
+                constants.Tank.COLLISION_SPRINGBACK
+            )
+            self.speed[hit.any(axis=2)] = 0.0
+
+        # tank vs. hill
+        spheres = _spheres(self.pos, bout)
+        # (K, P, hills)
+        hit = (
+            _squared(spheres[:, :, :, np.newaxis], self.hills[:, np.newaxis, np.newaxis])
+            < (constants.Hill.RADIUS + constants.Tank.RADIUS) ** 2
+        ).any(axis=2) & active[..., np.newaxis]
+        if hit.any():
+            away = _normalize(self.pos[:, :, np.newaxis] - self.hills[:, np.newaxis])
+            self.pos += (away * hit[..., np.newaxis]).sum(axis=2) * constants.Hill.COLLIDE_DIST
+            self.speed[hit.any(axis=2)] = 0.0
+            spheres = _spheres(self.pos, bout)
+
+        # few shell and mine slots are in use at a time, so only those are checked
+        live = ~self.done[:, np.newaxis, np.newaxis]
+        match, tank, slot = np.nonzero(self.shell_alive & live)
+        pos = self.shell_pos[match, tank, slot]
+        # shells vs. hills and the edge of the world; shells fly START_HEIGHT up
+        dead = (
+            _squared(pos[:, np.newaxis], self.hills[match]) + constants.Shell.START_HEIGHT**2
+            < constants.Hill.RADIUS**2
+        ).any(axis=1)
+        dead |= (np.abs(pos) > self.ground_hw).any(axis=1)
+        # shells vs. tanks, (shells, P)
+        hit = (
+            _squared(pos[:, np.newaxis, np.newaxis], spheres[match]) < constants.Tank.RADIUS**2
+        ).any(axis=2)
+        hit &= active[match] & (tank[:, np.newaxis] != np.arange(p)) & ~dead[:, np.newaxis]
+        self._hits(hit, match, tank, constants.Shell.DAMAGE, events)
+        self.shell_alive[match, tank, slot] = ~(dead | hit.any(axis=1))
+
+        # mines vs. tanks
+        match, tank, slot = np.nonzero(self.mine_alive & live)
+        pos = self.mine_pos[match, tank, slot]
+        hit = (
+            _squared(pos[:, np.newaxis, np.newaxis], spheres[match])
+            < (constants.Tank.RADIUS + constants.Mine.RADIUS) ** 2
+        ).any(axis=2)
+        hit &= active[match] & (tank[:, np.newaxis] != np.arange(p))
+        self._hits(hit, match, tank, constants.Mine.DAMAGE, events)
+        self.mine_alive[match, tank, slot] = ~hit.any(axis=1)
+
+    def _hits(
+        self,
+        hit: np.ndarray,
+        match: np.ndarray,
+        owner: np.ndarray,
+        damage: int,
+        events: dict[str, np.ndarray],
+    ) -> None:
+        """Add up the damage of hit[i, tank], the hits of a shell or mine i."""
+        i, tank = np.nonzero(hit)
+        np.add.at(events["damage"], (match[i], tank), damage)
+        np.add.at(events["dealt"], (match[i], owner[i]), damage)
+
+    def _move(self, actions: np.ndarray, active: np.ndarray) -> None:
+        """HeadlessTank.step() for every active tank at once."""
+        Action = constants.Action
+        Tank = constants.Tank
+
+        def held(action: constants.Action) -> np.ndarray:
+            return (actions >> action) & 1 == 1
+
+        speed = self.speed
+        snapping = self.snapping_back.copy()
+        turning = self.turning_back.copy()
+        ip_bangle = np.zeros_like(speed)
+        ip_tangle = np.zeros_like(speed)
+
+        speed = np.where(
+            held(Action.ACCEL), np.minimum(speed + Tank.ACC * TICK_LENGTH, Tank.MAX_SPEED), speed
+        )
+        for action, direction in ((Action.ALL_LEFT, 1), (Action.ALL_RIGHT, -1)):
+            pressed = held(action)
+            turning &= ~pressed
+            snapping &= ~pressed
+            ip_bangle = np.where(pressed, direction * Tank.BROTATE, ip_bangle)
+            ip_tangle = np.where(pressed, direction * Tank.BROTATE, ip_tangle)
+        for action, direction in ((Action.BASE_LEFT, 1), (Action.BASE_RIGHT, -1)):
+            pressed = held(action)
+            # cancel turning back upon manual turn
+            turning &= ~pressed
+            ip_bangle = np.where(pressed, direction * Tank.BROTATE, ip_bangle)
+        speed = np.where(
+            held(Action.DEACCEL), np.maximum(speed - Tank.ACC * TICK_LENGTH, Tank.MIN_SPEED), speed
+        )
+        turning |= held(Action.TURN_BACK)
+        for action, direction in ((Action.TURRET_LEFT, 1), (Action.TURRET_RIGHT, -1)):
+            pressed = held(action)
+            # cancel snapping back upon manual turn
+            snapping &= ~pressed
+            ip_tangle = np.where(pressed, direction * Tank.TROTATE, ip_tangle)
+        snapping |= held(Action.SNAP_BACK)
+        speed = np.where(held(Action.STOP) & (np.abs(speed) <= Tank.SNAP_STOP), 0.0, speed)
+
+        ip_tangle = np.where(snapping, ip_tangle, ip_tangle * TICK_LENGTH)
+        ip_bangle = np.where(turning, ip_bangle, ip_bangle * TICK_LENGTH)
+
+        # handle snapping/turning back
+        snap = snapping & (ip_tangle == 0.0)
+        incr, still = _snap(self.bangle, self.tangle, Tank.SNAP_SPEED * TICK_LENGTH)
+        ip_tangle = np.where(snap, incr, ip_tangle)
+        snapping = np.where(snap, still, snapping)
+        turn = turning & (ip_bangle == 0.0)
+        incr, still = _snap(self.tangle, self.bangle, Tank.BROTATE * TICK_LENGTH)
+        ip_bangle = np.where(turn, incr, ip_bangle)
+        turning = np.where(turn, still, turning)
+
+        bangle = (self.bangle + ip_bangle) % 360.0
+        tangle = (self.tangle + ip_tangle) % 360.0
+        pos = self.pos + _out(bangle) * (speed * TICK_LENGTH)[..., np.newaxis]
+        # ensure the tank does not go over the edge of the world
+        pos = np.clip(pos, -self.ground_hw, self.ground_hw)
+
+        self.bangle = np.where(active, bangle, self.bangle)
+        self.tangle = np.where(active, tangle, self.tangle)
+        self.speed = np.where(active, speed, self.speed)
+        self.snapping_back = np.where(active, snapping, self.snapping_back)
+        self.turning_back = np.where(active, turning, self.turning_back)
+        self.pos = np.where(active[..., np.newaxis], pos, self.pos)
+
+    def _fire(
+        self, actions: np.ndarray, active: np.ndarray, events: dict[str, np.ndarray]
+    ) -> None:
+        """Lay mines and fire shells like Tank.tick() in simulation.py."""
+        clock = self.sim_time[:, np.newaxis]
+
+        laying = (
+            active
+            & ((actions >> constants.Action.MINE) & 1 == 1)
+            & (clock >= self.mine_reloading + constants.Mine.RELOAD_TIME)
+        )
+        self.mine_reloading = np.where(laying, clock, self.mine_reloading)
+        match, tank = np.nonzero(laying)
+        slot = self.next_mine[match, tank]
+        self.mine_pos[match, tank, slot] = self.pos[match, tank]
+        self.mine_age[match, tank, slot] = 0.0
+        self.mine_alive[match, tank, slot] = True
+        self.next_mine[match, tank] = (slot + 1) % self.mine_slots
+        events["laid"] += laying
+
+        firing = (
+            active
+            & ((actions >> constants.Action.SHELL) & 1 == 1)
+            & (clock >= self.shell_reloading + constants.Shell.RELOAD_TIME)
+        )
+        self.shell_reloading = np.where(firing, clock, self.shell_reloading)
+        match, tank = np.nonzero(firing)
+        slot = self.next_shell[match, tank]
+        tout = _out(self.tangle[match, tank])
+        bout = _out(self.bangle[match, tank])
+        speed = self.speed[match, tank, np.newaxis]
+        self.shell_out[match, tank, slot] = tout + bout * speed / constants.Shell.SPEED
+        self.shell_pos[match, tank, slot] = (
+            self.pos[match, tank] + constants.Shell.START_DISTANCE * tout
+        )
+        self.shell_alive[match, tank, slot] = True
+        self.next_shell[match, tank] = (slot + 1) % self.shell_slots
+        events["fired"] += firing
@@ -0,0 +1,80 @@
+"""
+Notices when something blocks the event loop, and what.
+
+Watchdog.run() wakes up every Watchdog.INTERVAL and records how late it woke up in
+the bangbang_event_loop_lag_seconds histogram. Meanwhile a thread checks how long it
+has been since the coroutine last ran; once that is more than the threshold, the
+loop is stuck in synchronous code, so the thread logs the event loop thread's stack
+while that code is still running.
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+
+import constants
+import metrics
+
+
+class Watchdog(constants.Watchdog):
+    """Measures the lag of the running event loop; process labels the metrics."""
+
+    def __init__(self, process: str, threshold: float) -> None:
+        self.process = process
+        self.threshold = threshold
+        # for the percentiles in report()
+        self.lag = metrics.Distribution()
+        # time.perf_counter() when the coroutine last ran
+        self.last_beat = time.perf_counter()
+        # the last_beat of the stall that has already been logged
+        self.reported_beat: float | None = None
+        self.stopped = threading.Event()
+
+    async def run(self) -> None:
+        """Watch the event loop this is running on until cancelled."""
+        loop_thread = threading.get_ident()
+        thread = threading.Thread(
+            target=self.watch, args=(loop_thread,), name="watchdog", daemon=True
+        )
+        thread.start()
+        try:
+            while True:
+                self.last_beat = time.perf_counter()
+                await asyncio.sleep(self.INTERVAL)
+                lag = max(time.perf_counter() - self.last_beat - self.INTERVAL, 0.0)
+                metrics.EVENT_LOOP_LAG.observe(lag, process=self.process)
+                self.lag.observe(lag)
+                if lag > self.threshold:
+                    metrics.EVENT_LOOP_STALLS.inc(process=self.process)
+                    logging.warning(f"the event loop was blocked for {lag * 1000:.0f} ms")
+        finally:
+            self.stopped.set()
+
+    def watch(self, loop_thread: int) -> None:
+        """Log the stack of loop_thread whenever it stalls; runs in its own thread."""
+        while not self.stopped.wait(self.CHECK_INTERVAL):
+            beat = self.last_beat
+            stalled = time.perf_counter() - beat - self.INTERVAL
+            if stalled <= self.threshold or beat == self.reported_beat:
+                continue
+            self.reported_beat = beat
+            frame = sys._current_frames().get(loop_thread)
+            if frame is None:
+                continue
+            stack = "".join(traceback.format_stack(frame))
+            logging.warning(
+                f"the event loop has been blocked for {stalled * 1000:.0f} ms, "
+                f"currently in:\n{stack}"
+            )
+
+    def report(self) -> str:
+        """Return a summary of the lag so far."""
+        return (
+            f"Event loop lag: p50 {self.lag.percentile(50) * 1000:.1f} ms, "
+            f"p99 {self.lag.percentile(99) * 1000:.1f} ms, "
+            f"max {self.lag.max * 1000:.1f} ms, "
+            f"{metrics.EVENT_LOOP_STALLS.get(process=self.process):.0f} stall(s)"
+        )
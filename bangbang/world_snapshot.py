@@ -0,0 +1,271 @@
+"""
+Compact binary snapshots of the whole game world.
+
+A snapshot brings a client that joins or reconnects in the middle of a game up to
+date: the map parameters, every tank, live shell and mine, and the trees that have
+fallen. The live stream of messages takes over from there.
+
+encode() yields to the event loop every WorldSnapshot.CHUNK records so a big world
+doesn't hold up the tick loop, which means the world can change while a snapshot is
+being made. Anything that dies in the meantime is listed at the end of the snapshot
+and dropped by decode(); anything created in the meantime is sent to the client the
+usual way once it joins.
+
+All numbers are little-endian. Positions are stored as 32-bit floats, which is
+accurate to well under a millimeter on any map.
+"""
+
+import asyncio
+from collections.abc import Iterator
+import struct
+import zlib
+
+import constants
+
+# magic, format version, map version, server time, ground half width, map seed,
+# hill count, tree count, map checksum
+HEADER = struct.Struct("<4sBBdIQIII")
+MAGIC = b"BBWS"
+# increment whenever the format changes
+VERSION = 1
+
+COUNT = struct.Struct("<I")
+# client id, last applied REQUEST seq, action bitmask, health, x, z, bangle, tangle,
+# speed, color, length of the UTF-8 name that follows
+TANK = struct.Struct("<iiIh8fH")
+# shell id, owner, angle, unraised position, out vector, seconds since it was fired
+SHELL = struct.Struct("<Iif3f3ff")
+# mine id, owner, position, seconds since it was laid
+MINE = struct.Struct("<Ii3ff")
+# index into the map's tree list, direction of the fall (x, z), speed of the tank
+TREE = struct.Struct("<Ifff")
+ID = struct.Struct("<i")
+
+
+def pack_actions(actions) -> int:
+    mask = 0
+    for action in actions:
+        # anything else would set a bit unpack_actions() doesn't know, or raise
+        if isinstance(action, constants.Action):
+            mask |= 1 << action
+    return mask
+
+
+def unpack_actions(mask: int) -> list[constants.Action]:
+    return [action for action in constants.Action if mask & (1 << action)]
+
+
+def _records(
+    game: "server.Server", server_time: float, captured: list | None = None
+) -> Iterator[bytes]:
+    """
+    Yield the uncompressed snapshot of the game one record at a time.
+
+    If captured is given, the shells and mines in the snapshot are added to it.
+    """
+    params = game.map_params
+    yield HEADER.pack(
+        MAGIC,
+        VERSION,
+        params["version"],
+        server_time,
+        game.ground_hw,
+        params["seed"],
+        params["hills"],
+        params["trees"],
+        params["checksum"],
+    )
+
+    # copy the collections since they can change while encode() yields
+    tanks = list(game.tanks.items())
+    yield COUNT.pack(len(tanks))
+    for client_id, tank in tanks:
+        # the length has to fit in TANK
+        name = (tank.name or "").encode()[:0xFFFF]
+        yield TANK.pack(
+            client_id,
+            tank.last_seq,
+            pack_actions(tank.actions),
+            tank.health,
+            tank.pos[0],
+            tank.pos[2],
+            tank.bangle,
+            tank.tangle,
+            tank.speed,
+            *tank.color,
+            len(name),
+        ) + name
+
+    shells = list(game.shells)
+    if captured is not None:
+        captured += shells
+    yield COUNT.pack(len(shells))
+    for shell in shells:
+        yield SHELL.pack(
+            shell.shell_id,
+            shell.client_id,
+            shell.angle,
+            shell.pos[0],
+            shell.pos[1] - constants.Shell.START_HEIGHT,
+            shell.pos[2],
+            *shell.out,
+            shell.age,
+        )
+
+    mines = list(game.mines)
+    if captured is not None:
+        captured += mines
+    yield COUNT.pack(len(mines))
+    for mine in mines:
+        yield MINE.pack(mine.mine_id, mine.client_id, *mine.pos, mine.age)
+
+    fallen = list(game.fallen_trees.items())
+    yield COUNT.pack(len(fallen))
+    for index, (x, z, speed) in fallen:
+        yield TREE.pack(index, x, z, speed)
+
+    # whatever died while encode() was yielding
+    for removed in (
+        [client_id for client_id, tank in tanks if not tank.alive],
+        [shell.shell_id for shell in shells if not shell.alive],
+        [mine.mine_id for mine in mines if not mine.alive],
+    ):
+        yield COUNT.pack(len(removed)) + b"".join(ID.pack(i) for i in removed)
+
+
+async def encode(
+    game: "server.Server", server_time: float, captured: list | None = None
+) -> bytes:
+    """
+    Return a compressed snapshot of the game, made a few records at a time.
+
+    If captured is given, the shells and mines in the snapshot are added to it.
+    """
+    compressor = zlib.compressobj(constants.WorldSnapshot.COMPRESSION)
+    chunks: list[bytes] = []
+    # records packed since the last yield
+    pending = bytearray()
+    for written, record in enumerate(_records(game, server_time, captured), 1):
+        pending += record
+        if written % constants.WorldSnapshot.CHUNK == 0:
+            chunks.append(compressor.compress(pending))
+            pending = bytearray()
+            await asyncio.sleep(0)
+    chunks.append(compressor.compress(pending))
+    chunks.append(compressor.flush())
+    return b"".join(chunks)
+
+
+def pack(game: "server.Server", server_time: float, captured: list | None = None) -> bytes:
+    """
+    Return an uncompressed snapshot of the game, made all at once.
+
+    For callers that compress the snapshot elsewhere; see unpack(). If captured is
+    given, the shells and mines in the snapshot are added to it.
+    """
+    return b"".join(_records(game, server_time, captured))
+
+
+def decode(data: bytes) -> dict:
+    """
+    Return the contents of a snapshot made by encode().
+
+    Raises ValueError if data isn't a snapshot this version can read.
+    """
+    try:
+        raw = zlib.decompress(data)
+    except zlib.error as e:
+        raise ValueError("snapshot is corrupt") from e
+    return unpack(raw)
+
+
+def unpack(raw: bytes) -> dict:
+    """Return the contents of a snapshot made by pack(); see decode()."""
+    try:
+        (
+            magic,
+            version,
+            map_version,
+            server_time,
+            ground_hw,
+            seed,
+            hills,
+            trees,
+            checksum,
+        ) = HEADER.unpack_from(raw)
+    except struct.error as e:
+        raise ValueError("snapshot is truncated") from e
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a snapshot of a supported version")
+    offset = HEADER.size
+
+    def records(record: struct.Struct) -> list[tuple]:
+        nonlocal offset
+        (count,) = COUNT.unpack_from(raw, offset)
+        offset += COUNT.size
+        unpacked = list(record.iter_unpack(raw[offset : offset + count * record.size]))
+        offset += count * record.size
+        return unpacked
+
+    try:
+        tanks = []
+        (count,) = COUNT.unpack_from(raw, offset)
+        offset += COUNT.size
+        for _ in range(count):
+            client_id, ack, actions, health, x, z, bangle, tangle, speed, *rest = (
+                TANK.unpack_from(raw, offset)
+            )
+            offset += TANK.size
+            *color, name_length = rest
+            name = raw[offset : offset + name_length].decode(errors="replace")
+            offset += name_length
+            state = {
+                "actions": unpack_actions(actions),
+                "bangle": bangle,
+                "color": color,
+                "health": health,
+                "name": name,
+                "pos": (x, 0.0, z),
+                "speed": speed,
+                "tangle": tangle,
+            }
+            tanks.append((client_id, state, ack))
+
+        shells = [
+            {
+                "shell_id": shell_id,
+                "id": owner,
+                "angle": angle,
+                "pos": (x, y, z),
+                "out": (out_x, out_y, out_z),
+                "age": age,
+            }
+            for shell_id, owner, angle, x, y, z, out_x, out_y, out_z, age in records(SHELL)
+        ]
+        mines = [
+            {"mine_id": mine_id, "id": owner, "pos": (x, y, z), "age": age}
+            for mine_id, owner, x, y, z, age in records(MINE)
+        ]
+        fallen_trees = {index: (x, z, speed) for index, x, z, speed in records(TREE)}
+
+        dead_tanks = {i for (i,) in records(ID)}
+        dead_shells = {i for (i,) in records(ID)}
+        dead_mines = {i for (i,) in records(ID)}
+    except struct.error as e:
+        raise ValueError("snapshot is truncated") from e
+
+    return {
+        "time": server_time,
+        "ground_hw": ground_hw,
+        "map": {
+            "version": map_version,
+            "seed": seed,
+            "hills": hills,
+            "trees": trees,
+            "checksum": checksum,
+        },
+        "tanks": [t for t in tanks if t[0] not in dead_tanks],
+        "shells": [s for s in shells if s["shell_id"] not in dead_shells],
+        "mines": [m for m in mines if m["mine_id"] not in dead_mines],
+        "fallen_trees": fallen_trees,
+    }